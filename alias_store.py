@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS show_aliases (
+    ascap_name TEXT PRIMARY KEY,
+    bmi_name TEXT NOT NULL,
+    score REAL NOT NULL,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    matcher_version TEXT,
+    threshold REAL
+)
+"""
+
+# Bumped by every change to the aliases, so results can be keyed by the aliases they used
+REVISION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alias_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    revision INTEGER NOT NULL
+)
+"""
+
+# Added after the first release; older files get them on open (and their automatic aliases are not reused)
+ADDED_COLUMNS = {'matcher_version': 'TEXT', 'threshold': 'REAL'}
+
+class AliasStore:
+    """
+    Persisted mapping of ASCAP clean show names to BMI clean show names.
+
+    Every fuzzy match is recorded as an automatic alias with its score, the
+    matcher version and the threshold, so later runs of the same matcher
+    resolve the same show with a lookup instead of scoring it again.
+    Confirmed aliases are set by hand, apply to every run and are never
+    replaced by automatic ones. One SQLite file, opened per call so it can be
+    shared by job threads and worker processes.
+
+    Every change bumps revision(); changes counts the ones made through
+    this instance.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.changes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+            conn.execute(REVISION_SCHEMA)
+            conn.execute('INSERT OR IGNORE INTO alias_revision (id, revision) VALUES (1, 0)')
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(show_aliases)')}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    try:
+                        conn.execute(f'ALTER TABLE show_aliases ADD COLUMN {column} {column_type}')
+                    except sqlite3.OperationalError:
+                        pass  # Added by another process meanwhile
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # Commit on success, roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def revision(self):
+        """Number of changes made to the aliases so far, by any process"""
+        with self._connect() as conn:
+            return conn.execute('SELECT revision FROM alias_revision WHERE id = 1').fetchone()[0]
+
+    def _changed(self, conn, changes):
+        """Bump the revision in the same transaction as changes (a count of rows written)"""
+        if changes:
+            conn.execute('UPDATE alias_revision SET revision = revision + 1 WHERE id = 1')
+        return bool(changes)
+
+    def lookup(self, ascap_names, matcher_version=None, threshold=None):
+        """
+        {ascap_name: (bmi_name, score, confirmed)} for the names that have an
+        alias. Given a matcher version and threshold, automatic aliases are
+        only returned if they were recorded with both and score at least
+        the threshold.
+        """
+        ascap_names = list(ascap_names)
+        condition, params = '', []
+        if matcher_version is not None:
+            condition = ' AND (confirmed = 1 OR (matcher_version = ? AND threshold = ? AND score >= ?))'
+            params = [str(matcher_version), float(threshold), float(threshold)]
+        aliases = {}
+        with self._connect() as conn:
+            # Stay below SQLite's default limit of host parameters per statement
+            for start in range(0, len(ascap_names), 900):
+                batch = ascap_names[start:start + 900]
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(
+                    f'SELECT ascap_name, bmi_name, score, confirmed FROM show_aliases '
+                    f'WHERE ascap_name IN ({placeholders}){condition}',
+                    batch + params
+                )
+                for ascap_name, bmi_name, score, confirmed in rows:
+                    aliases[ascap_name] = (bmi_name, score, bool(confirmed))
+        return aliases
+
+    def record(self, matches, matcher_version, threshold):
+        """
+        Store automatic aliases from (ascap_name, bmi_name, score) tuples
+        found by a matcher version at a threshold, keeping confirmed ones
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # Aliases found again unchanged are left alone, so they do not bump the revision
+            cursor = conn.executemany(
+                """
+                INSERT INTO show_aliases (ascap_name, bmi_name, score, confirmed, updated_at, matcher_version, threshold)
+                VALUES (?, ?, ?, 0, ?, ?, ?)
+                ON CONFLICT(ascap_name) DO UPDATE SET
+                    bmi_name = excluded.bmi_name, score = excluded.score, updated_at = excluded.updated_at,
+                    matcher_version = excluded.matcher_version, threshold = excluded.threshold
+                WHERE show_aliases.confirmed = 0 AND (
+                    show_aliases.bmi_name IS NOT excluded.bmi_name OR show_aliases.score IS NOT excluded.score
+                    OR show_aliases.matcher_version IS NOT excluded.matcher_version
+                    OR show_aliases.threshold IS NOT excluded.threshold)
+                """,
+                [(ascap_name, bmi_name, float(score), now, str(matcher_version), float(threshold))
+                 for ascap_name, bmi_name, score in matches]
+            )
+            changed = self._changed(conn, cursor.rowcount)
+        self.changes += changed
+
+    def confirm(self, ascap_name, bmi_name, score=100):
+        """Set a confirmed alias, replacing any automatic one"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO show_aliases (ascap_name, bmi_name, score, confirmed, updated_at)
+                VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(ascap_name) DO UPDATE SET
+                    bmi_name = excluded.bmi_name, score = excluded.score,
+                    confirmed = 1, updated_at = excluded.updated_at
+                """,
+                (ascap_name, bmi_name, float(score), time.time())
+            )
+            changed = self._changed(conn, cursor.rowcount)
+        self.changes += changed
+
+    def remove(self, ascap_name):
+        """Forget the alias of a show so it goes through the matcher again"""
+        with self._connect() as conn:
+            cursor = conn.execute('DELETE FROM show_aliases WHERE ascap_name = ?', (ascap_name,))
+            changed = self._changed(conn, cursor.rowcount)
+        self.changes += changed
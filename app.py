@@ -1,34 +1,28 @@
-from flask import Flask, request, render_template, jsonify, send_file
+from flask import Flask, Response, request, stream_with_context, render_template, jsonify, send_file, send_from_directory, url_for, abort, g
 import os
 import json
-from compare_earnings import compare_earnings
+import threading
+import time
+from datetime import datetime
+from alias_store import AliasStore
+from parse_cache import ContentTooLarge, ParseCache, file_digest
+from result_store import SORT_COLUMNS, TABLES, ResultStore
+from resumable_upload import ResumableUploads, UploadError, parse_content_range
+from jobs import JobManager, JobQueueFull
+from instrumentation import RunProfile
+from metrics import SIZE_BUCKETS, MetricsRegistry
+from storage_backend import LocalStorageBackend, create_storage_backend
+from streaming_upload import ingest_multipart
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.exceptions import HTTPException
-from google.cloud import storage
 from config import *
-import tempfile
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Google Cloud Storage client with credentials from environment variable
-try:
-    credentials_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
-    if credentials_json:
-        logger.info("Using credentials from environment variable")
-        credentials_info = json.loads(credentials_json)
-        storage_client = storage.Client.from_service_account_info(credentials_info)
-    else:
-        logger.info("Using default credentials")
-        storage_client = storage.Client()
-    bucket = storage_client.bucket(GOOGLE_CLOUD_STORAGE_BUCKET)
-except Exception as e:
-    logger.error(f"Error initializing Google Cloud Storage: {str(e)}")
-    raise
-
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object('config')
@@ -36,91 +30,451 @@ app.wsgi_app = ProxyFix(app.wsgi_app)
 
 # Ensure upload directory exists for temporary files
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SPILL_DIR'], exist_ok=True)
+
+# Initialize the storage backend (Google Cloud Storage unless STORAGE_BACKEND=local)
+try:
+    storage = create_storage_backend(app.config)
+except Exception as e:
+    logger.error(f"Error initializing storage backend: {str(e)}")
+    raise
+
+# Parsed statements are cached by content hash so re-runs skip CSV parsing
+parse_cache = ParseCache(app.config['PARSE_CACHE_DIR'], app.config['PARSE_CACHE_MAX_BYTES'])
+
+# Show aliases from earlier fuzzy matches, so repeat catalogs resolve by lookup
+aliases = AliasStore(app.config['ALIAS_DB_PATH'])
+
+# Report rows of every comparison, queryable without downloading the workbook
+results = ResultStore(app.config['RESULT_DB_PATH'])
+
+# Statements sent as chunks, assembled on disk until both are complete
+resumable_uploads = ResumableUploads(app.config['RESUMABLE_UPLOAD_DIR'], app.config['MAX_CONTENT_LENGTH'],
+                                     app.config['UPLOAD_CHUNK_MAX_BYTES'],
+                                     max_decompressed_size=app.config['MAX_DECOMPRESSED_BYTES'])
+
+# Comparisons run in the background on a bounded pool; clients poll /jobs/<job_id>
+jobs = JobManager(app.config['JOB_STATE_DIR'], max_workers=app.config['JOB_WORKERS'],
+                  max_pending=app.config['MAX_PENDING_JOBS'])
+
+# How often a progress stream checks its job's state file
+PROGRESS_POLL_SECONDS = 0.5
+# Milliseconds the browser waits before reconnecting a progress stream that ended
+EVENT_STREAM_RETRY_MS = 1000
+event_stream_slots = threading.BoundedSemaphore(app.config['MAX_EVENT_STREAMS'])
+
+# Prometheus metrics, summed over the gunicorn workers through METRICS_DIR
+metrics = MetricsRegistry(app.config['METRICS_DIR'] or None)
+http_requests = metrics.counter('http_requests_total', 'HTTP requests', ['method', 'endpoint', 'status'])
+http_request_duration = metrics.histogram('http_request_duration_seconds', 'HTTP request latency', ['endpoint'])
+upload_bytes = metrics.counter('upload_bytes_total', 'Statement bytes received', ['pro'])
+upload_size = metrics.histogram('upload_file_size_bytes', 'Size of uploaded statements', ['pro'], buckets=SIZE_BUCKETS)
+comparisons = metrics.counter('comparison_jobs_total', 'Finished comparison jobs', ['status'])
+duplicate_submissions = metrics.counter('comparison_duplicates_total', 'Uploads answered by an existing comparison job')
+comparison_duration = metrics.histogram('comparison_duration_seconds', 'Comparison job run time')
+comparison_stage_duration = metrics.histogram('comparison_stage_duration_seconds', 'Comparison run time by stage', ['stage'])
+report_size = metrics.histogram('report_size_bytes', 'Size of generated Excel reports', buckets=SIZE_BUCKETS)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    if 'request_start' in g:
+        http_request_duration.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def run_comparison_job(ascap, bmi, key, alias_revision):
+    """
+    Run the comparison on ingested uploads and store the report; runs on the
+    job pool. key is None when the uploads were not hashed as they arrived;
+    alias_revision is the alias table's revision when the job was queued.
+    """
+    # pandas and the matcher load on the first job (or in the gunicorn master with --preload)
+    from compare_earnings import comparison_key, run_comparison
+
+    report_path = None
+    start = time.perf_counter()
+    # Stage transitions go to the job state, where /jobs/<job_id>/events picks them up
+    profile = RunProfile(listener=jobs.report_progress)
+    # Its own instance, to count the alias changes this run makes
+    job_aliases = AliasStore(aliases.path)
+    try:
+        if key is None:
+            with profile.stage('hash_inputs') as stage:
+                stage['bytes'] = ascap.size + bmi.size
+                for upload in [ascap, bmi]:
+                    upload.digest = file_digest(upload.path, max_size=app.config['MAX_DECOMPRESSED_BYTES'])
+            key = comparison_key(ascap.digest, bmi.digest, alias_revision)
+
+        # The inputs are still being archived while the comparison runs
+        logger.info("Running comparison...")
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_file = os.path.join(app.config['UPLOAD_FOLDER'], f'earnings_comparison_report_{timestamp}_{key[:12]}.xlsx')
+        # Results live as long as the jobs that point at them
+        results.prune(jobs.retention)
+        result = run_comparison(ascap.path, bmi.path, output_file=output_file, engine=app.config['CSV_READER_ENGINE'],
+                                cache=parse_cache, digests={'ascap': ascap.digest, 'bmi': bmi.digest}, aliases=job_aliases,
+                                profile=profile, results=results, result_id=key,
+                                memory_budget_mb=app.config['COMPARISON_MEMORY_BUDGET_MB'],
+                                spill_dir=app.config['SPILL_DIR'])
+        report_path = result['report_path'] if result else None
+
+        if not report_path or not os.path.exists(report_path):
+            raise Exception("Failed to generate report")
+
+        logger.info(f"Report generated: {report_path}")
+
+        # Upload report to storage
+        report_key = f'reports/{os.path.basename(report_path)}'
+        with profile.stage('upload_report') as stage:
+            stage['bytes'] = os.path.getsize(report_path)
+            storage.upload_file(report_path, report_key)
+
+        with profile.stage('archive_inputs') as stage:
+            stage['bytes'] = ascap.size + bmi.size
+            for upload in [ascap, bmi]:
+                upload.archive.wait()
+
+        # One JSON line per run with per-stage time, memory and counts
+        run_profile = profile.as_dict()
+        logger.info(json.dumps({'event': 'comparison_profile', 'report': os.path.basename(report_path),
+                                'ascap_bytes': ascap.size, 'bmi_bytes': bmi.size, **run_profile}))
+        for record in run_profile['stages']:
+            comparison_stage_duration.observe(record['seconds'], stage=record['stage'])
+        report_size.observe(os.path.getsize(report_path))
+
+        # Aliases recorded by this run alone would give the same result again, so identical
+        # inputs submitted at the new revision still share this job
+        revision = alias_revision + job_aliases.changes
+        if job_aliases.changes and job_aliases.revision() == revision:
+            jobs.add_key(comparison_key(ascap.digest, bmi.digest, revision))
+
+        logger.info("Processing complete")
+        comparisons.inc(status='done')
+        return {'report_key': report_key, 'result_id': key}
+    except Exception:
+        comparisons.inc(status='failed')
+        raise
+    finally:
+        comparison_duration.observe(time.perf_counter() - start)
+        # Clean up temporary files
+        for file_path in [ascap.path, bmi.path, report_path]:
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
+    files = {}
     try:
-        if 'ascap' not in request.files or 'bmi' not in request.files:
-            return jsonify({'error': 'Both ASCAP and BMI files are required'}), 400
-        
-        ascap_file = request.files['ascap']
-        bmi_file = request.files['bmi']
-        
-        if ascap_file.filename == '' or bmi_file.filename == '':
-            return jsonify({'error': 'No selected files'}), 400
-
         # Validate file sizes before processing
         max_size = app.config['MAX_CONTENT_LENGTH']
-        if request.content_length > max_size:
+        if request.content_length is not None and request.content_length > max_size:
             return jsonify({'error': f'Total upload size exceeds {max_size // (1024*1024)}MB limit'}), 413
-        
-        logger.info(f"Processing files: ASCAP={ascap_file.filename}, BMI={bmi_file.filename}")
-        
-        try:
-            # Create temporary files with .csv extension
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp_ascap:
-                ascap_file.save(temp_ascap.name)
-                # Upload to Google Cloud Storage with chunked transfer
-                blob = bucket.blob(f'uploads/{secure_filename(ascap_file.filename)}')
-                blob.chunk_size = 5 * 1024 * 1024  # 5MB chunks
-                blob.upload_from_filename(temp_ascap.name)
-                ascap_path = temp_ascap.name
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp_bmi:
-                bmi_file.save(temp_bmi.name)
-                # Upload to Google Cloud Storage with chunked transfer
-                blob = bucket.blob(f'uploads/{secure_filename(bmi_file.filename)}')
-                blob.chunk_size = 5 * 1024 * 1024  # 5MB chunks
-                blob.upload_from_filename(temp_bmi.name)
-                bmi_path = temp_bmi.name
-            
-            logger.info("Running comparison...")
-            # Run comparison
-            report_path = compare_earnings(ascap_path, bmi_path)
-            
-            if not report_path or not os.path.exists(report_path):
-                raise Exception("Failed to generate report")
-            
-            logger.info(f"Report generated: {report_path}")
-            
-            # Upload report to Google Cloud Storage
-            report_blob = bucket.blob(f'reports/{os.path.basename(report_path)}')
-            report_blob.upload_from_filename(report_path)
-            
-            # Clean up temporary files
-            os.unlink(ascap_path)
-            os.unlink(bmi_path)
-            os.unlink(report_path)
-            
-            # Generate signed URL for report download
-            url = report_blob.generate_signed_url(
-                version="v4",
-                expiration=300,  # URL expires in 5 minutes
-                method="GET"
-            )
-            
-            logger.info("Processing complete")
-            return jsonify({
-                'success': True,
-                'report_url': url
-            })
-            
-        except Exception as e:
-            logger.error(f"Error during file processing: {str(e)}")
-            # Clean up files in case of error
-            for file_path in [ascap_path, bmi_path]:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            raise e
-            
+
+        if request.mimetype != 'multipart/form-data':
+            return jsonify({'error': 'Both ASCAP and BMI files are required'}), 400
+
+        # Read the body once: each file is spooled to disk, hashed and archived as it arrives
+        files, _ = ingest_multipart(
+            request.stream, request.content_type, app.config['UPLOAD_FOLDER'],
+            storage=storage, archive_key=archive_key, max_decompressed_size=app.config['MAX_DECOMPRESSED_BYTES'],
+            content_length=request.content_length
+        )
+
+        if 'ascap' not in files or 'bmi' not in files:
+            for ingested in files.values():
+                ingested.discard()
+            return jsonify({'error': 'Both ASCAP and BMI files are required'}), 400
+
+        return submit_comparison(files)
+
+    except JobQueueFull as e:
+        for ingested in files.values():
+            ingested.discard()
+        return jsonify({'error': str(e)}), 429
+    except ContentTooLarge as e:
+        for ingested in files.values():
+            ingested.discard()
+        return jsonify({'error': str(e)}), 413
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
+        # Clean up files in case of error
+        for ingested in files.values():
+            ingested.discard()
         return jsonify({'error': str(e)}), 500
 
+def archive_key(filename):
+    return f'uploads/{secure_filename(filename)}'
+
+def submit_comparison(files):
+    """Queue the comparison of received 'ascap' and 'bmi' files (or join an identical one); 202 response"""
+    ascap, bmi = files['ascap'], files['bmi']
+    for pro, ingested in files.items():
+        upload_bytes.inc(ingested.size, pro=pro)
+        upload_size.observe(ingested.size, pro=pro)
+    logger.info(f"Processing files: ASCAP={ascap.filename} ({ascap.size} bytes), BMI={bmi.filename} ({bmi.size} bytes)")
+
+    # Identical inputs share one job: a finished one answers with its report, a queued or
+    # running one is waited on. comparison_key loads the comparison modules on first use.
+    from compare_earnings import comparison_key
+
+    # Results depend on the aliases too: a changed alias table means a new comparison
+    alias_revision = aliases.revision()
+    if ascap.digest is None or bmi.digest is None:
+        # Not hashed on the way in: the job hashes the inputs, so nothing to share a job by
+        job_id, created = jobs.submit(run_comparison_job, ascap, bmi, None, alias_revision), True
+    else:
+        key = comparison_key(ascap.digest, bmi.digest, alias_revision)
+        job_id, created = jobs.submit_unique(key, run_comparison_job, ascap, bmi, key, alias_revision)
+    if created:
+        for ingested in files.values():
+            ingested.store_archive()
+        logger.info(f"Queued comparison job {job_id}")
+    else:
+        # Nothing to do with this copy: drop the spool files and the unfinished archive uploads
+        for ingested in files.values():
+            ingested.discard()
+        duplicate_submissions.inc()
+        logger.info(f"Identical inputs, reusing comparison job {job_id}")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'reused': not created
+    }), 202
+
+def upload_response(state):
+    return {
+        'upload_id': state['upload_id'],
+        'upload_url': url_for('upload_chunk', upload_id=state['upload_id']),
+        'size': state['size'],
+        'received': state['received'],
+        'complete': state['received'] == [[0, state['size']]]
+    }
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked upload of one statement: JSON {filename, size}, size as sent"""
+    body = request.get_json(silent=True) or {}
+    try:
+        state = resumable_uploads.create(body.get('filename'), body.get('size'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload_response(state)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Byte ranges received so far, so a client can resume with the missing ones"""
+    state = resumable_uploads.get(upload_id)
+    if state is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify(upload_response(state))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """One chunk of an upload, placed by its Content-Range header; chunks may be sent in any order or again"""
+    max_chunk = app.config['UPLOAD_CHUNK_MAX_BYTES']
+    if request.content_length is not None and request.content_length > max_chunk:
+        return jsonify({'error': f'Chunks are limited to {max_chunk // (1024 * 1024)}MB'}), 413
+    try:
+        start, end, total = parse_content_range(request.headers.get('Content-Range'))
+        data = request.get_data(cache=False)
+        if len(data) != end - start:
+            raise UploadError(f"Chunk has {len(data)} bytes, Content-Range says {end - start}")
+        state = resumable_uploads.write_chunk(upload_id, start, data, total=total)
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except ContentTooLarge as e:
+        # The upload is dropped: no later chunk can bring it back under the limit
+        return jsonify({'error': str(e)}), 413
+    return jsonify(upload_response(state))
+
+@app.route('/compare', methods=['POST'])
+def compare_uploads():
+    """Compare two completed chunked uploads: JSON {ascap: upload_id, bmi: upload_id}"""
+    body = request.get_json(silent=True) or {}
+    if not body.get('ascap') or not body.get('bmi'):
+        return jsonify({'error': 'Both ASCAP and BMI files are required'}), 400
+    for pro in ('ascap', 'bmi'):
+        state = resumable_uploads.get(body[pro])
+        if state is None:
+            return jsonify({'error': f'Unknown {pro.upper()} upload'}), 404
+        if state['received'] != [[0, state['size']]]:
+            return jsonify({'error': f'{pro.upper()} upload is incomplete', **upload_response(state)}), 409
+
+    files = {}
+    try:
+        for pro in ('ascap', 'bmi'):
+            files[pro] = resumable_uploads.complete(body[pro], app.config['UPLOAD_FOLDER'],
+                                                    storage=storage, archive_key=archive_key)
+        return submit_comparison(files)
+    except KeyError:
+        # The other request for the same uploads got there first
+        for uploaded in files.values():
+            uploaded.discard()
+        return jsonify({'error': 'Upload already submitted'}), 409
+    except JobQueueFull as e:
+        for uploaded in files.values():
+            uploaded.discard()
+        return jsonify({'error': str(e)}), 429
+    except (ContentTooLarge, UploadError) as e:
+        for uploaded in files.values():
+            uploaded.discard()
+        return jsonify({'error': str(e)}), 413 if isinstance(e, ContentTooLarge) else 400
+    except Exception as e:
+        logger.error(f"Compare error: {str(e)}")
+        for uploaded in files.values():
+            uploaded.discard()
+        return jsonify({'error': str(e)}), 500
+
+def job_response(job_id, job):
+    response = {'job_id': job_id, 'status': job['status']}
+    if job.get('progress'):
+        response['progress'] = job['progress']
+    if job['status'] == 'done':
+        # Generate a fresh signed URL for report download on every poll
+        response['report_url'] = storage.signed_url(job['result']['report_key'], expiration=300)  # URL expires in 5 minutes
+        if job['result'].get('result_id'):
+            response['results_url'] = url_for('job_results', job_id=job_id)
+    elif job['status'] == 'failed':
+        response['error'] = job.get('error', 'Failed to process files')
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_response(job_id, job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job's state: one event per change, the last one done or failed.
+
+    A stream ends after EVENT_STREAM_SECONDS and the browser reconnects, so
+    no stream holds a request thread for a whole job; above MAX_EVENT_STREAMS
+    open streams it answers 503 and the page polls /jobs/<job_id> instead.
+    """
+    if jobs.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not event_stream_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many progress streams, poll the job status instead'}), 503, {'Retry-After': '2'}
+
+    def events():
+        yield f'retry: {EVENT_STREAM_RETRY_MS}\n\n'
+        last_state = None
+        last_sent = time.time()
+        deadline = time.time() + app.config['EVENT_STREAM_SECONDS']
+        while time.time() < deadline:
+            job = jobs.get(job_id)
+            if job is None:
+                return
+            if job != last_state:
+                last_state = job
+                last_sent = time.time()
+                yield f'data: {json.dumps(job_response(job_id, job))}\n\n'
+                if job['status'] in ('done', 'failed'):
+                    return
+            elif time.time() - last_sent > 15:
+                # Comment line so proxies keep the connection open
+                last_sent = time.time()
+                yield ': keep-alive\n\n'
+            time.sleep(PROGRESS_POLL_SECONDS)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also called when the client goes away mid-stream
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+def job_result_id(job_id):
+    """Result id of a finished job, or an error response"""
+    job = jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': 'Unknown job'}), 404)
+    if job['status'] != 'done':
+        return None, (jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409)
+    result_id = job['result'].get('result_id')
+    if not result_id or results.counts(result_id) is None:
+        return None, (jsonify({'error': 'Results are no longer available'}), 404)
+    return result_id, None
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """Outcome counts of a finished job and the URLs of its result tables"""
+    result_id, error = job_result_id(job_id)
+    if error:
+        return error
+    return jsonify({
+        'counts': results.counts(result_id),
+        'tables': {table: url_for('job_result_table', job_id=job_id, table=table) for table in TABLES}
+    })
+
+@app.route('/jobs/<job_id>/results/<table>', methods=['GET'])
+def job_result_table(job_id, table):
+    """
+    One page of a result table (shows, episodes, ascap_only, bmi_only).
+
+    Query parameters: show (one show), search (part of a show name),
+    min_difference or min_amount, missing_from (episodes: 'ascap' or 'bmi'),
+    sort (difference/amount, '-' prefix for largest first), limit and the
+    cursor from the previous page.
+    """
+    if table not in TABLES:
+        return jsonify({'error': f"Unknown result table '{table}'"}), 404
+    result_id, error = job_result_id(job_id)
+    if error:
+        return error
+
+    # Stored show names are cleaned; clean the ones asked for the same way
+    from normalize import clean_show_name
+
+    args = request.args
+    minimum = args.get(f'min_{SORT_COLUMNS[table]}')
+    try:
+        rows, next_cursor = results.query(
+            result_id, table,
+            show=clean_show_name(args['show']) if 'show' in args else None,
+            search=clean_show_name(args['search']) if args.get('search') else None,
+            minimum=float(minimum) if minimum else None,
+            missing_from=args.get('missing_from') or None,
+            sort=args.get('sort') or None,
+            limit=int(args.get('limit', 100)),
+            cursor=args.get('cursor') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = {'items': rows, 'next_cursor': next_cursor}
+    if next_cursor:
+        response['next_url'] = url_for('job_result_table', job_id=job_id, table=table,
+                                       **{**args.to_dict(), 'cursor': next_cursor})
+    return jsonify(response)
+
+@app.route('/storage/<path:key>', methods=['GET'])
+def local_storage_file(key):
+    # Only used by the local storage backend
+    if not isinstance(storage, LocalStorageBackend):
+        abort(404)
+    return send_from_directory(storage.root, key, as_attachment=True)
+
 # Add error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -0,0 +1,181 @@
+"""
+Compare many ASCAP/BMI statement pairs in one run.
+
+    python batch_compare.py --manifest pairs.csv --output-dir reports --workers 4
+    python batch_compare.py --glob 'statements/*2023*.csv' --output-dir reports
+
+A manifest is a CSV file with 'ascap' and 'bmi' columns and an optional
+'name' column (the report file name); relative paths are resolved against
+the manifest's directory. With --glob, files whose names are equal once
+'ascap' / 'bmi' is removed are paired, e.g. 'ASCAP 4TH 2023.csv' and
+'BMI 4TH 2023.csv'.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from instrumentation import format_profile
+from parse_cache import ParseCache
+
+PRO_IN_NAME = re.compile(r'ascap|bmi', re.IGNORECASE)
+
+def read_manifest(path):
+    """[(name, ascap_path, bmi_path)] from a manifest CSV"""
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, newline='') as f:
+        for i, row in enumerate(csv.DictReader(f), 1):
+            if not row.get('ascap') or not row.get('bmi'):
+                raise ValueError(f"{path}: row {i} needs both 'ascap' and 'bmi' paths")
+            ascap_path = os.path.join(base, row['ascap'])
+            bmi_path = os.path.join(base, row['bmi'])
+            name = row.get('name') or os.path.splitext(os.path.basename(ascap_path))[0]
+            pairs.append((name, ascap_path, bmi_path))
+    return pairs
+
+def pair_files(paths):
+    """[(name, ascap_path, bmi_path)] for files that only differ by the PRO in their name"""
+    by_key = {}
+    for path in sorted(paths):
+        filename = os.path.basename(path)
+        found = PRO_IN_NAME.search(filename)
+        if not found:
+            continue
+        key = (os.path.dirname(path), PRO_IN_NAME.sub('', filename, count=1).lower())
+        by_key.setdefault(key, {})[found.group(0).lower()] = path
+
+    pairs = []
+    for (_, rest), files in sorted(by_key.items()):
+        if 'ascap' in files and 'bmi' in files:
+            name = ' '.join(os.path.splitext(rest)[0].split()) or 'statements'
+            pairs.append((name, files['ascap'], files['bmi']))
+        else:
+            print(f"Skipping {next(iter(files.values()))}: no matching {'bmi' if 'ascap' in files else 'ascap'} file")
+    return pairs
+
+def report_names(pairs):
+    """Report file name for each pair, made unique within the batch"""
+    names = []
+    seen = {}
+    for name, _, _ in pairs:
+        base = re.sub(r'[^\w.-]+', '_', name).strip('_') or 'report'
+        seen[base] = seen.get(base, 0) + 1
+        names.append(f'{base}.xlsx' if seen[base] == 1 else f'{base}_{seen[base]}.xlsx')
+    return names
+
+def parse_statement(path, pro, engine, cache_dir, cache_max_bytes):
+    """Parse a statement into the shared parse cache"""
+    from statement_reader import load_statement
+
+    load_statement(path, pro, engine=engine, cache=ParseCache(cache_dir, cache_max_bytes))
+
+def compare_pair(ascap_path, bmi_path, output_file, engine, cache_dir, cache_max_bytes, alias_db, trace_memory=False,
+                 memory_budget_mb=None):
+    """Run one comparison in a worker process; returns (seconds, result or None, error or None)"""
+    from compare_earnings import run_comparison
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        aliases = None
+        if alias_db:
+            from alias_store import AliasStore
+            aliases = AliasStore(alias_db)
+        result = run_comparison(ascap_path, bmi_path, output_file=output_file, engine=engine,
+                                cache=ParseCache(cache_dir, cache_max_bytes), aliases=aliases,
+                                memory_budget_mb=memory_budget_mb, spill_dir=os.path.dirname(output_file) or None)
+        error = None if result else "Could not read statements"
+    except Exception as e:
+        result, error = None, str(e)
+    return time.perf_counter() - start, result, error
+
+def print_summary(pairs, outcomes):
+    columns = ['Pair', 'Status', 'Seconds', 'Matched', 'Only ASCAP', 'Only BMI', 'Songs only ASCAP', 'Songs only BMI']
+    rows = []
+    for (name, _, _), (seconds, result, error) in zip(pairs, outcomes):
+        if result:
+            rows.append([name, 'ok', f'{seconds:.1f}', result['matched_shows'], result['only_in_ascap'],
+                         result['only_in_bmi'], result['songs_only_in_ascap'], result['songs_only_in_bmi']])
+        else:
+            rows.append([name, f'failed: {error}', f'{seconds:.1f}', '', '', '', '', ''])
+
+    widths = [max(len(str(value)) for value in column) for column in zip(columns, *rows)]
+    print()
+    for row in [columns, ['-' * width for width in widths]] + rows:
+        print('  '.join(str(value).ljust(width) if i < 2 else str(value).rjust(width)
+                        for i, (value, width) in enumerate(zip(row, widths))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare ASCAP and BMI statements for many pairs at once")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help="CSV file with 'ascap', 'bmi' and optional 'name' columns")
+    source.add_argument('--glob', help="Glob of statement files, paired by name ('ASCAP Q4.csv' with 'BMI Q4.csv')")
+    parser.add_argument('--output-dir', default='.', help="Directory for the Excel reports")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--engine', default=config.CSV_READER_ENGINE, choices=['pandas', 'arrow'])
+    parser.add_argument('--cache-dir', default=config.PARSE_CACHE_DIR, help="Parse cache shared by the workers")
+    parser.add_argument('--cache-max-bytes', type=int, default=config.PARSE_CACHE_MAX_BYTES,
+                        help="Parse cache size budget; 0 disables the cache")
+    parser.add_argument('--alias-db', help="Show alias table to read and update (off by default, so "
+                                           "results do not depend on the order pairs finish in)")
+    parser.add_argument('--memory-budget-mb', type=float, default=config.COMPARISON_MEMORY_BUDGET_MB or None,
+                        help="Stream each pair through spill files in about this much memory per worker "
+                             "instead of loading the statements whole")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print per-stage time, memory and counts of every pair and write them to <report>.profile.json")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="With --profile, also record tracemalloc peaks per stage (slows the run down)")
+    args = parser.parse_args(argv)
+
+    pairs = read_manifest(args.manifest) if args.manifest else pair_files(glob.glob(args.glob))
+    if not pairs:
+        print("No statement pairs to compare")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [os.path.join(args.output_dir, name) for name in report_names(pairs)]
+    cache = (args.cache_dir, args.cache_max_bytes)
+
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        # Parse statements used by several pairs once, up front, so every pair loads them from the cache
+        uses = {}
+        for _, ascap_path, bmi_path in pairs:
+            for statement in ((ascap_path, 'ascap'), (bmi_path, 'bmi')):
+                uses[statement] = uses.get(statement, 0) + 1
+        shared = [statement for statement, count in uses.items() if count > 1]
+        # Bounded-memory runs stream the statements and never read the cache
+        if shared and ParseCache(*cache).enabled and not args.memory_budget_mb:
+            print(f"Parsing {len(shared)} statements shared by several pairs...")
+            parsed = [pool.submit(parse_statement, path, pro, args.engine, *cache) for path, pro in shared]
+            for future in parsed:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Could not pre-parse a shared statement: {str(e)}")
+
+        futures = [pool.submit(compare_pair, ascap_path, bmi_path, output, args.engine, *cache, args.alias_db,
+                               args.profile and args.trace_memory, args.memory_budget_mb)
+                   for (_, ascap_path, bmi_path), output in zip(pairs, outputs)]
+        outcomes = [future.result() for future in futures]
+
+    if args.profile:
+        for (name, _, _), output, (_, result, _) in zip(pairs, outputs, outcomes):
+            if result:
+                print(f"\nProfile of {name}:")
+                print(format_profile(result['profile']))
+                with open(f'{os.path.splitext(output)[0]}.profile.json', 'w') as f:
+                    json.dump(result['profile'], f, indent=2)
+
+    print_summary(pairs, outcomes)
+    return 0 if all(result for _, result, _ in outcomes) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
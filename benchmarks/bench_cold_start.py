@@ -0,0 +1,65 @@
+"""
+Time a cold start of wsgi:app in fresh interpreters.
+
+    python benchmarks/bench_cold_start.py --repeat 5
+
+For each run a new Python process imports wsgi (what a gunicorn worker
+does on boot without --preload), serves its first request, then imports
+the comparison modules a first job needs. The median of each step is
+reported with the peak RSS; with --preload the last step is paid once
+by the master instead of by every worker.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+heavy = [name for name in ('pandas', 'numpy', 'matplotlib', 'google.cloud.storage') if name in sys.modules]
+response = wsgi.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+import compare_earnings
+loaded = time.perf_counter()
+print(json.dumps({
+    'import_wsgi': imported - start,
+    'first_request': served - imported,
+    'import_comparison': loaded - served,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy_modules_at_boot': heavy,
+}))
+'''
+
+def cold_start(backend):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, STORAGE_BACKEND=backend, LOCAL_STORAGE_DIR=os.path.join(tmp, 'storage'),
+                   UPLOAD_FOLDER=os.path.join(tmp, 'uploads'))
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backend', default='local', choices=['local', 'gcs'],
+                        help="storage backend; the GCS client is only created on first use either way")
+    args = parser.parse_args()
+
+    runs = [cold_start(args.backend) for _ in range(args.repeat)]
+    for step in ('import_wsgi', 'first_request', 'import_comparison'):
+        print(f"{step:<18} median {statistics.median(run[step] for run in runs):7.3f}s   "
+              f"min {min(run[step] for run in runs):7.3f}s")
+    print(f"{'peak RSS':<18} median {statistics.median(run['peak_rss_mb'] for run in runs):7.1f} MB")
+    print(f"heavy modules imported at boot: {', '.join(runs[0]['heavy_modules_at_boot']) or 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Time compare_earnings end to end and per stage on synthetic statements.
+
+    python benchmarks/bench_compare.py --rows 20000 200000
+    python benchmarks/bench_compare.py --rows 200000 --save-baseline
+    python benchmarks/bench_compare.py --rows 200000 --check
+
+Statements come from synthetic_statements.py and are kept in --data-dir,
+so repeated runs time the same input. Each size runs --repeat times
+and the fastest time per stage is reported. --save-baseline stores the
+timings in --baseline-dir (one JSON file per size and engine); later
+runs print the change against them, and --check exits non-zero when the
+total time is more than --tolerance slower than the baseline.
+Baselines only compare runs on the same machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from compare_earnings import run_comparison
+from synthetic_statements import generate_statements
+
+def statement_paths(data_dir, rows, args):
+    """Synthetic statements for these parameters, generated on first use"""
+    name = f'{rows}-o{args.overlap}-n{args.noise}-p{args.promo}-s{args.seed}'
+    ascap_path = os.path.join(data_dir, f'ascap-{name}.csv')
+    bmi_path = os.path.join(data_dir, f'bmi-{name}.csv')
+    if not (os.path.exists(ascap_path) and os.path.exists(bmi_path)):
+        print(f"Generating {rows:,} row statements...")
+        os.makedirs(data_dir, exist_ok=True)
+        generate_statements(ascap_path, bmi_path, rows, overlap=args.overlap, noise=args.noise,
+                            promo=args.promo, seed=args.seed)
+    return ascap_path, bmi_path
+
+def run_benchmark(ascap_path, bmi_path, engine, repeat):
+    """Fastest total and per-stage seconds over repeat runs, with the outcome counts"""
+    best_stages = {}
+    best_total = float('inf')
+    peak_rss_mb = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # Keep the comparison's own output out of the table
+                result = run_comparison(ascap_path, bmi_path, output_file=os.path.join(tmp, 'report.xlsx'), engine=engine)
+            best_total = min(best_total, time.perf_counter() - start)
+            for record in result['profile']['stages']:
+                best_stages[record['stage']] = min(best_stages.get(record['stage'], float('inf')), record['seconds'])
+            peak_rss_mb = max(peak_rss_mb, result['profile']['peak_rss_mb'])
+    counts = {key: value for key, value in result.items() if key not in ('report_path', 'profile')}
+    return {'total_seconds': round(best_total, 4), 'stages': best_stages, 'peak_rss_mb': peak_rss_mb, 'counts': counts}
+
+def change(seconds, baseline_seconds):
+    if not baseline_seconds:
+        return ''
+    return f'{(seconds - baseline_seconds) / baseline_seconds:+7.1%}'
+
+def print_results(rows, results, baseline):
+    baseline_stages = baseline['stages'] if baseline else {}
+    print(f"\n{rows:,} rows per statement, peak RSS {results['peak_rss_mb']:.0f} MB, {results['counts']}")
+    print(f"{'Stage':<20} {'Seconds':>9} {'Baseline':>9} {'Change':>8}")
+    for stage, seconds in list(results['stages'].items()) + [('total', results['total_seconds'])]:
+        baseline_seconds = baseline['total_seconds'] if stage == 'total' and baseline else baseline_stages.get(stage)
+        print(f"{stage:<20} {seconds:>9.3f} {'' if baseline_seconds is None else f'{baseline_seconds:.3f}':>9} "
+              f"{change(seconds, baseline_seconds):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 200000], help='rows per statement')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per size (fastest is reported)')
+    parser.add_argument('--engine', default='pandas', choices=['pandas', 'arrow'])
+    parser.add_argument('--overlap', type=float, default=0.8)
+    parser.add_argument('--noise', type=float, default=0.1)
+    parser.add_argument('--promo', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'amoia-bench'),
+                        help='where generated statements are kept between runs')
+    parser.add_argument('--baseline-dir', default=os.path.join(BENCH_DIR, 'baselines'))
+    parser.add_argument('--save-baseline', action='store_true', help='store these timings as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit non-zero when slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown for --check (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    regressions = []
+    for rows in args.rows:
+        ascap_path, bmi_path = statement_paths(args.data_dir, rows, args)
+        results = run_benchmark(ascap_path, bmi_path, args.engine, args.repeat)
+
+        baseline_path = os.path.join(args.baseline_dir, f'compare-{rows}-{args.engine}.json')
+        baseline = None
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        print_results(rows, results, baseline)
+
+        if baseline and results['total_seconds'] > baseline['total_seconds'] * (1 + args.tolerance):
+            regressions.append(rows)
+        if args.save_baseline:
+            os.makedirs(args.baseline_dir, exist_ok=True)
+            results.update(rows=rows, engine=args.engine, python=platform.python_version(),
+                           platform=platform.platform(), cpus=os.cpu_count(), saved_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+            with open(baseline_path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Baseline saved to {baseline_path}")
+
+    if args.check and regressions:
+        print(f"\nSlower than baseline by more than {args.tolerance:.0%}: {', '.join(f'{rows:,} rows' for rows in regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
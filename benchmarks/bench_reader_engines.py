@@ -0,0 +1,43 @@
+"""
+Time read_statement with the pandas and arrow engines on large synthetic statements.
+
+    python benchmarks/bench_reader_engines.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from statement_reader import read_statement
+from synthetic_statements import generate_statements
+
+def time_engine(path, pro, engine, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_statement(path, pro, engine=engine)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='rows per synthetic statement')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per engine (best is reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_statements(os.path.join(tmp, 'ascap.csv'), os.path.join(tmp, 'bmi.csv'), args.rows)
+        for pro in ('ascap', 'bmi'):
+            path = os.path.join(tmp, f'{pro}.csv')
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+
+            pandas_time = time_engine(path, pro, 'pandas', args.repeat)
+            arrow_time = time_engine(path, pro, 'arrow', args.repeat)
+            print(f"{pro.upper():5} {args.rows:>10,} rows {size_mb:8.1f} MB  "
+                  f"pandas {pandas_time:6.2f}s  arrow {arrow_time:6.2f}s  speedup {pandas_time / arrow_time:4.1f}x")
+
+if __name__ == '__main__':
+    main()
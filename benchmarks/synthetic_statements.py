@@ -0,0 +1,136 @@
+"""
+Write synthetic ASCAP and BMI statements with the real column names.
+
+    python benchmarks/synthetic_statements.py --rows 1000000 --out-dir /tmp/statements
+
+Both statements draw from one catalog of shows. A share of the shows
+(overlap) is reported by both PROs; BMI spells some of those differently
+(noise: typos, punctuation, "&" for "and") and writes names in capitals
+like real BMI statements; some ASCAP rows carry the "(COMM/PROMO) "
+prefix. Every show has its own episodes and songs, which both PROs
+sample independently, so matched shows have songs missing on either side.
+Output is fully determined by the arguments and the seed.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from statement_reader import STATEMENT_SCHEMAS
+
+WORDS = ['law', 'order', 'night', 'live', 'late', 'show', 'news', 'kitchen', 'house', 'hunters', 'today',
+         'morning', 'family', 'island', 'love', 'real', 'housewives', 'chef', 'dance', 'street', 'city',
+         'crime', 'scene', 'big', 'brother', 'survivor', 'world', 'sports', 'center', 'game']
+NETWORKS = np.array(['NBC', 'CBS', 'ABC', 'FOX', 'HBO', 'BRAVO', 'TLC', 'ESPN', ''], dtype=object)
+EPISODES_PER_SHOW = 24
+SONGS_PER_SHOW = 60
+CHUNK_ROWS = 500000
+
+def show_catalog(count, rng):
+    """count distinct show names of two to four words"""
+    names = set()
+    while len(names) < count:
+        words = rng.choice(WORDS, size=rng.integers(2, 5))
+        names.add(' '.join(words).title() + (f' {rng.integers(1, 1000)}' if len(names) >= len(WORDS) ** 2 else ''))
+    return sorted(names)
+
+def misspell(name, rng):
+    """A variant of a show name that still scores high with fuzz.ratio"""
+    kind = rng.integers(0, 4)
+    if kind == 0 and len(name) > 6:  # Dropped letter
+        i = rng.integers(1, len(name) - 1)
+        return name[:i] + name[i + 1:]
+    if kind == 1 and len(name) > 6:  # Swapped letters
+        i = rng.integers(1, len(name) - 2)
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == 2:
+        return name.replace(' ', ': ', 1)
+    return name + 's'
+
+def generate_statements(ascap_path, bmi_path, rows, overlap=0.8, noise=0.1, promo=0.05,
+                        shows=None, seed=0):
+    """
+    Write rows rows to each of ascap_path and bmi_path.
+
+    overlap is the share of each statement's shows also in the other one,
+    noise the share of shared shows BMI spells differently and promo the
+    share of ASCAP rows with a "(COMM/PROMO) " prefix. shows defaults to
+    one show per 400 rows (at least 50).
+    """
+    rng = np.random.default_rng(seed)
+    shows = shows or max(50, rows // 400)
+    shared = int(round(shows * overlap))
+    catalog = show_catalog(2 * shows - shared, rng)
+
+    # ASCAP reports shows [0, shows), BMI the first `shared` of those plus its own
+    ascap_shows = np.array(catalog[:shows], dtype=object)
+    bmi_names = [misspell(name, rng) if i < shared and rng.random() < noise else name
+                 for i, name in enumerate(catalog[:shared] + catalog[shows:])]
+    bmi_shows = np.array([name.upper() for name in bmi_names], dtype=object)
+
+    # Each show owns a block of episode and song numbers
+    episode_names = np.array([''] + [f'Episode {i}' for i in range(1, EPISODES_PER_SHOW)], dtype=object)
+    song_count = (2 * shows - shared) * SONGS_PER_SHOW // 4  # Shows share songs too
+    songs = np.array([f'{" ".join(rng.choice(WORDS, size=2)).title()} Theme {i}' for i in range(song_count)], dtype=object)
+
+    def rows_for(show_names, show_ids, n):
+        show = rng.integers(0, len(show_names), size=n)
+        episode = rng.integers(0, EPISODES_PER_SHOW, size=n)
+        song = (show_ids[show] * (SONGS_PER_SHOW // 4) + rng.integers(0, SONGS_PER_SHOW, size=n)) % song_count
+        amount = np.round(rng.gamma(0.6, 4.0, size=n), 2)
+        return show, episode_names[episode], songs[song], NETWORKS[rng.integers(0, len(NETWORKS), size=n)], amount
+
+    ascap_ids = np.arange(shows)
+    bmi_ids = np.concatenate([np.arange(shared), np.arange(shows, 2 * shows - shared)])
+    ascap_schema = STATEMENT_SCHEMAS['ascap']
+    bmi_schema = STATEMENT_SCHEMAS['bmi']
+
+    for start in range(0, rows, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, rows - start)
+        header = start == 0
+
+        show, episode, song, network, amount = rows_for(ascap_shows, ascap_ids, n)
+        show_names = ascap_shows[show]
+        promoted = rng.random(n) < promo
+        show_names[promoted] = '(COMM/PROMO) ' + show_names[promoted]
+        pd.DataFrame({
+            'Party ID': np.arange(start, start + n),
+            ascap_schema['show']: show_names,
+            ascap_schema['episode']: episode,
+            ascap_schema['song']: song,
+            ascap_schema['network']: network,
+            ascap_schema['amount']: amount,
+            'Performance Count': rng.integers(1, 20, size=n)
+        }).to_csv(ascap_path, mode='w' if header else 'a', header=header, index=False)
+
+        show, episode, song, network, amount = rows_for(bmi_shows, bmi_ids, n)
+        pd.DataFrame({
+            bmi_schema['show']: bmi_shows[show],
+            bmi_schema['episode']: np.char.upper(episode.astype(str)),
+            bmi_schema['song']: np.char.upper(song.astype(str)),
+            bmi_schema['network']: network,
+            bmi_schema['amount']: amount,
+            'PERIOD': '20234'
+        }).to_csv(bmi_path, mode='w' if header else 'a', header=header, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='rows per statement (10k to 10M)')
+    parser.add_argument('--out-dir', default='.', help='directory for ascap.csv and bmi.csv')
+    parser.add_argument('--overlap', type=float, default=0.8, help='share of shows reported by both PROs')
+    parser.add_argument('--noise', type=float, default=0.1, help='share of shared shows BMI spells differently')
+    parser.add_argument('--promo', type=float, default=0.05, help='share of ASCAP rows with a (COMM/PROMO) prefix')
+    parser.add_argument('--shows', type=int, help='shows per statement (default: one per 400 rows)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    generate_statements(os.path.join(args.out_dir, 'ascap.csv'), os.path.join(args.out_dir, 'bmi.csv'), args.rows,
+                        overlap=args.overlap, noise=args.noise, promo=args.promo, shows=args.shows, seed=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,57 @@
 import pandas as pd
-import os
-import re
+import numpy as np
+import tempfile
+import hashlib
+import itertools
 from fuzzywuzzy import fuzz
 import xlsxwriter
-import matplotlib.pyplot as plt
 from datetime import datetime
+from instrumentation import RunProfile
+from show_matcher import assign_matches, find_candidate_matches
+from statement_reader import STATEMENT_SCHEMAS, load_statement
 
-def clean_show_name(name):
-    """Clean show names for better comparison"""
-    if pd.isna(name):
-        return ""
-    
-    # Convert to lowercase
-    name = str(name).lower().strip()
-    
-    # Remove "(comm/promo)" prefix
-    name = re.sub(r'^\(comm/promo\)\s*', '', name)
-    
-    # Remove special characters but keep spaces
-    name = re.sub(r'[^\w\s]', '', name)
-    
-    # Remove extra whitespace
-    name = ' '.join(name.split())
-    
-    return name
+# Minimum fuzz.ratio score for two show names to be considered the same show
+FUZZY_MATCH_THRESHOLD = 85
 
-def clean_song_title(title):
-    """Clean song titles for better comparison"""
-    if pd.isna(title):
-        return ""
-    
-    # Convert to lowercase
-    title = str(title).lower().strip()
-    
-    # Remove special characters but keep spaces
-    title = re.sub(r'[^\w\s]', '', title)
-    
-    # Remove extra whitespace
-    title = ' '.join(title.split())
-    
-    return title
+# Bump whenever matching or the report layout changes, so cached reports are not reused
+MATCHER_VERSION = 1
+
+# Statement columns used for episode/song aggregation
+ASCAP_COLUMNS = STATEMENT_SCHEMAS['ascap']
+BMI_COLUMNS = STATEMENT_SCHEMAS['bmi']
+
+class ShowMatch:
+    """The BMI show an ASCAP show is matched to and the match score (100 for exact matches)"""
+    __slots__ = ('bmi_show', 'match_quality')
+
+    def __init__(self, bmi_show, match_quality):
+        self.bmi_show = bmi_show
+        self.match_quality = match_quality
+
+    def __eq__(self, other):
+        return isinstance(other, ShowMatch) and (self.bmi_show, self.match_quality) == (other.bmi_show, other.match_quality)
+
+    def __repr__(self):
+        return f'ShowMatch({self.bmi_show!r}, {self.match_quality!r})'
+
+class ShowTotals:
+    """One show's song counts and amounts, for writing it row by row"""
+    __slots__ = ('ascap_songs', 'bmi_songs', 'ascap_amount', 'bmi_amount', 'difference')
+
+    def __init__(self, ascap_songs, bmi_songs, ascap_amount, bmi_amount, difference):
+        self.ascap_songs = ascap_songs
+        self.bmi_songs = bmi_songs
+        self.ascap_amount = ascap_amount
+        self.bmi_amount = bmi_amount
+        self.difference = difference
+
+def comparison_key(ascap_digest, bmi_digest, alias_revision=0):
+    """
+    Key of a comparison's result: both input hashes, the matcher version and
+    threshold, and the revision of the alias table (AliasStore.revision())
+    """
+    return hashlib.sha256(f'{ascap_digest}:{bmi_digest}:{MATCHER_VERSION}:{FUZZY_MATCH_THRESHOLD}:'
+                          f'{alias_revision}'.encode()).hexdigest()
 
 def find_similar_shows(show_name, show_list, threshold=85):
     """Find similar show names using fuzzy matching"""
@@ -53,9 +65,215 @@ def find_similar_shows(show_name, show_list, threshold=85):
 def fuzzy_match(a, b):
     return fuzz.ratio(a, b) >= 80
 
-def create_excel_report(ascap_df, bmi_df, matches, episode_matches, only_in_ascap, only_in_bmi, songs_only_in_ascap, songs_only_in_bmi, output_file):
-    """Create a detailed Excel report with multiple sheets and charts"""
-    workbook = xlsxwriter.Workbook(output_file)
+def aggregate_episodes(df, columns):
+    """
+    Aggregate a statement to one row per show, episode and song in one
+    vectorized pass, keyed by the normalized names. Amounts are summed;
+    display names come from the first row of each group and network from
+    its first row that has one.
+    """
+    keys = ['clean_name', 'clean_episode', 'clean_song_title']
+    # Work on group codes: pandas' first() falls back to a slow path on categorical columns
+    groups = df.groupby(keys, observed=True, sort=False).ngroup().to_numpy()
+    _, first_rows = np.unique(groups, return_index=True)
+    episodes = df.iloc[first_rows][keys + [columns['episode'], columns['song']]].reset_index(drop=True)
+    episodes.columns = keys + ['episode', 'song']
+
+    network = df[columns['network']]
+    has_network = network.notna().to_numpy()
+    network_groups, network_rows = np.unique(groups[has_network], return_index=True)
+    episodes['network'] = pd.Series(network.iloc[np.flatnonzero(has_network)[network_rows]].to_numpy(),
+                                    index=network_groups).reindex(range(len(episodes))).to_numpy()
+    episodes['amount'] = np.bincount(groups, weights=df[columns['amount']].fillna(0).to_numpy(),
+                                     minlength=len(episodes))
+    return episodes
+
+def shared_categories(first, second, categories=None):
+    """
+    Two columns as categoricals over the same categories (by default the
+    sorted union of their values), so they merge and sort by code
+    """
+    first, second = pd.Categorical(first), pd.Categorical(second)
+    if categories is None:
+        # union() returns equal indexes as they are, so sort explicitly
+        categories = first.categories.union(second.categories).sort_values()
+    return first.set_categories(categories), second.set_categories(categories)
+
+def first_present(first, second):
+    """One categorical with the values of first, or of second where first is missing"""
+    first, second = shared_categories(first, second)
+    return pd.Categorical.from_codes(np.where(first.codes >= 0, first.codes, second.codes), first.categories)
+
+def reconcile_episodes(ascap_episodes, bmi_episodes, matches):
+    """
+    Join the episode/song aggregates of all matched shows with one full outer merge.
+
+    Returns the reconciliation frame every report sheet reads from: one row
+    per show, normalized episode and song, with display names, network,
+    ASCAP amount, BMI amount, absolute difference and in_ascap/in_bmi flags.
+    Rows are grouped by show in the order of matches, then sorted by episode
+    and song. Names are categoricals, so each row holds codes rather than
+    Python strings; the show column's categories are the shows in match order.
+    """
+    keys = ['show', 'clean_episode', 'clean_song_title']
+    bmi_to_show = {match.bmi_show: show for show, match in matches.items()}
+
+    ascap = ascap_episodes[ascap_episodes['clean_name'].isin(list(matches))]
+    bmi = bmi_episodes[bmi_episodes['clean_name'].isin(list(bmi_to_show))]
+    # Categoricals from the two statements have different categories, so both sides are
+    # recoded to shared ones before merging
+    bmi_names = bmi['clean_name'].cat
+    bmi_shows = np.array([bmi_to_show.get(name) for name in bmi_names.categories], dtype=object)
+    ascap_keys = {}
+    bmi_keys = {}
+    ascap_keys['show'], bmi_keys['show'] = shared_categories(ascap['clean_name'], bmi_shows[bmi_names.codes.to_numpy()],
+                                                            categories=list(matches))
+    for key in keys[1:]:
+        ascap_keys[key], bmi_keys[key] = shared_categories(ascap[key], bmi[key])
+    values = ['episode', 'song', 'network', 'amount']
+    ascap = ascap[values].reset_index(drop=True).assign(**ascap_keys)
+    bmi = bmi[values].reset_index(drop=True).assign(**bmi_keys)
+
+    merged = ascap.merge(bmi, on=keys, how='outer', suffixes=('_ascap', '_bmi'), indicator=True)
+    reconciliation = pd.DataFrame({
+        'show': merged['show'],
+        'clean_episode': merged['clean_episode'],
+        'clean_song_title': merged['clean_song_title'],
+        'episode': first_present(merged['episode_ascap'], merged['episode_bmi']),
+        'song': first_present(merged['song_ascap'], merged['song_bmi']),
+        'network': first_present(merged['network_ascap'], merged['network_bmi']),
+        'ascap_amount': merged['amount_ascap'].fillna(0.0),
+        'bmi_amount': merged['amount_bmi'].fillna(0.0),
+        'in_ascap': (merged['_merge'] != 'right_only').to_numpy(),
+        'in_bmi': (merged['_merge'] != 'left_only').to_numpy()
+    })
+    reconciliation['difference'] = (reconciliation['ascap_amount'] - reconciliation['bmi_amount']).abs()
+
+    # Shows in match order, episodes and songs in sorted order: all by code
+    return reconciliation.sort_values(keys, kind='mergesort').reset_index(drop=True)
+
+def summarize_shows(reconciliation, matches):
+    """Per-show totals and song counts from the reconciliation frame, in match order"""
+    summary = reconciliation.groupby('show', observed=True, sort=False).agg(
+        ascap_amount=('ascap_amount', 'sum'),
+        bmi_amount=('bmi_amount', 'sum'),
+        ascap_songs=('in_ascap', 'sum'),
+        bmi_songs=('in_bmi', 'sum')
+    )
+    summary = summary.set_axis(summary.index.astype(object)).reindex(list(matches))
+    summary['difference'] = (summary['ascap_amount'] - summary['bmi_amount']).abs()
+    summary['match_quality'] = [match.match_quality for match in matches.values()]
+    return summary
+
+def show_totals(summary):
+    """{show: ShowTotals} from a summarize_shows() frame, for per-show lookups while writing rows"""
+    return {show: ShowTotals(*values) for show, *values in zip(
+        summary.index, summary['ascap_songs'].astype(int).tolist(), summary['bmi_songs'].astype(int).tolist(),
+        summary['ascap_amount'].astype(float).tolist(), summary['bmi_amount'].astype(float).tolist(),
+        summary['difference'].astype(float).tolist())}
+
+def show_slices(shows):
+    """(value, start, stop) for each run of equal values in an array grouped by show, e.g. show codes"""
+    shows = np.asarray(shows)
+    if not len(shows):
+        return []
+    starts = np.flatnonzero(np.r_[True, shows[1:] != shows[:-1]])
+    stops = np.r_[starts[1:], len(shows)]
+    return [(shows[start], start, stop) for start, stop in zip(starts, stops)]
+
+def text_column(values):
+    """Column values as strings, with missing values written as empty cells"""
+    values = values.astype(object)
+    return values.where(values.notna(), '').astype(str).tolist()
+
+def unmatched_songs(df, shows, columns):
+    """
+    Rows of the given shows as one frame with show, episode, song, network
+    and amount columns, grouped by show in file order
+    """
+    rows = df[df['clean_name'].isin(shows)]
+    # Categories in sorted order, so sorting by show code sorts by name
+    show = rows['clean_name'].cat.remove_unused_categories()
+    songs = pd.DataFrame({
+        'show': show.cat.reorder_categories(show.cat.categories.sort_values()),
+        'episode': rows[columns['episode']],
+        'song': rows[columns['song']],
+        'network': rows[columns['network']],
+        'amount': rows[columns['amount']]
+    })
+    return songs.sort_values('show', kind='mergesort').reset_index(drop=True)
+
+def write_songs_sheet(workbook, name, songs, header_format, money_format):
+    """Write an unmatched songs frame (or its parts, in order) to its own sheet"""
+    sheet = workbook.add_worksheet(name)
+    sheet.write_row(0, 0, ['Show Name', 'Episode', 'Song Title', 'Network', 'Amount'], header_format)
+
+    row = 1
+    for part in frame_parts(songs):
+        columns = zip(text_column(part['show']), text_column(part['episode']),
+                      text_column(part['song']), text_column(part['network']),
+                      part['amount'].astype(float).tolist())
+        for show, episode, song, network, amount in columns:
+            sheet.write_row(row, 0, [show, episode, song, network])
+            sheet.write(row, 4, amount, money_format)
+            row += 1
+    return sheet
+
+def frame_parts(frames):
+    """
+    A frame as a one-part list; an iterable of frames that each hold whole
+    shows (the partitions of a bounded-memory run) is returned as it is
+    """
+    return [frames] if isinstance(frames, pd.DataFrame) else frames
+
+def part_summaries(reconciliation, matches):
+    """(part, per-show summary of the part) for each part of the reconciliation, in order"""
+    for part in frame_parts(reconciliation):
+        yield part, summarize_shows(part, {show: matches[show] for show in pd.unique(part['show'])})
+
+def stored_values(values):
+    """Column values for the result store: missing values as None, numpy scalars as Python ones"""
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+def store_results(results, result_id, matches, reconciliation, songs_only_in_ascap, songs_only_in_bmi, counts):
+    """Write the rows behind every report sheet to a ResultStore under result_id"""
+    summary = pd.concat([summary for _, summary in part_summaries(reconciliation, matches)])
+    shows = zip(summary.index.astype(str), [matches[show].bmi_show for show in summary.index],
+                summary['match_quality'].astype(float).tolist(), summary['ascap_songs'].astype(int).tolist(),
+                summary['bmi_songs'].astype(int).tolist(), summary['ascap_amount'].astype(float).tolist(),
+                summary['bmi_amount'].astype(float).tolist(), summary['difference'].astype(float).tolist())
+
+    def episode_rows(part):
+        return zip(part['show'].tolist(), stored_values(part['episode']), stored_values(part['song']),
+                   stored_values(part['network']), part['ascap_amount'].astype(float).tolist(),
+                   part['bmi_amount'].astype(float).tolist(), part['difference'].astype(float).tolist(),
+                   part['in_ascap'].tolist(), part['in_bmi'].tolist())
+
+    def song_rows(songs):
+        # Missing amounts count as 0, as in the reconciliation
+        return zip(songs['show'].tolist(), stored_values(songs['episode']), stored_values(songs['song']),
+                   stored_values(songs['network']), songs['amount'].astype(float).fillna(0.0).tolist())
+
+    # Parts are read one at a time as the rows are inserted
+    results.store(result_id, counts, {
+        'shows': shows,
+        'episodes': itertools.chain.from_iterable(map(episode_rows, frame_parts(reconciliation))),
+        'ascap_only': itertools.chain.from_iterable(map(song_rows, frame_parts(songs_only_in_ascap))),
+        'bmi_only': itertools.chain.from_iterable(map(song_rows, frame_parts(songs_only_in_bmi)))
+    })
+
+def create_excel_report(matches, reconciliation, songs_only_in_ascap, songs_only_in_bmi, output_file):
+    """
+    Create a detailed Excel report with multiple sheets and charts
+
+    Every matched-show sheet is read from the reconciliation frame. The
+    workbook is written in constant-memory mode: every sheet is written top
+    to bottom one row at a time and flushed to disk as it goes. The
+    reconciliation and songs frames can also be iterables of parts that
+    each hold whole shows; they are then read one part at a time.
+    """
+    workbook = xlsxwriter.Workbook(output_file, {'constant_memory': True})
 
     # Create formats
     header_format = workbook.add_format({
@@ -68,182 +286,104 @@ def create_excel_report(ascap_df, bmi_df, matches, episode_matches, only_in_asca
     
     money_format = workbook.add_format({'num_format': '$#,##0.00'})
     percent_format = workbook.add_format({'num_format': '0.00%'})
+    wrap_format = workbook.add_format({'text_wrap': True})
 
-    # Show Episodes Analysis sheet
+    # Create the sheets in tab order
     show_episodes_sheet = workbook.add_worksheet('Show Episodes Analysis')
+    summary_sheet = workbook.add_worksheet('Summary')
+    episode_sheet = workbook.add_worksheet('Episode Breakdown')
+
+    # Show Episodes Analysis layout
     headers = ['Show Name', 'Total Songs in ASCAP', 'Total Songs in BMI', 
               'Songs Missing from ASCAP', 'Songs Missing from BMI', 'BMI Amount', 'ASCAP Amount', 'Difference']
     show_episodes_sheet.write_row(0, 0, headers, header_format)
-    
-    current_row = 1
-    for show, match_info in matches.items():
-        if show in episode_matches:
-            ascap_episodes = episode_matches[show]['ascap_episodes']
-            bmi_episodes = episode_matches[show]['bmi_episodes']
-            
-            # Create dictionaries for faster lookup
-            ascap_dict = {}
-            for ep in ascap_episodes:
-                key = (ep['Program Name'], ep['Work Title'])
-                ascap_dict[key] = float(ep['Dollars'])
-
-            bmi_dict = {}
-            for ep in bmi_episodes:
-                key = (ep['EPISODE NAME'], ep['TITLE NAME'])
-                bmi_dict[key] = float(ep['ROYALTY AMOUNT'])
-            
-            # Calculate totals
-            bmi_amount = sum(bmi_dict.values())
-            ascap_amount = sum(ascap_dict.values())
-            difference = abs(bmi_amount - ascap_amount)
-            
-            # Write show info
-            show_episodes_sheet.write(current_row, 0, show)
-            show_episodes_sheet.write(current_row, 1, len(ascap_dict))
-            show_episodes_sheet.write(current_row, 2, len(bmi_dict))
-            
-            # Get all songs from both sources
-            bmi_songs = sorted([song for _, song in bmi_dict.keys()])
-            ascap_songs = sorted([song for _, song in ascap_dict.keys()])
-            
-            # Write songs in columns
-            max_songs = max(len(bmi_songs), len(ascap_songs))
-            for i in range(max_songs):
-                if i < len(bmi_songs):
-                    show_episodes_sheet.write(current_row + i, 3, bmi_songs[i])
-                if i < len(ascap_songs):
-                    show_episodes_sheet.write(current_row + i, 4, ascap_songs[i])
-            
-            # Write amounts
-            show_episodes_sheet.write(current_row, 5, bmi_amount, money_format)
-            show_episodes_sheet.write(current_row, 6, ascap_amount, money_format)
-            show_episodes_sheet.write(current_row, 7, difference, money_format)
-            
-            # Move to next show's starting row
-            current_row += max(max_songs, 1) + 1  # Add 1 for spacing between shows
-    
-    # Adjust column widths
     show_episodes_sheet.set_column(0, 0, 30)  # Show Name
     show_episodes_sheet.set_column(1, 2, 15)  # Total Songs
-    show_episodes_sheet.set_column(3, 4, 40)  # Songs Lists
+    show_episodes_sheet.set_column(3, 4, 40, wrap_format)  # Songs Lists, wrapped
     show_episodes_sheet.set_column(5, 7, 15)  # Amounts
     
     # Set row height to accommodate multiple lines
     show_episodes_sheet.set_default_row(60)
-    
-    # Enable text wrapping for songs columns
-    wrap_format = workbook.add_format({'text_wrap': True})
-    show_episodes_sheet.set_column(3, 4, 40, wrap_format)
 
-    # Summary sheet
-    summary_data = []
-    total_ascap = 0
-    total_bmi = 0
-    
-    for show, match_info in matches.items():
-        ascap_amount = match_info['ascap_amount']
-        bmi_amount = match_info['bmi_amount']
-        diff = abs(ascap_amount - bmi_amount)
-        diff_percent = diff / max(ascap_amount, bmi_amount) if max(ascap_amount, bmi_amount) > 0 else 0
-        
-        total_ascap += ascap_amount
-        total_bmi += bmi_amount
-        
-        summary_data.append({
-            'Show Name': show,
-            'ASCAP Amount': ascap_amount,
-            'BMI Amount': bmi_amount,
-            'Difference': diff,
-            'Difference %': diff_percent,
-            'Match Quality': match_info['match_quality']
-        })
-
-    summary_df = pd.DataFrame(summary_data)
+    # Episode breakdown layout
+    episode_headers = ['Show Name', 'Episode Title', 'Song Title', 'Network', 'ASCAP Amount', 'BMI Amount', 'Difference']
+    episode_sheet.write_row(0, 0, episode_headers, header_format)
+
+    # Both sheets are filled in one pass over the matched shows, a part at a time; column
+    # arrays and per-show aggregates are computed once per part for both sheets
+    show_row = 1
+    episode_row = 1
+    summaries = []
+    for part, part_summary in part_summaries(reconciliation, matches):
+        summaries.append(part_summary)
+        totals_of = show_totals(part_summary)
+        show_names = part['show'].cat.categories
+        episodes = text_column(part['episode'])
+        songs = text_column(part['song'])
+        networks = text_column(part['network'])
+        ascap_amounts = part['ascap_amount'].astype(float).tolist()
+        bmi_amounts = part['bmi_amount'].astype(float).tolist()
+        differences = part['difference'].astype(float).tolist()
+        in_ascap = part['in_ascap'].tolist()
+        in_bmi = part['in_bmi'].tolist()
+
+        for code, start, stop in show_slices(part['show'].cat.codes.to_numpy()):
+            show = show_names[code]
+            totals = totals_of[show]
+            missing_from_ascap = sorted(songs[i] for i in range(start, stop) if in_bmi[i] and not in_ascap[i])
+            missing_from_bmi = sorted(songs[i] for i in range(start, stop) if in_ascap[i] and not in_bmi[i])
+
+            # Show info and amounts on the first row, then missing songs in columns
+            show_episodes_sheet.write_row(show_row, 0, [show, totals.ascap_songs, totals.bmi_songs])
+            show_episodes_sheet.write_row(show_row, 5, [totals.bmi_amount, totals.ascap_amount, totals.difference],
+                                          money_format)
+            max_songs = max(len(missing_from_ascap), len(missing_from_bmi))
+            for i in range(max_songs):
+                show_episodes_sheet.write_row(show_row + i, 3, [
+                    missing_from_ascap[i] if i < len(missing_from_ascap) else None,
+                    missing_from_bmi[i] if i < len(missing_from_bmi) else None
+                ])
+            show_row += max(max_songs, 1) + 1  # Add 1 for spacing between shows
+
+            # Episode data
+            for i in range(start, stop):
+                episode_sheet.write_row(episode_row, 0, [show, episodes[i], songs[i], networks[i]])
+                episode_sheet.write_row(episode_row, 4, [ascap_amounts[i], bmi_amounts[i], differences[i]], money_format)
+                episode_row += 1
+
+            # Add a blank row between shows
+            episode_row += 1
+    summary = pd.concat(summaries)
+
+    # Summary sheet, largest differences first
+    summary_df = pd.DataFrame({
+        'Show Name': summary.index.astype(str),
+        'ASCAP Amount': summary['ascap_amount'].to_numpy(dtype=float),
+        'BMI Amount': summary['bmi_amount'].to_numpy(dtype=float),
+        'Difference': summary['difference'].to_numpy(dtype=float),
+        'Match Quality': summary['match_quality'].to_numpy(dtype=float)
+    })
+    largest = np.maximum(summary_df['ASCAP Amount'], summary_df['BMI Amount'])
+    summary_df.insert(4, 'Difference %', np.where(largest > 0, summary_df['Difference'] / largest.where(largest > 0, 1), 0.0))
     summary_df = summary_df.sort_values('Difference', ascending=False)
     
     # Write summary sheet
-    summary_sheet = workbook.add_worksheet('Summary')
     summary_sheet.write_row(0, 0, summary_df.columns, header_format)
-    
-    for i, row in enumerate(summary_df.values, 1):
-        summary_sheet.write(i, 0, str(row[0]))  # Show Name
-        summary_sheet.write(i, 1, float(row[1]), money_format)  # ASCAP Amount
-        summary_sheet.write(i, 2, float(row[2]), money_format)  # BMI Amount
-        summary_sheet.write(i, 3, float(row[3]), money_format)  # Difference
-        summary_sheet.write(i, 4, float(row[4]), percent_format)  # Difference %
-        summary_sheet.write(i, 5, float(row[5]))  # Match Quality
-
-    # Episode breakdown sheet
-    episode_sheet = workbook.add_worksheet('Episode Breakdown')
-    current_row = 0
-    
-    episode_headers = ['Show Name', 'Episode Title', 'Song Title', 'Network', 'ASCAP Amount', 'BMI Amount', 'Difference']
-    episode_sheet.write_row(current_row, 0, episode_headers, header_format)
-    current_row += 1
-    
-    for show, episodes in episode_matches.items():
-        ascap_episodes = episodes['ascap_episodes']
-        bmi_episodes = episodes['bmi_episodes']
-        
-        # Create a mapping of episode+song combinations
-        episode_song_map = {}
-        
-        # Process ASCAP episodes
-        for ep in ascap_episodes:
-            key = (ep['Program Name'], ep['Work Title'])
-            network = str(ep['Network Service']) if pd.notna(ep['Network Service']) else ''
-            if key not in episode_song_map:
-                episode_song_map[key] = {'ascap': float(ep['Dollars']), 'bmi': 0.0, 'network': network}
-            else:
-                episode_song_map[key]['ascap'] = float(ep['Dollars'])
-                
-        # Process BMI episodes
-        for ep in bmi_episodes:
-            key = (ep['EPISODE NAME'], ep['TITLE NAME'])
-            network = str(ep['PERF SOURCE']) if pd.notna(ep['PERF SOURCE']) else ''
-            if key not in episode_song_map:
-                episode_song_map[key] = {'ascap': 0.0, 'bmi': float(ep['ROYALTY AMOUNT']), 'network': network}
-            else:
-                episode_song_map[key]['bmi'] = float(ep['ROYALTY AMOUNT'])
-        
-        # Write episode data
-        for (episode, song), amounts in episode_song_map.items():
-            episode_sheet.write(current_row, 0, str(show))
-            episode_sheet.write(current_row, 1, str(episode) if pd.notna(episode) else '')
-            episode_sheet.write(current_row, 2, str(song) if pd.notna(song) else '')
-            episode_sheet.write(current_row, 3, str(amounts['network']))
-            episode_sheet.write(current_row, 4, amounts['ascap'], money_format)
-            episode_sheet.write(current_row, 5, amounts['bmi'], money_format)
-            diff = abs(amounts['ascap'] - amounts['bmi'])
-            episode_sheet.write(current_row, 6, diff, money_format)
-            current_row += 1
-        
-        # Add a blank row between shows
-        current_row += 1
-
-    # Songs only in ASCAP sheet
-    ascap_only_sheet = workbook.add_worksheet('Songs Only in ASCAP')
-    ascap_headers = ['Show Name', 'Episode', 'Song Title', 'Network', 'Amount']
-    ascap_only_sheet.write_row(0, 0, ascap_headers, header_format)
-    
-    for i, song in enumerate(songs_only_in_ascap, 1):
-        ascap_only_sheet.write(i, 0, str(song['show']) if pd.notna(song['show']) else '')
-        ascap_only_sheet.write(i, 1, str(song['episode']) if pd.notna(song['episode']) else '')
-        ascap_only_sheet.write(i, 2, str(song['song']) if pd.notna(song['song']) else '')
-        ascap_only_sheet.write(i, 3, str(song['network']) if pd.notna(song['network']) else '')
-        ascap_only_sheet.write(i, 4, float(song['amount']), money_format)
-
-    # Songs only in BMI sheet
-    bmi_only_sheet = workbook.add_worksheet('Songs Only in BMI')
-    bmi_headers = ['Show Name', 'Episode', 'Song Title', 'Network', 'Amount']
-    bmi_only_sheet.write_row(0, 0, bmi_headers, header_format)
-    
-    for i, song in enumerate(songs_only_in_bmi, 1):
-        bmi_only_sheet.write(i, 0, str(song['show']) if pd.notna(song['show']) else '')
-        bmi_only_sheet.write(i, 1, str(song['episode']) if pd.notna(song['episode']) else '')
-        bmi_only_sheet.write(i, 2, str(song['song']) if pd.notna(song['song']) else '')
-        bmi_only_sheet.write(i, 3, str(song['network']) if pd.notna(song['network']) else '')
-        bmi_only_sheet.write(i, 4, float(song['amount']), money_format)
+    columns = zip(summary_df['Show Name'].tolist(),
+                  summary_df['ASCAP Amount'].tolist(),
+                  summary_df['BMI Amount'].tolist(),
+                  summary_df['Difference'].tolist(),
+                  summary_df['Difference %'].tolist(),
+                  summary_df['Match Quality'].tolist())
+    for i, (show, ascap_amount, bmi_amount, diff, diff_percent, match_quality) in enumerate(columns, 1):
+        summary_sheet.write(i, 0, show)
+        summary_sheet.write_row(i, 1, [ascap_amount, bmi_amount, diff], money_format)
+        summary_sheet.write(i, 4, diff_percent, percent_format)
+        summary_sheet.write(i, 5, match_quality)
+
+    # Songs only in ASCAP / BMI sheets
+    ascap_only_sheet = write_songs_sheet(workbook, 'Songs Only in ASCAP', songs_only_in_ascap, header_format, money_format)
+    bmi_only_sheet = write_songs_sheet(workbook, 'Songs Only in BMI', songs_only_in_bmi, header_format, money_format)
 
     # Adjust column widths
     for sheet in [summary_sheet, episode_sheet, ascap_only_sheet, bmi_only_sheet]:
@@ -276,144 +416,165 @@ def create_excel_report(ascap_df, bmi_df, matches, episode_matches, only_in_asca
     print(f"Excel report created successfully: {output_file}")
     return output_file
 
-def compare_earnings(ascap_path, bmi_path):
+def match_shows(ascap_shows, bmi_shows, aliases=None, profile=None):
     """
-    Compare earnings data between ASCAP and BMI files with enhanced matching and reporting
+    Match ASCAP to BMI clean show names: exact matches, then stored aliases,
+    then one-to-one fuzzy matches. Returns (matches, only_in_ascap,
+    only_in_bmi); matches maps each ASCAP show to its ShowMatch.
     """
-    try:
-        # Read CSVs with low_memory=False to handle mixed types
-        ascap_df = pd.read_csv(ascap_path, low_memory=False)
-        bmi_df = pd.read_csv(bmi_path, low_memory=False)
-    except Exception as e:
-        print(f"Error reading CSV files: {str(e)}")
-        return
+    profile = profile or RunProfile()
 
-    # Clean and normalize show names and song titles
-    ascap_df['clean_name'] = ascap_df['Series or Film/Attraction'].apply(clean_show_name)
-    bmi_df['clean_name'] = bmi_df['SHOW NAME'].apply(clean_show_name)
-    
-    ascap_df['clean_song_title'] = ascap_df['Work Title'].apply(clean_song_title)
-    bmi_df['clean_song_title'] = bmi_df['TITLE NAME'].apply(clean_song_title)
-
-    # Create sets of unique shows and songs
-    ascap_shows = set(ascap_df['clean_name'].dropna())
-    bmi_shows = set(bmi_df['clean_name'].dropna())
-    
     # Initialize matching results
     matches = {}
-    episode_matches = {}
     only_in_ascap = set()
     only_in_bmi = set()
-    songs_only_in_ascap = []
-    songs_only_in_bmi = []
-
-    # First, find exact matches
-    exact_matches = ascap_shows.intersection(bmi_shows)
-    for show in exact_matches:
-        ascap_rows = ascap_df[ascap_df['clean_name'] == show]
-        bmi_rows = bmi_df[bmi_df['clean_name'] == show]
-        
-        ascap_amount = ascap_rows['Dollars'].sum()
-        bmi_amount = bmi_rows['ROYALTY AMOUNT'].sum()
-        
-        # Group by episode
-        ascap_episodes = ascap_rows.groupby(['Program Name', 'Work Title']).agg({
-            'Dollars': 'sum',
-            'Network Service': 'first'
-        }).reset_index()
-        
-        bmi_episodes = bmi_rows.groupby(['EPISODE NAME', 'TITLE NAME']).agg({
-            'ROYALTY AMOUNT': 'sum',
-            'PERF SOURCE': 'first'  # Using PERF SOURCE as network
-        }).reset_index()
-        
-        # Store episode-level data
-        episode_matches[show] = {
-            'ascap_episodes': ascap_episodes.to_dict('records'),
-            'bmi_episodes': bmi_episodes.to_dict('records')
-        }
-        
-        # Store show-level data
-        matches[show] = {
-            'ascap_amount': ascap_amount,
-            'bmi_amount': bmi_amount,
-            'match_quality': 100
-        }
-
-    # Then, try fuzzy matching for remaining shows
-    remaining_ascap = ascap_shows - exact_matches
-    remaining_bmi = bmi_shows - exact_matches
-
-    for ascap_show in remaining_ascap:
-        similar_shows = find_similar_shows(ascap_show, remaining_bmi)
-        if similar_shows:
-            best_match, match_quality = similar_shows[0]
-            if match_quality >= 85:  # Only consider high-quality matches
-                ascap_rows = ascap_df[ascap_df['clean_name'] == ascap_show]
-                bmi_rows = bmi_df[bmi_df['clean_name'] == best_match]
-                
-                ascap_amount = ascap_rows['Dollars'].sum()
-                bmi_amount = bmi_rows['ROYALTY AMOUNT'].sum()
-                
-                # Group by episode
-                ascap_episodes = ascap_rows.groupby(['Program Name', 'Work Title']).agg({
-                    'Dollars': 'sum',
-                    'Network Service': 'first'
-                }).reset_index()
-                
-                bmi_episodes = bmi_rows.groupby(['EPISODE NAME', 'TITLE NAME']).agg({
-                    'ROYALTY AMOUNT': 'sum',
-                    'PERF SOURCE': 'first'  # Using PERF SOURCE as network
-                }).reset_index()
-                
-                # Store episode-level data
-                episode_matches[ascap_show] = {
-                    'ascap_episodes': ascap_episodes.to_dict('records'),
-                    'bmi_episodes': bmi_episodes.to_dict('records')
-                }
-                
-                matches[ascap_show] = {
-                    'ascap_amount': ascap_amount,
-                    'bmi_amount': bmi_amount,
-                    'match_quality': match_quality
-                }
+
+    with profile.stage('exact_matching') as stage:
+        # First, find exact matches
+        exact_matches = ascap_shows.intersection(bmi_shows)
+        for show in exact_matches:
+            matches[show] = ShowMatch(show, 100)
+
+        # Then, try fuzzy matching for remaining shows
+        remaining_ascap = ascap_shows - exact_matches
+        remaining_bmi = bmi_shows - exact_matches
+        stage.update(ascap_shows=len(ascap_shows), bmi_shows=len(bmi_shows), matched=len(exact_matches))
+
+    # Known aliases are resolved by lookup: confirmed ones, and automatic ones this matcher
+    # would still accept. Shows are taken in sorted order so the result never depends on
+    # set iteration order
+    if aliases is not None:
+        with profile.stage('alias_lookup') as stage:
+            known = aliases.lookup(remaining_ascap, matcher_version=MATCHER_VERSION, threshold=FUZZY_MATCH_THRESHOLD)
+            for ascap_show, (bmi_show, score, confirmed) in sorted(known.items()):
+                if bmi_show in remaining_bmi:
+                    matches[ascap_show] = ShowMatch(bmi_show, score)
+                    remaining_ascap.remove(ascap_show)
+                    remaining_bmi.remove(bmi_show)
+            stage['matched'] = len(matches) - len(exact_matches)
+
+    # Score only the candidate pairs that can reach the threshold, in one batched pass,
+    # then assign shows one-to-one by best score across all pairs
+    with profile.stage('fuzzy_matching') as stage:
+        candidates = find_candidate_matches(remaining_ascap, remaining_bmi, threshold=FUZZY_MATCH_THRESHOLD)
+        assignment = assign_matches(candidates)
+
+        new_aliases = []
+        for ascap_show in sorted(remaining_ascap):
+            if ascap_show in assignment:
+                best_match, match_quality = assignment[ascap_show]
+                matches[ascap_show] = ShowMatch(best_match, match_quality)
                 remaining_bmi.remove(best_match)
+                new_aliases.append((ascap_show, best_match, match_quality))
             else:
                 only_in_ascap.add(ascap_show)
-        else:
-            only_in_ascap.add(ascap_show)
+
+        mean_quality = sum(score for _, score in assignment.values()) / len(assignment) if assignment else 0
+        stage.update(ascap_shows=len(remaining_ascap), bmi_shows=len(remaining_bmi) + len(assignment),
+                     candidate_pairs=sum(len(similar_shows) for similar_shows in candidates.values()),
+                     matched=len(assignment), mean_score=round(mean_quality, 1))
+    print(f"Fuzzy matching: {stage['matched']} of {stage['ascap_shows']} shows matched from {stage['candidate_pairs']} "
+          f"candidate pairs against {stage['bmi_shows']} BMI shows, mean score {mean_quality:.1f}, in {stage['seconds']:.2f}s")
+
+    if aliases is not None and new_aliases:
+        aliases.record(new_aliases, MATCHER_VERSION, FUZZY_MATCH_THRESHOLD)
 
     # Add remaining BMI shows to unmatched
     only_in_bmi.update(remaining_bmi)
 
-    # Get detailed information for songs only in ASCAP
-    for show in only_in_ascap:
-        ascap_rows = ascap_df[ascap_df['clean_name'] == show]
-        for _, row in ascap_rows.iterrows():
-            songs_only_in_ascap.append({
-                'show': show,
-                'episode': row['Program Name'],
-                'song': row['Work Title'],
-                'network': row['Network Service'],
-                'amount': row['Dollars']
-            })
-
-    # Get detailed information for songs only in BMI
-    for show in only_in_bmi:
-        bmi_rows = bmi_df[bmi_df['clean_name'] == show]
-        for _, row in bmi_rows.iterrows():
-            songs_only_in_bmi.append({
-                'show': show,
-                'episode': row['EPISODE NAME'],
-                'song': row['TITLE NAME'],
-                'network': row['PERF SOURCE'],
-                'amount': row['ROYALTY AMOUNT']
-            })
+    return matches, only_in_ascap, only_in_bmi
+
+def run_comparison(ascap_path, bmi_path, output_file=None, engine='pandas', cache=None, digests=None, aliases=None,
+                   profile=None, results=None, result_id=None, memory_budget_mb=None, spill_dir=None):
+    """
+    Compare earnings data between ASCAP and BMI files and write the Excel report
+
+    Returns a dict with the report path, the outcome counts and the per-stage
+    profile (see RunProfile), or None if the statements could not be read. output_file defaults to a timestamped
+    name in the working directory.
+
+    engine selects the CSV parser: 'pandas' (default) or the multithreaded 'arrow' reader.
+    cache is an optional ParseCache; unchanged statements are then loaded from it already
+    parsed and normalized. digests can give the SHA-256 of the 'ascap' and 'bmi' files when
+    the caller already hashed them while receiving them. aliases is an optional AliasStore:
+    shows with a stored alias skip fuzzy matching, and new fuzzy matches are recorded in it.
+    profile is an optional RunProfile to record the stages in, e.g. one with a progress listener.
+    results is an optional ResultStore that gets the report's rows under result_id, for queries.
+
+    With memory_budget_mb, the statements are never loaded whole: they are
+    streamed in chunks and partitioned by show through spill files in
+    spill_dir (see out_of_core.py), and engine and cache are not used.
+    """
+    profile = profile or RunProfile()
+    if memory_budget_mb:
+        from out_of_core import partitioned_comparison
+
+        with tempfile.TemporaryDirectory(prefix='comparison-', dir=spill_dir) as spill:
+            try:
+                compared = partitioned_comparison(ascap_path, bmi_path, spill, memory_budget_mb,
+                                                  aliases=aliases, profile=profile)
+            except Exception as e:
+                print(f"Error reading CSV files: {str(e)}")
+                return
+            return finish_comparison(*compared, output_file=output_file, profile=profile, results=results,
+                                     result_id=result_id)
+
+    digests = digests or {}
+    try:
+        # Read only the columns we use, with float amounts and categorical strings,
+        # and clean show names and song titles (distinct values only)
+        ascap_df = load_statement(ascap_path, 'ascap', engine=engine, cache=cache, digest=digests.get('ascap'),
+                                  profile=profile)
+        bmi_df = load_statement(bmi_path, 'bmi', engine=engine, cache=cache, digest=digests.get('bmi'),
+                                profile=profile)
+    except Exception as e:
+        print(f"Error reading CSV files: {str(e)}")
+        return
+
+    matches, only_in_ascap, only_in_bmi = match_shows(set(ascap_df['clean_name'].dropna()),
+                                                      set(bmi_df['clean_name'].dropna()),
+                                                      aliases=aliases, profile=profile)
+
+    # Reconcile episodes and songs of all matched shows in one merge
+    with profile.stage('reconciliation') as stage:
+        reconciliation = reconcile_episodes(aggregate_episodes(ascap_df, ASCAP_COLUMNS),
+                                            aggregate_episodes(bmi_df, BMI_COLUMNS), matches)
+        stage['rows'] = len(reconciliation)
+
+    # Get detailed information for songs only in ASCAP / BMI in one selection each
+    with profile.stage('unmatched_rows') as stage:
+        songs_only_in_ascap = unmatched_songs(ascap_df, only_in_ascap, ASCAP_COLUMNS)
+        songs_only_in_bmi = unmatched_songs(bmi_df, only_in_bmi, BMI_COLUMNS)
+        stage.update(ascap_rows=len(songs_only_in_ascap), bmi_rows=len(songs_only_in_bmi))
+
+    return finish_comparison(matches, only_in_ascap, only_in_bmi, reconciliation, songs_only_in_ascap,
+                             songs_only_in_bmi, output_file=output_file, profile=profile, results=results,
+                             result_id=result_id)
+
+def finish_comparison(matches, only_in_ascap, only_in_bmi, reconciliation, songs_only_in_ascap, songs_only_in_bmi,
+                      output_file=None, profile=None, results=None, result_id=None):
+    """Store the results, write the Excel report and return run_comparison's dict"""
+    profile = profile or RunProfile()
+    counts = {
+        'matched_shows': len(matches),
+        'only_in_ascap': len(only_in_ascap),
+        'only_in_bmi': len(only_in_bmi),
+        'songs_only_in_ascap': len(songs_only_in_ascap),
+        'songs_only_in_bmi': len(songs_only_in_bmi)
+    }
+    if results is not None:
+        with profile.stage('result_store') as stage:
+            store_results(results, result_id, matches, reconciliation, songs_only_in_ascap, songs_only_in_bmi, counts)
+            stage['rows'] = len(matches) + len(reconciliation) + len(songs_only_in_ascap) + len(songs_only_in_bmi)
 
     # Generate Excel report
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    excel_file = f'earnings_comparison_report_{timestamp}.xlsx'
-    create_excel_report(ascap_df, bmi_df, matches, episode_matches, only_in_ascap, only_in_bmi, songs_only_in_ascap, songs_only_in_bmi, excel_file)
+    if output_file is None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_file = f'earnings_comparison_report_{timestamp}.xlsx'
+    excel_file = output_file
+    with profile.stage('excel_report') as stage:
+        create_excel_report(matches, reconciliation, songs_only_in_ascap, songs_only_in_bmi, excel_file)
+        stage['rows'] = len(reconciliation) + len(songs_only_in_ascap) + len(songs_only_in_bmi)
     
     print(f"\nAnalysis complete! Excel report generated: {excel_file}")
     print(f"Total shows analyzed: {len(matches)}")
@@ -422,14 +583,19 @@ def compare_earnings(ascap_path, bmi_path):
     print(f"Songs only in ASCAP: {len(songs_only_in_ascap)}")
     print(f"Songs only in BMI: {len(songs_only_in_bmi)}")
     
-    return excel_file  # Return the path to the generated Excel file
+    return {'report_path': excel_file, **counts, 'profile': profile.as_dict()}
+
+def compare_earnings(ascap_path, bmi_path, engine='pandas', cache=None, digests=None, aliases=None):
+    """
+    Compare earnings data between ASCAP and BMI files with enhanced matching and reporting
+
+    Returns the path of the Excel report, or None if the statements could not be read.
+    See run_comparison for the options.
+    """
+    result = run_comparison(ascap_path, bmi_path, engine=engine, cache=cache, digests=digests, aliases=aliases)
+    return result['report_path'] if result else None
 
 if __name__ == '__main__':
-    # Files to compare
-    ascap_file = "/Users/test/Desktop/PROJECTS/amoia/ASCAP 4TH 2023.csv"
-    bmi_file = "/Users/test/Desktop/PROJECTS/amoia/BMI 4TH 2023.csv"
-
-    if not os.path.exists(ascap_file) or not os.path.exists(bmi_file):
-        print("Error: One or both CSV files not found!")
-    else:
-        compare_earnings(ascap_file, bmi_file)
+    # Command-line entry point: see batch_compare.py
+    from batch_compare import main
+    raise SystemExit(main())
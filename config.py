@@ -4,9 +4,53 @@ import os
 GOOGLE_CLOUD_PROJECT = os.getenv('GOOGLE_CLOUD_PROJECT', 'amoia-451501')  # Your project ID
 GOOGLE_CLOUD_STORAGE_BUCKET = os.getenv('GOOGLE_CLOUD_STORAGE_BUCKET', 'amoiabucket')  # Your bucket name
 
+# Storage backend: 'gcs' (bucket above) or 'local' (directory, for offline runs and benchmarks)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'gcs')
+LOCAL_STORAGE_DIR = os.getenv('LOCAL_STORAGE_DIR', 'storage')
+
 # Local settings
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
 MAX_CONTENT_LENGTH = int(os.getenv('MAX_UPLOAD_SIZE', 300 * 1024 * 1024))  # 300MB max file size
+# Limit on a statement once gzip-decompressed, so a small .csv.gz cannot expand without bound
+MAX_DECOMPRESSED_BYTES = int(os.getenv('MAX_DECOMPRESSED_BYTES', 1024 * 1024 * 1024))  # 1GB
+
+# Chunked uploads (/uploads): each chunk is its own request, so a dropped connection only
+# loses one chunk; MAX_UPLOAD_SIZE limits each file as sent (usually gzip-compressed)
+RESUMABLE_UPLOAD_DIR = os.getenv('RESUMABLE_UPLOAD_DIR', os.path.join(UPLOAD_FOLDER, 'resumable'))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv('UPLOAD_CHUNK_MAX_BYTES', 8 * 1024 * 1024))
+
+# Comparison settings
+CSV_READER_ENGINE = os.getenv('CSV_READER_ENGINE', 'pandas')  # 'pandas' or 'arrow' (multithreaded, needs pyarrow)
+
+# Parsed statement cache, kept on the uploads disk; 0 disables it
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'parse_cache'))
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1GB of the 2GB disk
+
+# Bounded-memory comparisons: statements are streamed and partitioned by show through spill
+# files instead of being loaded whole, in about this much memory per job; 0 loads them whole
+COMPARISON_MEMORY_BUDGET_MB = float(os.getenv('COMPARISON_MEMORY_BUDGET_MB', 0))
+SPILL_DIR = os.getenv('SPILL_DIR', os.path.join(UPLOAD_FOLDER, 'spill'))
+
+# Show aliases learned by fuzzy matching, reused by later runs
+ALIAS_DB_PATH = os.getenv('ALIAS_DB_PATH', os.path.join(UPLOAD_FOLDER, 'show_aliases.sqlite3'))
+
+# Comparison results kept for the JSON query endpoints (/jobs/<job_id>/results)
+RESULT_DB_PATH = os.getenv('RESULT_DB_PATH', os.path.join(UPLOAD_FOLDER, 'results.sqlite3'))
+
+# Background comparison jobs
+JOB_STATE_DIR = os.getenv('JOB_STATE_DIR', os.path.join(UPLOAD_FOLDER, 'jobs'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))  # Comparisons running at once
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', 8))  # Queued plus running before /upload answers 429
+
+# Progress streams (/jobs/<job_id>/events): each open stream holds a request thread, so each
+# worker keeps at most this many open (the page polls above that) and ends every stream
+# after this many seconds; the browser then reconnects by itself
+MAX_EVENT_STREAMS = int(os.getenv('MAX_EVENT_STREAMS', 2))
+EVENT_STREAM_SECONDS = float(os.getenv('EVENT_STREAM_SECONDS', 30))
+
+# Metrics: directory shared by the gunicorn workers so /metrics covers all of them;
+# empty keeps metrics per process
+METRICS_DIR = os.getenv('METRICS_DIR', '')
 
 # Flask settings
 DEBUG = os.getenv('FLASK_ENV') == 'development'
@@ -0,0 +1,7 @@
+# Read by gunicorn from the working directory; command-line flags take precedence.
+
+def when_ready(server):
+    """With --preload, import the comparison stack once in the master so forked workers share it"""
+    if server.cfg.preload_app:
+        import compare_earnings  # noqa: F401  (pandas, numpy, rapidfuzz, xlsxwriter)
+        server.log.info("Preloaded comparison modules")
@@ -0,0 +1,79 @@
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class RunProfile:
+    """
+    Per-stage wall time, memory and counts of one comparison run.
+
+    Each stage records its wall time, the process's peak RSS once it is
+    done (a high-water mark for the whole process, so it only grows) and,
+    while tracemalloc is tracing, the peak Python allocation during the
+    stage. Counts are set on the dict yielded by stage().
+
+    listener, if given, is called as listener(name, None) when a stage
+    starts and listener(name, record) when it ends, for progress reporting;
+    it is only called at stage boundaries, never from inner loops.
+    """
+
+    def __init__(self, listener=None):
+        self.stages = []
+        self.listener = listener
+
+    def _notify(self, name, record):
+        if self.listener is None:
+            return
+        try:
+            self.listener(name, record)
+        except Exception as e:
+            # Progress is best effort and must never fail the run
+            logger.warning(f"Progress listener failed: {str(e)}")
+
+    @contextmanager
+    def stage(self, name, **counts):
+        record = {'stage': name}
+        record.update(counts)
+        self._notify(name, None)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            if tracing:
+                record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            self.stages.append(record)
+            self._notify(name, record)
+
+    def as_dict(self):
+        return {
+            'total_seconds': round(sum(record['seconds'] for record in self.stages), 4),
+            'peak_rss_mb': max((record['peak_rss_mb'] for record in self.stages), default=round(peak_rss_mb(), 1)),
+            'stages': self.stages
+        }
+
+def format_profile(profile):
+    """Stage table for a profile dict, one line per stage"""
+    lines = [f"{'Stage':<20} {'Seconds':>9} {'Peak RSS MB':>12} {'Traced MB':>10}  Counts"]
+    for record in profile['stages']:
+        counts = ', '.join(f'{key}={value}' for key, value in record.items()
+                           if key not in ('stage', 'seconds', 'peak_rss_mb', 'traced_peak_mb'))
+        traced = record.get('traced_peak_mb')
+        lines.append(f"{record['stage']:<20} {record['seconds']:>9.3f} {record['peak_rss_mb']:>12.1f} "
+                     f"{'' if traced is None else f'{traced:.1f}':>10}  {counts}")
+    lines.append(f"{'total':<20} {profile['total_seconds']:>9.3f} {profile['peak_rss_mb']:>12.1f}")
+    return '\n'.join(lines)
@@ -0,0 +1,260 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+JOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be queued"""
+
+class JobManager:
+    """
+    Runs comparison jobs on a bounded thread pool.
+
+    At most max_workers jobs run at once and at most max_pending jobs are
+    queued or running; submit raises JobQueueFull beyond that. Job state is
+    kept as one JSON file per job in state_dir so any worker process can
+    answer status requests. submit_unique also records which job handles
+    a key (under state_dir/keys), so identical requests share one job.
+
+    State files outlive the process, so each queued or running job records
+    its owner (host, pid and a per-process id) and a heartbeat the owner
+    refreshes every heartbeat_interval seconds. A job whose heartbeat is
+    older than stale_after, or whose pid now belongs to a new process, was
+    lost with its process: it is marked failed when it is looked up and at
+    startup, so submit_unique starts a fresh job for its key.
+    """
+
+    def __init__(self, state_dir, max_workers=2, max_pending=8, retention=24 * 3600, heartbeat_interval=10,
+                 stale_after=60):
+        self.state_dir = state_dir
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='comparison-job')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.key_lock = threading.Lock()
+        # Serializes read-modify-write of state files between job threads and the heartbeat
+        self.state_lock = threading.Lock()
+        self.local = threading.local()
+        self.active = set()
+        self._pid = None
+        self._owner = None
+        self._heartbeat = None
+        self.key_dir = os.path.join(state_dir, 'keys')
+        os.makedirs(self.key_dir, exist_ok=True)
+        self.recover()
+
+    @property
+    def owner(self):
+        """This process's owner record; a new one after a fork so preloaded workers never share one"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._owner = {'host': socket.gethostname(), 'pid': self._pid, 'process': uuid.uuid4().hex}
+            self._heartbeat = None  # Threads do not survive a fork
+        return self._owner
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return the new job id"""
+        if not self.slots.acquire(blocking=False):
+            raise JobQueueFull("Too many comparisons in progress, please try again shortly")
+
+        self.prune()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.active.add(job_id)
+        self._write(job_id, {'job_id': job_id, 'status': 'queued', 'created_at': now, 'owner': self.owner,
+                             'heartbeat_at': now})
+        self._start_heartbeat()
+        try:
+            self.executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            self.active.discard(job_id)
+            self.slots.release()
+            raise
+        return job_id
+
+    def submit_unique(self, key, func, *args, **kwargs):
+        """
+        Like submit, unless a job with the same key is queued, running or done:
+        then that job's id is returned instead. Returns (job_id, created).
+        """
+        with self._key_locked(key) as key_path:
+            job_id = self._keyed_job(key_path)
+            if job_id is not None:
+                return job_id, False
+            job_id = self.submit(func, *args, **kwargs)
+            self._write_json(key_path, {'job_id': job_id})
+            return job_id, True
+
+    def add_key(self, key):
+        """
+        Make submit_unique(key) return the job running on this thread too,
+        unless the key already has a queued, running or done job
+        """
+        job_id = getattr(self.local, 'job_id', None)
+        if job_id is None:
+            return
+        with self._key_locked(key) as key_path:
+            if self._keyed_job(key_path) is None:
+                self._write_json(key_path, {'job_id': job_id})
+
+    @contextmanager
+    def _key_locked(self, key):
+        """Path of a key's file, held by one thread of one process at a time"""
+        if not JOB_KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid job key: {key}")
+        # Threads of this process, then other worker processes, one at a time per key
+        with self.key_lock, open(os.path.join(self.key_dir, f'{key}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield os.path.join(self.key_dir, f'{key}.json')
+
+    def _keyed_job(self, key_path):
+        """Id of the queued, running or done job a key file points at, or None"""
+        try:
+            with open(key_path) as f:
+                job_id = json.load(f)['job_id']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        job = self.get(job_id)
+        if job is not None and job['status'] in ('queued', 'running', 'done'):
+            return job_id
+        return None
+
+    def get(self, job_id):
+        """State dict of a job, or None if the id is unknown; a lost job is marked failed first"""
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        state = self._read(job_id)
+        if state is not None and self._is_lost(state):
+            state = self._mark_lost(job_id)
+        return state
+
+    def update(self, job_id, **fields):
+        with self.state_lock:
+            state = self._read(job_id) or {'job_id': job_id}
+            state.update(fields)
+            self._write(job_id, state)
+        return state
+
+    def recover(self):
+        """Mark queued or running jobs lost with their process (e.g. before a restart) as failed"""
+        for name in os.listdir(self.state_dir):
+            if name.endswith('.json'):
+                self.get(name[:-len('.json')])
+
+    def report_progress(self, stage, record=None):
+        """
+        Record that the job running on this thread started (record is None) or
+        finished a stage; a RunProfile listener. Does nothing outside a job.
+        """
+        job_id = getattr(self.local, 'job_id', None)
+        if job_id is None:
+            return
+        with self.state_lock:
+            state = self._read(job_id) or {'job_id': job_id}
+            progress = state.get('progress') or {'completed': []}
+            if record is None:
+                progress['stage'] = stage
+            else:
+                progress['stage'] = None
+                progress['completed'].append({key: value for key, value in record.items()
+                                              if key not in ('peak_rss_mb', 'traced_peak_mb')})
+            state['progress'] = progress
+            self._write(job_id, state)
+
+    def prune(self):
+        """Remove state files of jobs older than the retention period"""
+        cutoff = time.time() - self.retention
+        for directory in (self.state_dir, self.key_dir):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if name.endswith(('.json', '.lock')) and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _run(self, job_id, func, args, kwargs):
+        self.local.job_id = job_id
+        try:
+            self.update(job_id, status='running', started_at=time.time())
+            result = func(*args, **kwargs)
+            self.update(job_id, status='done', finished_at=time.time(), result=result)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self.update(job_id, status='failed', finished_at=time.time(), error=str(e))
+        finally:
+            self.local.job_id = None
+            self.active.discard(job_id)
+            self.slots.release()
+
+    def _is_lost(self, state):
+        if state.get('status') not in ('queued', 'running'):
+            return False
+        owner = state.get('owner') or {}
+        if owner.get('process') == self.owner['process']:
+            return state['job_id'] not in self.active
+        if owner.get('host') == self.owner['host'] and owner.get('pid') == self.owner['pid']:
+            return True  # This pid belonged to an earlier process, e.g. before a container restart
+        heartbeat = state.get('heartbeat_at') or state.get('created_at') or 0
+        return time.time() - heartbeat > self.stale_after
+
+    def _mark_lost(self, job_id):
+        with self.state_lock:
+            state = self._read(job_id)
+            if state is not None and self._is_lost(state):
+                logger.warning(f"Job {job_id} was lost with the process running it")
+                state.update(status='failed', finished_at=time.time(),
+                             error="The comparison was interrupted, please upload the files again")
+                self._write(job_id, state)
+        return state
+
+    def _start_heartbeat(self):
+        self.owner  # Refreshes the heartbeat thread after a fork
+        with self.state_lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True, name='job-heartbeat')
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            for job_id in list(self.active):
+                with self.state_lock:
+                    state = self._read(job_id)
+                    if state is not None and state.get('status') in ('queued', 'running'):
+                        state['heartbeat_at'] = time.time()
+                        self._write(job_id, state)
+
+    def _read(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _write(self, job_id, state):
+        self._write_json(self._path(job_id), state)
+
+    def _write_json(self, path, data):
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
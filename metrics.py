@@ -0,0 +1,201 @@
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds, from a fast request to a long comparison
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Bytes, from a small statement to the upload limit
+SIZE_BUCKETS = tuple(1024 * 2 ** i for i in range(0, 20, 2))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            values[key] = values.get(key, 0) + amount
+        self.registry._changed()
+
+class Histogram:
+    def __init__(self, registry, name, help, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            state = values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, the +Inf bucket last, then sum
+                state = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+        self.registry._changed()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms, rendered in the Prometheus text
+    exposition format.
+
+    Updates only take a lock and change a dict entry. When directory is
+    set, each process also writes its values to its own JSON file there at
+    most every flush_interval seconds, and render() sums the files of all
+    processes, so any gunicorn worker can answer a scrape for the whole
+    service. Files of exited workers are kept so counters never go back.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._flusher = None
+        self._pid = None
+        self._path = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    @property
+    def path(self):
+        """This process's file; a new one after a fork so preloaded workers never share one"""
+        if self.directory and self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+            self._flusher = None  # Threads do not survive a fork
+        return self._path
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+        return metric
+
+    def _changed(self):
+        if not self.directory:
+            return
+        self._dirty.set()
+        if self._flusher is None or self._pid != os.getpid():
+            with self.lock:
+                self.path  # Refreshes the file and flusher after a fork
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='metrics-flush')
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: [[list(key), value if isinstance(value, (int, float)) else list(value)]
+                           for key, value in values.items()]
+                    for name, values in self.values.items()}
+
+    def flush(self):
+        """Write this process's values to its file in directory"""
+        if not self.directory:
+            return
+        self._dirty.clear()
+        snapshot = self.snapshot()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def collect(self):
+        """{metric name: {label values: value}} summed over every process"""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith('.json') or path == self.path:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (FileNotFoundError, ValueError):
+                    continue
+
+        totals = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, entries in snapshot.items():
+                if name not in totals:
+                    continue
+                for key, value in entries:
+                    key = tuple(key)
+                    current = totals[name].get(key)
+                    if isinstance(value, list):
+                        totals[name][key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        totals[name][key] = value + (current or 0)
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            kind = 'counter' if isinstance(metric, Counter) else 'histogram'
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.items()):
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(metric.labelnames, key)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(metric.labelnames, key, [("le", _number(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(metric.labelnames, key)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(metric.labelnames, key)} {cumulative}')
+        return '\n'.join(lines) + '\n'
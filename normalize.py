@@ -0,0 +1,72 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Compiled once and shared by every cleaner
+COMM_PROMO_PREFIX = re.compile(r'^\(comm/promo\)\s*')
+SPECIAL_CHARACTERS = re.compile(r'[^\w\s]')
+
+def clean_show_name(name):
+    """Clean show names for better comparison"""
+    if pd.isna(name):
+        return ""
+
+    # Convert to lowercase
+    name = str(name).lower().strip()
+
+    # Remove "(comm/promo)" prefix
+    name = COMM_PROMO_PREFIX.sub('', name)
+
+    # Remove special characters but keep spaces
+    name = SPECIAL_CHARACTERS.sub('', name)
+
+    # Remove extra whitespace
+    name = ' '.join(name.split())
+
+    return name
+
+def clean_song_title(title):
+    """Clean song titles for better comparison"""
+    if pd.isna(title):
+        return ""
+
+    # Convert to lowercase
+    title = str(title).lower().strip()
+
+    # Remove special characters but keep spaces
+    title = SPECIAL_CHARACTERS.sub('', title)
+
+    # Remove extra whitespace
+    title = ' '.join(title.split())
+
+    return title
+
+def normalize_column(values, cleaner):
+    """
+    Clean a column by running the cleaner on its distinct values only.
+
+    Returns a categorical Series of cleaned values: the cleaned uniques are
+    the categories and every row keeps just a code into them, so the cost
+    scales with the number of distinct names rather than the row count.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        uniques = values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+
+    # Missing values have code -1; give them their own slot at the end
+    cleaned = [cleaner(value) for value in uniques] + [cleaner(None)]
+    codes = np.where(codes < 0, len(uniques), codes)
+
+    # Different raw values can clean to the same name, so factorize again
+    clean_codes, clean_uniques = pd.factorize(pd.Index(cleaned, dtype=object))
+    return pd.Series(pd.Categorical.from_codes(clean_codes[codes], clean_uniques),
+                     index=values.index)
+
+def normalize_statement(df, show_column, episode_column, song_column):
+    """Add clean_name, clean_episode and clean_song_title columns to a PRO statement"""
+    df['clean_name'] = normalize_column(df[show_column], clean_show_name)
+    df['clean_episode'] = normalize_column(df[episode_column], clean_song_title)
+    df['clean_song_title'] = normalize_column(df[song_column], clean_song_title)
+    return df
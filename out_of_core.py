@@ -0,0 +1,255 @@
+"""
+Bounded-memory comparison for statements larger than RAM.
+
+Each statement is streamed in chunks; every chunk is normalized and its
+rows are appended to spill files ("buckets") picked by a hash of the clean
+show name, so all rows of a show end up in one bucket, in file order.
+Only the distinct show names are kept in memory, and they are matched
+with the same match_shows() as the in-memory path. The few BMI shows
+matched to an ASCAP show in another bucket are then moved to that bucket.
+Buckets are grouped up to a share of the memory budget, and each group is
+aggregated, reconciled and searched for unmatched songs on its own,
+with its results spilled in turn. The report and result store read the
+results back one group at a time.
+
+Matches and per-show rows are identical to the in-memory path; only the
+order of the shows in the report differs, by group. One show always sits
+in one group, so a single show larger than the budget still goes over it.
+"""
+import math
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from compare_earnings import (ASCAP_COLUMNS, BMI_COLUMNS, aggregate_episodes, match_shows, reconcile_episodes,
+                              unmatched_songs)
+from instrumentation import RunProfile
+from normalize import normalize_statement
+from parse_cache import is_gzip, open_content
+from statement_reader import STATEMENT_SCHEMAS, statement_dtypes
+
+# Shares of the memory budget: one chunk while it is parsed and normalized, and the
+# spilled rows of one group of buckets (both statements), which take about six times
+# their spilled size while they are aggregated and reconciled
+CHUNK_SHARE = 0.1
+GROUP_SHARE = 0.1
+# Parsing a chunk briefly takes about this many times its CSV text size
+PARSE_EXPANSION = 4
+# Spilled (categorical) rows take about this share of their CSV text size
+SPILL_RATIO = 0.5
+# Assumed expansion of gzip statements; gzip only records the size modulo 4GB
+GZIP_RATIO = 10
+MIN_CHUNK_ROWS = 1000
+MAX_BUCKETS = 1024
+SAMPLE_BYTES = 256 * 1024
+
+class SpilledFrames:
+    """
+    Frames pickled one after another into one file and read back one at a
+    time. Iterable any number of times; len() is the total row count.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+
+    def append(self, df):
+        with open(self.path, 'ab') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows += len(df)
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def size(self):
+        """Bytes spilled so far"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+def statement_size(path):
+    """CSV text size of a statement, estimated for gzip files"""
+    size = os.path.getsize(path)
+    return size * GZIP_RATIO if is_gzip(path) else size
+
+def bytes_per_row(path):
+    """Average CSV line length at the start of a statement"""
+    with open_content(path) as f:
+        sample = f.read(SAMPLE_BYTES)
+    return len(sample) / max(sample.count(b'\n'), 1)
+
+def plan_partitions(paths, memory_budget_mb):
+    """(chunk rows, bucket count) keeping chunks and groups of buckets within their budget shares"""
+    budget = memory_budget_mb * 1024 * 1024
+    row_bytes = max(bytes_per_row(path) for path in paths)
+    chunk_rows = max(MIN_CHUNK_ROWS, int(budget * CHUNK_SHARE / (row_bytes * PARSE_EXPANSION)))
+    spilled = sum(statement_size(path) for path in paths) * SPILL_RATIO
+    # Four times the buckets strictly needed, so groups can be balanced from the real sizes
+    buckets = min(MAX_BUCKETS, max(1, 4 * math.ceil(spilled / (budget * GROUP_SHARE))))
+    return chunk_rows, buckets
+
+def show_buckets(names, buckets):
+    """Bucket of each clean show name; a stable hash, the same in every chunk and process"""
+    return (pd.util.hash_array(np.asarray(names, dtype=object)) % np.uint64(buckets)).astype(np.int64)
+
+def compact(df):
+    """Drop categories no row uses, so a bucket's spill only carries its own names"""
+    return df.assign(**{column: df[column].cat.remove_unused_categories() for column in df.columns
+                        if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+def show_mask(df, shows):
+    """Rows of df whose clean show name is in shows, tested once per category rather than per row"""
+    names = df['clean_name'].cat
+    wanted = names.categories.isin(list(shows))
+    codes = names.codes.to_numpy()
+    return wanted[codes] & (codes >= 0)
+
+def concat_frames(frames, empty):
+    """One frame from spilled parts, categoricals unioned so they stay categorical; empty if there are none"""
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return empty
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for column in empty.columns:
+        if isinstance(empty[column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([frame[column] for frame in frames])
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    return pd.DataFrame(columns)
+
+def partition_statement(path, pro, spill_dir, buckets, chunk_rows, profile):
+    """
+    Stream a statement into per-bucket spills. Returns (spills, distinct
+    clean show names, an empty frame with the statement's columns).
+    """
+    schema = STATEMENT_SCHEMAS[pro]
+    spills = [SpilledFrames(os.path.join(spill_dir, f'{pro}-{bucket}.pkl')) for bucket in range(buckets)]
+    shows = set()
+    empty = None
+    with profile.stage(f'partition_{pro}') as stage, open_content(path) as f:
+        reader = pd.read_csv(f, usecols=list(schema.values()), dtype=statement_dtypes(schema), chunksize=chunk_rows)
+        rows = chunks = 0
+        for chunk in reader:
+            normalize_statement(chunk, schema['show'], schema['episode'], schema['song'])
+            if empty is None:
+                empty = compact(chunk.iloc[:0])
+            names = chunk['clean_name'].cat.categories
+            codes = chunk['clean_name'].cat.codes.to_numpy()
+            present = np.unique(codes)
+            shows.update(names[present])
+            row_buckets = show_buckets(names, buckets)[codes]
+            for bucket in np.unique(row_buckets):
+                spills[bucket].append(compact(chunk[row_buckets == bucket]))
+            rows += len(chunk)
+            chunks += 1
+        stage.update(rows=rows, chunks=chunks, shows=len(shows), spilled_mb=round(sum(spill.size for spill in spills) / 1024 ** 2, 1))
+    if empty is None:
+        raise ValueError(f"{pro.upper()} statement has no rows")
+    return spills, shows, empty
+
+def move_matched_shows(bmi_spills, empty, matches, spill_dir, buckets):
+    """
+    Spill the rows of BMI shows matched to an ASCAP show in another bucket into that bucket.
+    Returns (moved spills by target bucket, {source bucket: shows moved away}).
+    """
+    targets = {}
+    for ascap_show, match in matches.items():
+        targets[match.bmi_show] = ascap_show
+    names = list(targets)
+    sources = show_buckets(names, buckets) if names else []
+    destinations = show_buckets(list(targets.values()), buckets) if names else []
+    moved_away = {}
+    destination_of = {}
+    for name, source, destination in zip(names, sources, destinations):
+        if source != destination:
+            moved_away.setdefault(int(source), set()).add(name)
+            destination_of[name] = int(destination)
+
+    moved = [SpilledFrames(os.path.join(spill_dir, f'bmi-moved-{bucket}.pkl')) for bucket in range(buckets)]
+    for source, shows in sorted(moved_away.items()):
+        # The rows moved out of one bucket are a part of it, so they are split in one go
+        rows = concat_frames([frame[show_mask(frame, shows)] for frame in bmi_spills[source]], empty)
+        names = rows['clean_name'].cat
+        # One show always goes to one bucket, so its rows keep their file order
+        row_destinations = np.array([destination_of.get(name, -1) for name in names.categories])[names.codes.to_numpy()]
+        for destination in np.unique(row_destinations):
+            moved[destination].append(compact(rows[row_destinations == destination]))
+    return moved, moved_away
+
+def bucket_groups(sizes, limit):
+    """Consecutive buckets grouped while their spilled bytes stay within limit"""
+    groups = []
+    current = []
+    current_size = 0
+    for bucket, size in enumerate(sizes):
+        if current and current_size + size > limit:
+            groups.append(current)
+            current, current_size = [], 0
+        current.append(bucket)
+        current_size += size
+    if current:
+        groups.append(current)
+    return groups
+
+def partitioned_comparison(ascap_path, bmi_path, spill_dir, memory_budget_mb, aliases=None, profile=None):
+    """
+    Match and reconcile two statements within about memory_budget_mb.
+    Returns the arguments of compare_earnings.finish_comparison: matches,
+    only_in_ascap, only_in_bmi and the reconciliation and unmatched songs
+    as SpilledFrames of whole shows, in spill_dir.
+    """
+    profile = profile or RunProfile()
+    chunk_rows, buckets = plan_partitions([ascap_path, bmi_path], memory_budget_mb)
+    ascap_spills, ascap_shows, ascap_empty = partition_statement(ascap_path, 'ascap', spill_dir, buckets, chunk_rows,
+                                                                 profile)
+    bmi_spills, bmi_shows, bmi_empty = partition_statement(bmi_path, 'bmi', spill_dir, buckets, chunk_rows, profile)
+
+    matches, only_in_ascap, only_in_bmi = match_shows(ascap_shows, bmi_shows, aliases=aliases, profile=profile)
+
+    with profile.stage('move_matched_shows') as stage:
+        moved, moved_away = move_matched_shows(bmi_spills, bmi_empty, matches, spill_dir, buckets)
+        stage.update(shows=sum(len(shows) for shows in moved_away.values()), rows=sum(len(spill) for spill in moved))
+
+    ascap_buckets = dict(zip(matches, show_buckets(list(matches), buckets))) if matches else {}
+    reconciliation = SpilledFrames(os.path.join(spill_dir, 'reconciliation.pkl'))
+    songs_only_in_ascap = SpilledFrames(os.path.join(spill_dir, 'songs-only-ascap.pkl'))
+    songs_only_in_bmi = SpilledFrames(os.path.join(spill_dir, 'songs-only-bmi.pkl'))
+    sizes = [ascap_spills[bucket].size + bmi_spills[bucket].size + moved[bucket].size for bucket in range(buckets)]
+    groups = bucket_groups(sizes, memory_budget_mb * 1024 * 1024 * GROUP_SHARE)
+
+    with profile.stage('reconciliation') as stage:
+        for group in groups:
+            ascap_df = concat_frames([frame for bucket in group for frame in ascap_spills[bucket]], ascap_empty)
+            bmi_frames = []
+            for bucket in group:
+                away = moved_away.get(bucket)
+                bmi_frames += [frame[~show_mask(frame, away)] if away else frame for frame in bmi_spills[bucket]]
+                bmi_frames += list(moved[bucket])
+            bmi_df = concat_frames(bmi_frames, bmi_empty)
+
+            in_group = set(group)
+            group_matches = {show: match for show, match in matches.items()
+                             if ascap_buckets[show] in in_group}
+            reconciliation.append(reconcile_episodes(aggregate_episodes(ascap_df, ASCAP_COLUMNS),
+                                                     aggregate_episodes(bmi_df, BMI_COLUMNS), group_matches))
+            songs_only_in_ascap.append(unmatched_songs(ascap_df, only_in_ascap, ASCAP_COLUMNS))
+            songs_only_in_bmi.append(unmatched_songs(bmi_df, only_in_bmi, BMI_COLUMNS))
+            del ascap_df, bmi_df, bmi_frames
+        stage.update(rows=len(reconciliation), groups=len(groups), buckets=buckets,
+                     ascap_rows=len(songs_only_in_ascap), bmi_rows=len(songs_only_in_bmi))
+
+    return matches, only_in_ascap, only_in_bmi, reconciliation, songs_only_in_ascap, songs_only_in_bmi
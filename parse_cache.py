@@ -0,0 +1,224 @@
+import gzip
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import zlib
+
+from config import MAX_DECOMPRESSED_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the parsed/normalized frame layout or parsing rules change so stale entries are never read
+CACHE_FORMAT_VERSION = 3
+
+# First bytes of every gzip file
+GZIP_MAGIC = b'\x1f\x8b'
+
+def is_gzip(path):
+    """Whether a file is gzip-compressed, by its content rather than its name"""
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+# Largest piece of decompressed output held at once while hashing
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+class ContentTooLarge(ValueError):
+    """Raised when a statement is larger than the limit once decompressed"""
+
+    def __init__(self, max_size):
+        super().__init__(f"Statements are limited to {max_size // (1024 * 1024)}MB once decompressed")
+
+class ContentHasher:
+    """
+    SHA-256 of a statement's content, fed the file's bytes in order as they
+    arrive. Gzip data (any number of members) is decompressed a bounded
+    piece at a time and the decompressed content is hashed, so a compressed
+    statement has the digest of the plain one however it was received.
+    Raises ContentTooLarge past max_size content bytes.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = MAX_DECOMPRESSED_BYTES if max_size is None else max_size
+        self.received = 0  # File bytes fed so far
+        self.size = 0  # Content bytes hashed so far
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._gzip = None  # Unknown until the first two bytes arrive
+        self._decompressor = None
+
+    def update(self, data):
+        self.received += len(data)
+        if self._gzip is None:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return
+            data, self._head = self._head, b''
+            self._gzip = data.startswith(GZIP_MAGIC)
+            if self._gzip:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if not self._gzip:
+            self._add(data)
+            return
+
+        pending = True
+        while data or pending:
+            if self._decompressor.eof:
+                data = data.lstrip(b'\x00')  # Zero padding after a member, as gzip allows
+                if not data:
+                    return
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                out = self._decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            except zlib.error as e:
+                raise ValueError(f"Invalid gzip data: {str(e)}")
+            self._add(out)
+            # A full piece of output may leave more buffered in the decompressor
+            pending = len(out) == DECOMPRESS_CHUNK_SIZE and not self._decompressor.eof
+            data = self._decompressor.unused_data if self._decompressor.eof else self._decompressor.unconsumed_tail
+
+    def hexdigest(self):
+        """Digest of everything fed; the file must be complete"""
+        if self._gzip is None:
+            self._add(self._head)
+            self._head = b''
+        elif self._gzip and not self._decompressor.eof:
+            raise ValueError("Compressed statement is truncated")
+        return self._hash.hexdigest()
+
+    def _add(self, content):
+        self.size += len(content)
+        if self.size > self.max_size:
+            raise ContentTooLarge(self.max_size)
+        self._hash.update(content)
+
+class LimitedReader(io.RawIOBase):
+    """A readable stream that raises ContentTooLarge once more than max_size bytes are read from it"""
+
+    def __init__(self, raw, max_size):
+        self.raw = raw
+        self.max_size = max_size
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        self.size += count
+        if self.size > self.max_size:
+            raise ContentTooLarge(self.max_size)
+        return count
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+def open_content(path, max_size=None):
+    """
+    Binary file object with a statement's content: decompressed for a gzip
+    file, and then limited to max_size bytes (MAX_DECOMPRESSED_BYTES by default)
+    """
+    if not is_gzip(path):
+        return open(path, 'rb')
+    return io.BufferedReader(LimitedReader(gzip.open(path, 'rb'), MAX_DECOMPRESSED_BYTES if max_size is None else max_size))
+
+def file_digest(path, chunk_size=1024 * 1024, max_size=None):
+    """
+    SHA-256 hex digest of a file's content; of the decompressed content for
+    a gzip file (see ContentHasher), so a compressed statement shares its
+    cache entry with the plain one
+    """
+    hasher = ContentHasher(max_size)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class ParseCache:
+    """
+    Content-addressed cache of parsed and normalized statements stored as
+    Feather files in one directory.
+
+    Entries are keyed by the SHA-256 of the CSV content, so an unchanged
+    statement is loaded without parsing it again whatever its file name.
+    The directory is kept under max_bytes by evicting the least recently
+    used entries (hits refresh an entry's modification time).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        if self.enabled and importlib.util.find_spec('pyarrow') is None:  # Feather support
+            logger.warning("pyarrow is not installed, parse cache disabled")
+            self.enabled = False
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, digest, pro):
+        return os.path.join(self.directory, f'{pro}-v{CACHE_FORMAT_VERSION}-{digest}.feather')
+
+    def get(self, digest, pro):
+        """Cached frame for a statement, or None on a miss; unreadable entries are removed"""
+        if not self.enabled:
+            return None
+        import pandas as pd
+
+        path = self.path_for(digest, pro)
+        try:
+            df = pd.read_feather(path)
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, OSError):
+            return None
+        except ValueError as e:
+            # Corrupt or truncated file (pyarrow.ArrowInvalid): parse again and replace it
+            logger.warning(f"Removing unreadable parse cache entry {os.path.basename(path)}: {str(e)}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        logger.info(f"Parse cache hit for {pro} statement {digest[:12]}")
+        return df
+
+    def put(self, digest, pro, df):
+        """Store a frame, then evict old entries to stay within the size budget"""
+        if not self.enabled:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            df.reset_index(drop=True).to_feather(tmp_path)
+            os.replace(tmp_path, self.path_for(digest, pro))
+        except Exception as e:
+            logger.warning(f"Could not write parse cache entry: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.feather'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
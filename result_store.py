@@ -0,0 +1,195 @@
+import base64
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Columns of each result table after comparison (the id of the comparisons row, much
+# smaller in every index entry than the result id) and row_id (the row's position in the report)
+TABLES = {
+    'shows': ['show', 'bmi_show', 'match_quality', 'ascap_songs', 'bmi_songs', 'ascap_amount', 'bmi_amount',
+              'difference'],
+    'episodes': ['show', 'episode', 'song', 'network', 'ascap_amount', 'bmi_amount', 'difference', 'in_ascap', 'in_bmi'],
+    'ascap_only': ['show', 'episode', 'song', 'network', 'amount'],
+    'bmi_only': ['show', 'episode', 'song', 'network', 'amount']
+}
+# The column each table can be sorted and filtered by, besides report order and show
+SORT_COLUMNS = {'shows': 'difference', 'episodes': 'difference', 'ascap_only': 'amount', 'bmi_only': 'amount'}
+BOOLEAN_COLUMNS = {'in_ascap', 'in_bmi'}
+MAX_PAGE_SIZE = 1000
+
+def _schema():
+    statements = [
+        """
+        CREATE TABLE IF NOT EXISTS comparisons (
+            id INTEGER PRIMARY KEY,
+            result_id TEXT NOT NULL UNIQUE,
+            counts TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    ]
+    for table, columns in TABLES.items():
+        sort_column = SORT_COLUMNS[table]
+        statements += [
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                comparison INTEGER NOT NULL,
+                row_id INTEGER NOT NULL,
+                {', '.join(columns)},
+                PRIMARY KEY (comparison, row_id)
+            ) WITHOUT ROWID
+            """,
+            # Show lookups and sorting walk an index in page order, so a page costs the same anywhere in the result
+            f'CREATE INDEX IF NOT EXISTS {table}_show ON {table} (comparison, show, {sort_column}, row_id)',
+            f'CREATE INDEX IF NOT EXISTS {table}_{sort_column} ON {table} (comparison, {sort_column}, row_id)'
+        ]
+    return statements
+
+def encode_cursor(sort, row):
+    """Opaque cursor for the page after row"""
+    value = None if sort is None else row[sort.lstrip('-')]
+    data = json.dumps([sort, value, row['row_id']]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(cursor, sort):
+    """(sort value, row_id) of a cursor made for the same sort"""
+    try:
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("The cursor belongs to a different sort order")
+    return value, row_id
+
+class ResultStore:
+    """
+    Comparison results (show summary, episode reconciliation and the
+    ASCAP-only and BMI-only rows) kept in SQLite so single shows can be
+    looked up without the Excel report.
+
+    Results are stored under a result id, the comparison key, so identical
+    comparisons share them. Queries page with cursors on indexed columns:
+    each page is an index range scan, however deep into the result it is.
+    One SQLite file in WAL mode, opened per call so job threads and worker
+    processes can read while a comparison is being stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in _schema():
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')  # Durable across crashes in WAL mode, far fewer fsyncs
+        try:
+            with conn:  # Commit on success, roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def store(self, result_id, counts, tables):
+        """
+        Replace the results stored under result_id: counts is a dict of outcome
+        counts, tables maps table names to iterables of row tuples in report order
+        """
+        with self._connect() as conn:
+            self._delete(conn, result_id)
+            comparison = conn.execute('INSERT INTO comparisons (result_id, counts, created_at) VALUES (?, ?, ?)',
+                                      (result_id, json.dumps(counts), time.time())).lastrowid
+            for table, rows in tables.items():
+                columns = TABLES[table]
+                placeholders = ','.join('?' * (len(columns) + 2))
+                conn.executemany(f'INSERT INTO {table} VALUES ({placeholders})',
+                                 ((comparison, row_id) + tuple(row) for row_id, row in enumerate(rows)))
+
+    def counts(self, result_id):
+        """Outcome counts of a stored result, or None if there is none"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT counts FROM comparisons WHERE result_id = ?', (result_id,)).fetchone()
+        return None if row is None else json.loads(row['counts'])
+
+    def query(self, result_id, table, show=None, search=None, minimum=None, missing_from=None, sort=None,
+              limit=100, cursor=None):
+        """
+        One page of a result table: (rows as dicts, cursor of the next page or None).
+
+        show selects one show by clean name and search the shows whose clean
+        name contains it; minimum keeps rows whose sort column (difference or
+        amount) is at least that much; missing_from ('ascap' or 'bmi') keeps
+        episode rows missing from that statement. sort is None for report
+        order, or the sort column, prefixed with '-' for largest first.
+        """
+        if table not in TABLES:
+            raise ValueError(f"Unknown result table '{table}'")
+        sort_column = SORT_COLUMNS[table]
+        if sort not in (None, sort_column, f'-{sort_column}'):
+            raise ValueError(f"'{table}' can only be sorted by {sort_column} or -{sort_column}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        conditions = ['comparison = (SELECT id FROM comparisons WHERE result_id = ?)']
+        params = [result_id]
+        if show is not None:
+            conditions.append('show = ?')
+            params.append(show)
+        if search:
+            conditions.append('instr(show, ?) > 0')
+            params.append(search)
+        if minimum is not None:
+            conditions.append(f'{sort_column} >= ?')
+            params.append(float(minimum))
+        if missing_from is not None:
+            if table != 'episodes' or missing_from not in ('ascap', 'bmi'):
+                raise ValueError("missing_from is 'ascap' or 'bmi' and only applies to episodes")
+            conditions.append(f'in_{missing_from} = 0')
+
+        if cursor is not None:
+            value, row_id = decode_cursor(cursor, sort)
+            if sort is None:
+                conditions.append('row_id > ?')
+                params.append(row_id)
+            else:
+                conditions.append(f'({sort_column}, row_id) {"<" if sort.startswith("-") else ">"} (?, ?)')
+                params += [value, row_id]
+        if sort is None:
+            order = 'row_id'
+        elif sort.startswith('-'):
+            order = f'{sort_column} DESC, row_id DESC'
+        else:
+            order = f'{sort_column}, row_id'
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT row_id, {', '.join(TABLES[table])} FROM {table} "
+                f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        rows = [{key: bool(row[key]) if key in BOOLEAN_COLUMNS else row[key] for key in row.keys()}
+                for row in rows]
+        next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def prune(self, retention):
+        """Remove results stored more than retention seconds ago"""
+        cutoff = time.time() - retention
+        with self._connect() as conn:
+            for (result_id,) in conn.execute('SELECT result_id FROM comparisons WHERE created_at < ?',
+                                             (cutoff,)).fetchall():
+                self._delete(conn, result_id)
+
+    def _delete(self, conn, result_id):
+        row = conn.execute('SELECT id FROM comparisons WHERE result_id = ?', (result_id,)).fetchone()
+        if row is None:
+            return
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE comparison = ?', (row['id'],))
+        conn.execute('DELETE FROM comparisons WHERE id = ?', (row['id'],))
@@ -0,0 +1,294 @@
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from parse_cache import ContentHasher, ContentTooLarge, is_gzip
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+# Content-Range of a chunk: first and last byte (inclusive) and the total size
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+class UploadError(Exception):
+    """Raised for a chunk or completion an upload cannot accept"""
+
+def parse_content_range(header):
+    """(start, end, total) of a Content-Range header, end exclusive"""
+    found = CONTENT_RANGE_PATTERN.match((header or '').strip())
+    if not found:
+        raise UploadError("Chunks need a 'Content-Range: bytes <first>-<last>/<size>' header")
+    first, last, total = (int(value) for value in found.groups())
+    if last < first:
+        raise UploadError(f"Invalid Content-Range: {header}")
+    return first, last + 1, total
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping [start, end) ranges covering the same bytes"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class ArchiveUpload:
+    """
+    Stores a file under key on its own thread; wait() like BackgroundWriter.wait().
+    Files of at least storage.parallel_threshold bytes go through
+    storage.upload_file() (parallel chunks on GCS), smaller ones through a writer.
+    """
+
+    def __init__(self, path, storage, key, chunk_size=1024 * 1024):
+        self.error = None
+        # Opened or linked here so the upload still reads the file if the job removes it first
+        if storage.parallel_threshold is not None and os.path.getsize(path) >= storage.parallel_threshold:
+            self.link = f'{path}.archive'
+            os.link(path, self.link)
+            self.thread = threading.Thread(target=self._upload, args=(storage, key), daemon=True)
+        else:
+            self.file = open(path, 'rb')
+            self.thread = threading.Thread(target=self._copy, args=(storage.open_writer(key), chunk_size),
+                                           daemon=True)
+        self.thread.start()
+
+    def _upload(self, storage, key):
+        try:
+            storage.upload_file(self.link, key)
+        except Exception as e:
+            self.error = e
+        finally:
+            os.remove(self.link)
+
+    def _copy(self, target, chunk_size):
+        try:
+            with self.file:
+                for chunk in iter(lambda: self.file.read(chunk_size), b''):
+                    target.write(chunk)
+            target.close()
+        except Exception as e:
+            self.error = e
+            target.abort()
+
+    def wait(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+class UploadedFile:
+    """
+    An assembled upload, with the attributes the comparison job reads from
+    an IngestedFile. digest is None when the chunks were not hashed as they
+    arrived (e.g. after a restart); the comparison job then hashes the file.
+    """
+
+    def __init__(self, filename, path, storage=None, archive_key=None, digest=None):
+        self.filename = filename
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.digest = digest
+        self.storage = storage
+        self.archive_key = archive_key
+        self.archive = None
+
+    def store_archive(self):
+        """Start storing the file as uploaded (still compressed); see archive.wait()"""
+        if self.storage is not None:
+            self.archive = ArchiveUpload(self.path, self.storage, self.archive_key(self.filename))
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ResumableUploads:
+    """
+    Files uploaded as chunks that may arrive in any order, be retried, or
+    resume after a dropped connection.
+
+    Each upload is a data file of the declared size and a JSON state file
+    with the byte ranges received so far, both in directory, so any worker
+    process can take the next chunk; a per-upload lock and flock serialize
+    state updates, so different uploads never wait for each other. Unfinished uploads are removed after retention seconds.
+
+    The process that started an upload also hashes its content (see
+    ContentHasher) as the received bytes become contiguous from the start,
+    so completing it needs no pass over the file; an upload that would
+    decompress to more than max_decompressed_size bytes is dropped as soon
+    as it gets there.
+    """
+
+    def __init__(self, directory, max_size, max_chunk_size, retention=24 * 3600, max_decompressed_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_chunk_size = max_chunk_size
+        self.retention = retention
+        self.max_decompressed_size = max_decompressed_size
+        # Guards locks
+        self.lock = threading.Lock()
+        # Upload id: lock serializing the threads of this process on that upload
+        self.locks = {}
+        # Upload id: (lock, ContentHasher) of the uploads started in this process
+        self.hashers = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, filename, size):
+        """Start an upload of size bytes and return its state"""
+        if not filename:
+            raise UploadError("A file name is required")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("The file size must be a positive number of bytes")
+        if size > self.max_size:
+            raise UploadError(f"File size exceeds {self.max_size // (1024 * 1024)}MB limit")
+
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        with open(self._data_path(upload_id), 'wb') as f:
+            f.truncate(size)
+        state = {'upload_id': upload_id, 'filename': filename, 'size': size, 'received': [],
+                 'created_at': time.time()}
+        self._write(upload_id, state)
+        self.hashers[upload_id] = (threading.Lock(), ContentHasher(self.max_decompressed_size))
+        return state
+
+    def get(self, upload_id):
+        """State dict of an upload, or None if the id is unknown"""
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            return None
+        try:
+            with open(self._state_path(upload_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_chunk(self, upload_id, start, data, total=None):
+        """Write data at offset start and return the updated state"""
+        state = self.get(upload_id)
+        if state is None:
+            raise KeyError(upload_id)
+        end = start + len(data)
+        if total is not None and total != state['size']:
+            raise UploadError(f"Upload is {state['size']} bytes, not {total}")
+        if len(data) > self.max_chunk_size:
+            raise UploadError(f"Chunks are limited to {self.max_chunk_size // (1024 * 1024)}MB")
+        if not data or end > state['size']:
+            raise UploadError(f"Chunk {start}-{end} is outside the {state['size']} byte upload")
+
+        try:
+            with open(self._data_path(upload_id), 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+        except FileNotFoundError:
+            raise KeyError(upload_id)  # Completed or pruned in the meantime
+        with self._locked(upload_id):
+            state = self.get(upload_id)
+            if state is None:
+                raise KeyError(upload_id)
+            state['received'] = merge_ranges(state['received'] + [[start, end]])
+            self._write(upload_id, state)
+        try:
+            self._hash_received(upload_id, state)
+        except ValueError as e:
+            # Too large once decompressed, or not valid gzip: no later chunk can fix it
+            self._remove(upload_id)
+            raise e if isinstance(e, ContentTooLarge) else UploadError(str(e))
+        return state
+
+    def complete(self, upload_id, spool_dir, storage=None, archive_key=None):
+        """
+        Move a fully received upload to spool_dir and return it as an
+        UploadedFile; the upload id is no longer valid afterwards.
+        """
+        with self._locked(upload_id):
+            state = self.get(upload_id)
+            if state is None:
+                raise KeyError(upload_id)
+            if state['received'] != [[0, state['size']]]:
+                raise UploadError(f"Upload of {state['filename']} is incomplete")
+            data_path = self._data_path(upload_id)
+            fd, path = tempfile.mkstemp(dir=spool_dir, suffix='.csv.gz' if is_gzip(data_path) else '.csv')
+            os.close(fd)
+            os.replace(data_path, path)
+            os.remove(self._state_path(upload_id))
+            os.remove(os.path.join(self.directory, f'{upload_id}.lock'))
+
+        digest = None
+        lock, hasher = self.hashers.pop(upload_id, (None, None))
+        if hasher is not None:
+            with lock:
+                if hasher.received == state['size']:
+                    try:
+                        digest = hasher.hexdigest()
+                    except ValueError as e:
+                        os.remove(path)
+                        raise e if isinstance(e, ContentTooLarge) else UploadError(str(e))
+        return UploadedFile(state['filename'], path, storage=storage, archive_key=archive_key, digest=digest)
+
+    def prune(self):
+        """Remove uploads started more than the retention period ago"""
+        cutoff = time.time() - self.retention
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        for upload_id in list(self.hashers):
+            if not os.path.exists(self._state_path(upload_id)):
+                self.hashers.pop(upload_id, None)
+        with self.lock:
+            for upload_id in list(self.locks):
+                if not os.path.exists(self._state_path(upload_id)):
+                    del self.locks[upload_id]
+
+    def _hash_received(self, upload_id, state):
+        """Feed this process's hasher the bytes received contiguously from the start that it has not seen"""
+        lock, hasher = self.hashers.get(upload_id, (None, None))
+        if hasher is None:
+            return
+        received = state['received']
+        contiguous = received[0][1] if received and received[0][0] == 0 else 0
+        with lock:
+            if contiguous <= hasher.received:
+                return
+            # Read back from the data file, which also covers chunks that arrived out of order
+            with open(self._data_path(upload_id), 'rb') as f:
+                f.seek(hasher.received)
+                while hasher.received < contiguous:
+                    hasher.update(f.read(min(1024 * 1024, contiguous - hasher.received)))
+
+    def _remove(self, upload_id):
+        self.hashers.pop(upload_id, None)
+        for path in (self._data_path(upload_id), self._state_path(upload_id),
+                     os.path.join(self.directory, f'{upload_id}.lock')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.json')
+
+    def _data_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.data')
+
+    @contextmanager
+    def _locked(self, upload_id):
+        # Threads of this process, then other worker processes, one at a time per upload
+        with self.lock:
+            lock = self.locks.setdefault(upload_id, threading.Lock())
+        with lock, open(os.path.join(self.directory, f'{upload_id}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, upload_id, state):
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path(upload_id))
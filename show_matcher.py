@@ -0,0 +1,108 @@
+import math
+import numpy as np
+from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rf_fuzz, process
+
+# Score blocks with at least this many pairs on every core
+PARALLEL_MIN_PAIRS = 250000
+
+def _length_bounds(length, threshold):
+    """Shortest and longest choice lengths that can still reach the threshold against a query of this length"""
+    # fuzz.ratio is 2 * LCS / (len1 + len2), so it can never exceed 2 * min / (len1 + len2).
+    # One point of slack keeps rounded scores (84.5 -> 85) inside the window.
+    t = max(threshold - 1, 1) / 100.0
+    return math.ceil(length * t / (2 - t)), math.floor(length * (2 - t) / t)
+
+def find_candidate_matches(queries, choices, threshold=85, workers=None):
+    """
+    Find every (query, choice) pair whose fuzz.ratio is at least threshold.
+
+    Choices are indexed by length so each query is only scored against the
+    length window that can still reach the threshold; each window is scored
+    in one batched rapidfuzz call and surviving pairs are rescored with
+    fuzz.ratio so scores are identical to find_similar_shows.
+
+    Returns a dict mapping query -> [(choice, score), ...], best score first.
+    """
+    queries = sorted({q for q in queries if q})
+    choices = sorted({c for c in choices if c}, key=lambda c: (len(c), c))
+    results = {}
+    if not queries or not choices:
+        return results
+
+    choice_lengths = np.array([len(c) for c in choices])
+    cutoff = max(threshold - 1, 0)
+
+    # Group queries by length so each group shares one candidate window
+    by_length = {}
+    for query in queries:
+        by_length.setdefault(len(query), []).append(query)
+
+    for length, group in by_length.items():
+        min_len, max_len = _length_bounds(length, threshold)
+        lo = np.searchsorted(choice_lengths, min_len, side='left')
+        hi = np.searchsorted(choice_lengths, max_len, side='right')
+        if lo >= hi:
+            continue
+        window = choices[lo:hi]
+
+        block_workers = workers
+        if block_workers is None:
+            block_workers = -1 if len(group) * len(window) >= PARALLEL_MIN_PAIRS else 1
+
+        scores = process.cdist(group, window, scorer=rf_fuzz.ratio, score_cutoff=cutoff,
+                               dtype=np.float64, workers=block_workers)
+        for qi, ci in zip(*np.nonzero(scores)):
+            query, choice = group[qi], window[ci]
+            ratio = fuzz.ratio(query, choice)
+            if ratio >= threshold:
+                results.setdefault(query, []).append((choice, ratio))
+
+    for matches in results.values():
+        matches.sort(key=lambda x: (-x[1], x[0]))
+    return results
+
+def assign_matches(candidates):
+    """
+    One-to-one assignment of queries to choices from find_candidate_matches output.
+
+    All candidate pairs form a sparse similarity matrix, kept as parallel
+    arrays of (query, choice, score) so memory grows with the number of
+    pairs above the threshold, not with queries x choices. Pairs are taken
+    best score first across the whole matrix (ties by name) and a pair is
+    kept when neither side is assigned yet, so a show can no longer take a
+    better match away from another one just because it was looked at first.
+
+    Returns a dict mapping query -> (choice, score).
+    """
+    queries = sorted(candidates)
+    choice_index = {}
+    rows, cols, scores = [], [], []
+    for qi, query in enumerate(queries):
+        for choice, score in candidates[query]:
+            rows.append(qi)
+            cols.append(choice_index.setdefault(choice, len(choice_index)))
+            scores.append(score)
+    if not scores:
+        return {}
+
+    rows = np.array(rows, dtype=np.int32)
+    cols = np.array(cols, dtype=np.int32)
+    scores = np.array(scores, dtype=np.int64)
+    choices = np.empty(len(choice_index), dtype=object)
+    for choice, ci in choice_index.items():
+        choices[ci] = choice
+    choice_rank = np.argsort(np.argsort(choices))  # Break ties by choice name
+
+    # Best score first; rows are already in query name order
+    order = np.lexsort((choice_rank[cols], rows, -scores))
+    query_taken = np.zeros(len(queries), dtype=bool)
+    choice_taken = np.zeros(len(choices), dtype=bool)
+    assignment = {}
+    for i in order:
+        qi, ci = rows[i], cols[i]
+        if query_taken[qi] or choice_taken[ci]:
+            continue
+        query_taken[qi] = choice_taken[ci] = True
+        assignment[queries[qi]] = (choices[ci], scores[i].item())
+    return assignment
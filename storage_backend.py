@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class StorageBackend:
+    """Where uploaded statements and generated reports are stored"""
+
+    # Files of at least this many bytes are stored faster by upload_file() than
+    # through open_writer(); None when it makes no difference
+    parallel_threshold = None
+
+    def upload_file(self, path, key):
+        """Store a local file under key"""
+        raise NotImplementedError
+
+    def open_writer(self, key):
+        """
+        Writable stream for key: write() the content, then close() to store it
+        or abort() to discard it
+        """
+        raise NotImplementedError
+
+    def signed_url(self, key, expiration=300):
+        """URL the browser can download key from for the next expiration seconds"""
+        raise NotImplementedError
+
+class GCSObjectWriter:
+    """
+    Resumable upload fed with write() calls, into a temporary object that
+    replaces the target on close(), so abort() never touches what is
+    already stored (like LocalFileWriter)
+    """
+
+    def __init__(self, bucket, key, chunk_size):
+        self.blob = bucket.blob(key)
+        self.tmp_blob = bucket.blob(f'{key}.part-{uuid.uuid4().hex}')
+        self.writer = self.tmp_blob.open('wb', chunk_size=chunk_size, ignore_flush=True)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        self.writer.close()
+        try:
+            # Server-side: the data is not sent again
+            self.blob.compose([self.tmp_blob])
+        finally:
+            self.tmp_blob.delete()
+
+    def abort(self):
+        # A BlobWriter cannot be cancelled: finish the temporary object, then delete it
+        try:
+            self.writer.close()
+        except Exception as e:
+            logger.warning(f"Error closing aborted upload of {self.blob.name}: {str(e)}")
+        try:
+            self.tmp_blob.delete()
+        except Exception as e:
+            logger.warning(f"Error deleting aborted upload of {self.blob.name}: {str(e)}")
+
+class LocalFileWriter:
+    """Writes to a temporary file that replaces the target on close()"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class GCSStorageBackend(StorageBackend):
+    """
+    Google Cloud Storage bucket.
+
+    bucket is a bucket handle, or a bucket name: the client is then created
+    on first use and reused, so starting a worker costs no client setup.
+    Files of at least parallel_threshold bytes are uploaded as chunks in
+    parallel (XML multipart upload) instead of one resumable upload.
+    """
+
+    def __init__(self, bucket, chunk_size=5 * 1024 * 1024, parallel_threshold=64 * 1024 * 1024,
+                 parallel_chunk_size=32 * 1024 * 1024, max_workers=8):
+        self._bucket = bucket
+        self._bucket_lock = threading.Lock()
+        self.chunk_size = chunk_size
+        self.parallel_threshold = parallel_threshold
+        self.parallel_chunk_size = parallel_chunk_size
+        self.max_workers = max_workers
+
+    @property
+    def bucket(self):
+        if isinstance(self._bucket, str):
+            with self._bucket_lock:
+                if isinstance(self._bucket, str):
+                    self._bucket = create_gcs_bucket(self._bucket)
+        return self._bucket
+
+    def upload_file(self, path, key):
+        from google.cloud.storage import transfer_manager
+
+        blob = self.bucket.blob(key)
+        if os.path.getsize(path) >= self.parallel_threshold:
+            transfer_manager.upload_chunks_concurrently(
+                path, blob,
+                chunk_size=self.parallel_chunk_size,
+                worker_type=transfer_manager.THREAD,
+                max_workers=self.max_workers
+            )
+        else:
+            # Chunked resumable transfer
+            blob.chunk_size = self.chunk_size
+            blob.upload_from_filename(path)
+
+    def open_writer(self, key):
+        return GCSObjectWriter(self.bucket, key, self.chunk_size)
+
+    def signed_url(self, key, expiration=300):
+        return self.bucket.blob(key).generate_signed_url(
+            version="v4",
+            expiration=expiration,
+            method="GET"
+        )
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Directory on the local filesystem, for running and benchmarking the
+    pipeline offline. URLs point at the app's /storage/<key> route and are
+    not actually signed.
+    """
+
+    def __init__(self, root, base_url='/storage'):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def upload_file(self, path, key):
+        target = self.path_for(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+
+    def open_writer(self, key):
+        return LocalFileWriter(self.path_for(key))
+
+    def signed_url(self, key, expiration=300):
+        return f'{self.base_url}/{key}'
+
+def create_gcs_bucket(bucket_name):
+    """Bucket handle using credentials from GOOGLE_APPLICATION_CREDENTIALS_JSON or the default ones"""
+    from google.cloud import storage
+
+    credentials_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
+    if credentials_json:
+        logger.info("Using credentials from environment variable")
+        credentials_info = json.loads(credentials_json)
+        storage_client = storage.Client.from_service_account_info(credentials_info)
+    else:
+        logger.info("Using default credentials")
+        storage_client = storage.Client()
+    return storage_client.bucket(bucket_name)
+
+def create_storage_backend(config):
+    """Storage backend selected by STORAGE_BACKEND ('gcs' or 'local')"""
+    if config['STORAGE_BACKEND'] == 'local':
+        return LocalStorageBackend(config['LOCAL_STORAGE_DIR'])
+    if config['STORAGE_BACKEND'] != 'gcs':
+        raise ValueError(f"Unknown storage backend '{config['STORAGE_BACKEND']}', expected 'gcs' or 'local'")
+    return GCSStorageBackend(config['GOOGLE_CLOUD_STORAGE_BUCKET'])
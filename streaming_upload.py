@@ -0,0 +1,187 @@
+import os
+import queue
+import tempfile
+import threading
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from parse_cache import ContentHasher
+from resumable_upload import ArchiveUpload
+
+# Bytes read from the request body at a time; must stay well below max_form_memory_size
+# because the decoder buffers at most one read plus any unparsed tail
+READ_CHUNK_SIZE = 256 * 1024
+
+class BackgroundWriter:
+    """
+    Feeds a storage writer from its own thread so slow storage writes
+    overlap with reading the request. At most max_pending chunks are
+    buffered; write() blocks beyond that.
+    """
+
+    _CLOSE = object()
+    _ABORT = object()
+
+    def __init__(self, target, max_pending=64):
+        self.target = target
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(data)
+
+    def close(self):
+        """Store the content once everything queued is written; see wait()"""
+        self.queue.put(self._CLOSE)
+
+    def abort(self):
+        self.queue.put(self._ABORT)
+
+    def wait(self):
+        """Block until the writer thread is done and re-raise its error, if any"""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is self._CLOSE or item is self._ABORT:
+                break
+            if self.error is None:
+                try:
+                    self.target.write(item)
+                except Exception as e:
+                    self.error = e
+        try:
+            if item is self._CLOSE and self.error is None:
+                self.target.close()
+            else:
+                self.target.abort()
+        except Exception as e:
+            self.error = self.error or e
+
+class IngestedFile:
+    """A file received by ingest_multipart: local spool copy, content digest and archive upload"""
+
+    def __init__(self, filename, path, storage=None, archive_key=None, max_decompressed_size=None, tee=True):
+        self.filename = filename
+        self.path = path
+        self.storage = storage
+        self.archive_key = archive_key
+        self.archive = None
+        if storage is not None and tee:
+            self.archive = BackgroundWriter(storage.open_writer(archive_key))
+        self.size = 0
+        self.digest = None
+        self._hasher = ContentHasher(max_decompressed_size)
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+        self._hasher.update(data)
+        if self.archive is not None:
+            self.archive.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        """Close the spool file once the whole part is received; the archive stays open"""
+        self._file.close()
+        self.digest = self._hasher.hexdigest()
+
+    def store_archive(self):
+        """
+        Keep the archive: it is stored once everything is written, or from
+        the spool file if the part was not teed (see archive.wait())
+        """
+        if self.archive is not None:
+            self.archive.close()
+        elif self.storage is not None:
+            self.archive = ArchiveUpload(self.path, self.storage, self.archive_key)
+
+    def discard(self):
+        self._file.close()
+        if self.archive is not None:
+            self.archive.abort()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def ingest_multipart(stream, content_type, spool_dir, storage=None, archive_key=None,
+                     max_form_memory_size=1024 * 1024, max_decompressed_size=None, content_length=None):
+    """
+    Read a multipart/form-data body in one pass.
+
+    Every file part is written to a spool file in spool_dir, hashed with
+    ContentHasher (by its decompressed content if it is gzip, raising
+    ContentTooLarge past max_decompressed_size) and, when storage is given,
+    teed to storage.open_writer(archive_key(filename)) on a background
+    thread, all while the body is still arriving. Unless content_length
+    shows that no part can reach storage.parallel_threshold, parts are not
+    teed: store_archive() then stores them from the spool file, through
+    storage.upload_file() if they are that large. File inputs left empty by
+    the browser are skipped.
+
+    Returns (files, fields): dicts keyed by form field name of IngestedFile
+    objects and of string values. Archives are still being written when this
+    returns and are only stored once the caller decides: file.store_archive()
+    keeps one (then file.archive.wait() before relying on it) and
+    file.discard() drops it without replacing what is already stored.
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise ValueError("Expected a multipart/form-data request")
+
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=max_form_memory_size)
+    # Decided before anything is sent, so no part goes to storage twice
+    threshold = storage.parallel_threshold if storage is not None else None
+    tee = threshold is None or (content_length is not None and content_length < threshold)
+    files = {}
+    fields = {}
+    current = None
+    field_data = []
+    try:
+        while True:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    current = None
+                    if event.filename:
+                        fd, path = tempfile.mkstemp(dir=spool_dir, suffix='.csv')
+                        os.close(fd)
+                        current = IngestedFile(event.filename, path, storage,
+                                               archive_key(event.filename) if storage is not None else None,
+                                               max_decompressed_size, tee)
+                        files[event.name] = current
+                elif isinstance(event, Field):
+                    current = event
+                    field_data = []
+                elif isinstance(event, Data):
+                    if isinstance(current, IngestedFile):
+                        current.write(event.data)
+                        if not event.more_data:
+                            current.finish()
+                    elif isinstance(current, Field):
+                        field_data.append(event.data)
+                        if sum(len(data) for data in field_data) > max_form_memory_size:
+                            raise RequestEntityTooLarge()
+                        if not event.more_data:
+                            fields[current.name] = b''.join(field_data).decode('utf-8', 'replace')
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+        if not isinstance(event, Epilogue):
+            raise ValueError("Upload ended before the form data was complete")
+    except Exception:
+        for ingested in files.values():
+            ingested.discard()
+        raise
+
+    return files, fields
@@ -0,0 +1,41 @@
+from alias_store import AliasStore
+
+def test_record_keeps_confirmed_aliases(tmp_path):
+    store = AliasStore(str(tmp_path / 'aliases.sqlite3'))
+    store.record([('law order', 'law and order', 88), ('late show', 'the late show', 90)], 1, 85)
+    store.confirm('law order', 'law  order svu')
+    store.record([('law order', 'law orders', 95), ('late show', 'late shows', 92)], 1, 85)
+
+    aliases = store.lookup(['law order', 'late show', 'unknown'])
+    assert aliases == {
+        'law order': ('law  order svu', 100.0, True),
+        'late show': ('late shows', 92.0, False)
+    }
+
+    store.remove('late show')
+    assert list(store.lookup(['late show'])) == []
+
+    # Every change bumps the revision; finding the same aliases again does not
+    assert store.revision() == store.changes == 4
+    store.record([('law order', 'law orders', 95)], 1, 85)
+    assert AliasStore(store.path).revision() == 4
+
+def test_automatic_aliases_apply_only_to_the_same_matcher(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'aliases.sqlite3')
+    # A file from before aliases recorded their matcher
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE show_aliases (ascap_name TEXT PRIMARY KEY, bmi_name TEXT NOT NULL, '
+                     'score REAL NOT NULL, confirmed INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)')
+        conn.execute("INSERT INTO show_aliases VALUES ('old show', 'old shows', 90, 0, 0)")
+    store = AliasStore(path)
+    store.record([('late show', 'late shows', 88)], 1, 85)
+    store.confirm('law order', 'law and order', score=70)
+
+    assert sorted(store.lookup(['old show', 'late show', 'law order'], matcher_version=1, threshold=85)) == [
+        'late show', 'law order']
+    # A stricter threshold or another matcher version scores the show again
+    assert list(store.lookup(['old show', 'late show', 'law order'], matcher_version=1, threshold=90)) == ['law order']
+    assert list(store.lookup(['old show', 'late show', 'law order'], matcher_version=2, threshold=85)) == ['law order']
+    assert len(store.lookup(['old show', 'late show', 'law order'])) == 3
@@ -0,0 +1,293 @@
+import gzip
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import config
+
+ASCAP_CSV = b'''Series or Film/Attraction,Program Name,Work Title,Network Service,Dollars
+Law & Order,Pilot,Theme,NBC,1.25
+The Late Show,Ep 2,Song,CBS,2.00
+Kitchen Nightmares,Ep 1,Intro,FOX,0.75
+'''
+
+BMI_CSV = b'''SHOW NAME,EPISODE NAME,TITLE NAME,PERF SOURCE,ROYALTY AMOUNT
+LAW & ORDER,Pilot,Theme,NBC,1.00
+The Late Shows,Ep 2,Song,CBS,2.50
+House Hunters,Ep 9,Outro,HGTV,3.00
+'''
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The app module, run fully offline: local storage and scratch directories"""
+    scratch = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('STORAGE_BACKEND', 'local')
+        monkeypatch.setenv('LOCAL_STORAGE_DIR', str(scratch / 'storage'))
+        monkeypatch.setenv('UPLOAD_FOLDER', str(scratch / 'uploads'))
+        importlib.reload(config)
+        if 'app' in sys.modules:
+            yield importlib.reload(sys.modules['app'])
+        else:
+            yield importlib.import_module('app')
+    importlib.reload(config)
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+def wait_for_job(client, status_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.1)
+    raise AssertionError('job did not finish')
+
+def test_upload_runs_comparison_job(client, app_module):
+    response = client.post('/upload', content_type='multipart/form-data', data={
+        'ascap': (io.BytesIO(ASCAP_CSV), 'ascap.csv'),
+        'bmi': (io.BytesIO(BMI_CSV), 'bmi.csv'),
+    })
+    assert response.status_code == 202
+
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert job['status'] == 'done', job.get('error')
+
+    # Inputs are archived and the report is downloadable from local storage
+    storage_dir = app_module.app.config['LOCAL_STORAGE_DIR']
+    assert sorted(os.listdir(os.path.join(storage_dir, 'uploads'))) == ['ascap.csv', 'bmi.csv']
+    download = client.get(job['report_url'])
+    assert download.status_code == 200
+    assert download.data[:2] == b'PK'  # xlsx is a zip archive
+
+def test_job_events_stream_progress(client):
+    response = client.post('/upload', content_type='multipart/form-data', data={
+        'ascap': (io.BytesIO(ASCAP_CSV), 'ascap-events.csv'),
+        'bmi': (io.BytesIO(BMI_CSV + b'Extra,Ep 1,Song,ABC,1.00\n'), 'bmi-events.csv'),
+    })
+    status_url = response.get_json()['status_url']
+
+    stream = client.get(status_url + '/events')
+    assert stream.mimetype == 'text/event-stream'
+    events = [json.loads(line[len('data: '):]) for line in stream.get_data(as_text=True).split('\n')
+              if line.startswith('data: ')]
+    assert events[-1]['status'] == 'done', events[-1].get('error')
+    assert 'report_url' in events[-1]
+    completed = [record['stage'] for record in events[-1]['progress']['completed']]
+    # The BMI statement is new to the parse cache; the ASCAP one may have been parsed by another test
+    assert {'cache_load_ascap', 'cache_load_bmi', 'parse_bmi', 'fuzzy_matching'} <= set(completed)
+    assert completed[-3:] == ['excel_report', 'upload_report', 'archive_inputs']
+    assert client.get('/jobs/' + '0' * 32 + '/events').status_code == 404
+
+def test_job_events_end_and_are_capped(client, app_module, monkeypatch):
+    import threading
+
+    release = threading.Event()
+    job_id = app_module.jobs.submit(lambda: release.wait(10) and {})
+    monkeypatch.setitem(app_module.app.config, 'EVENT_STREAM_SECONDS', 0.5)
+    try:
+        # A long job's stream ends early and tells the browser when to reconnect
+        body = client.get(f'/jobs/{job_id}/events').get_data(as_text=True)
+        assert body.startswith('retry: ')
+        assert [json.loads(line[len('data: '):])['status'] for line in body.split('\n')
+                if line.startswith('data: ')] in (['queued'], ['running'], ['queued', 'running'])
+
+        monkeypatch.setattr(app_module, 'event_stream_slots', threading.BoundedSemaphore(1))
+        stream = client.get(f'/jobs/{job_id}/events', buffered=False)
+        assert client.get(f'/jobs/{job_id}/events').status_code == 503
+        stream.close()
+        assert client.get(f'/jobs/{job_id}/events').status_code == 200
+    finally:
+        release.set()
+
+def send_chunked(client, data, filename, chunk_size=100):
+    upload = client.post('/uploads', json={'filename': filename, 'size': len(data)}).get_json()
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        response = client.put(upload['upload_url'], data=chunk, headers={
+            'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(data)}'})
+        assert response.status_code == 200
+    return upload['upload_id']
+
+def test_chunked_gzip_uploads_run_comparison_job(client, app_module):
+    ascap_id = send_chunked(client, gzip.compress(ASCAP_CSV + b'Chunked,Ep 1,Song,ABC,1.00\n'), 'ascap.csv.gz')
+
+    # A partial upload can be resumed from the ranges the server reports
+    bmi_data = gzip.compress(BMI_CSV)
+    upload = client.post('/uploads', json={'filename': 'bmi.csv.gz', 'size': len(bmi_data)}).get_json()
+    client.put(upload['upload_url'], data=bmi_data[:50], headers={'Content-Range': f'bytes 0-49/{len(bmi_data)}'})
+    assert client.post('/compare', json={'ascap': ascap_id, 'bmi': upload['upload_id']}).status_code == 409
+    status = client.get(upload['upload_url']).get_json()
+    assert status['received'] == [[0, 50]] and not status['complete']
+    client.put(upload['upload_url'], data=bmi_data[50:],
+               headers={'Content-Range': f'bytes 50-{len(bmi_data) - 1}/{len(bmi_data)}'})
+
+    response = client.post('/compare', json={'ascap': ascap_id, 'bmi': upload['upload_id']})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert job['status'] == 'done', job.get('error')
+    storage_dir = app_module.app.config['LOCAL_STORAGE_DIR']
+    assert 'bmi.csv.gz' in os.listdir(os.path.join(storage_dir, 'uploads'))
+    # The uploads are used up by the comparison
+    assert client.get(upload['upload_url']).status_code == 404
+
+def test_uploads_are_limited_and_hashed_by_decompressed_content(client, app_module, monkeypatch):
+    import hashlib
+    from compare_earnings import comparison_key
+
+    ascap_csv = ASCAP_CSV + b'Rehashed,Ep 1,Song,ABC,1.00\n'
+    ascap_id = send_chunked(client, gzip.compress(ascap_csv), 'ascap.csv.gz')
+    bmi_id = send_chunked(client, BMI_CSV, 'bmi.csv')
+    # As after a restart: the chunks were not hashed here, so the job hashes the files
+    app_module.resumable_uploads.hashers.clear()
+    revision = app_module.aliases.revision()
+    response = client.post('/compare', json={'ascap': ascap_id, 'bmi': bmi_id})
+    assert response.status_code == 202 and not response.get_json()['reused']
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert job['status'] == 'done', job.get('error')
+    key = comparison_key(hashlib.sha256(ascap_csv).hexdigest(), hashlib.sha256(BMI_CSV).hexdigest(), revision)
+    assert app_module.results.counts(key) is not None
+
+    monkeypatch.setattr(app_module.resumable_uploads, 'max_decompressed_size', 1024)
+    bomb = gzip.compress(ASCAP_CSV + b'\n' * 100000)
+    upload = client.post('/uploads', json={'filename': 'bomb.csv.gz', 'size': len(bomb)}).get_json()
+    response = client.put(upload['upload_url'], data=bomb,
+                          headers={'Content-Range': f'bytes 0-{len(bomb) - 1}/{len(bomb)}'})
+    assert response.status_code == 413
+    assert client.get(upload['upload_url']).status_code == 404
+
+def test_results_are_queryable_as_json(client):
+    response = client.post('/upload', content_type='multipart/form-data', data={
+        'ascap': (io.BytesIO(ASCAP_CSV + b'Law & Order,Ep 2,Second Song,NBC,9.00\n'), 'ascap-results.csv'),
+        'bmi': (io.BytesIO(BMI_CSV), 'bmi-results.csv'),
+    })
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert job['status'] == 'done', job.get('error')
+
+    tables = client.get(job['results_url']).get_json()['tables']
+    page = client.get(tables['episodes'], query_string={'show': 'Law & Order', 'sort': '-difference', 'limit': 1})
+    data = page.get_json()
+    assert [(row['song'], row['difference']) for row in data['items']] == [('Second Song', 9.0)]
+    rest = client.get(data['next_url']).get_json()
+    assert [row['song'] for row in rest['items']] == ['Theme'] and rest['next_cursor'] is None
+
+    assert client.get(tables['shows'], query_string={'sort': 'amount'}).status_code == 400
+    assert client.get(job['results_url'] + '/nope').status_code == 404
+
+def test_upload_requires_both_files(client):
+    response = client.post('/upload', content_type='multipart/form-data', data={
+        'ascap': (io.BytesIO(ASCAP_CSV), 'ascap.csv'),
+    })
+    assert response.status_code == 400
+
+def test_unknown_job(client):
+    assert client.get('/jobs/' + '0' * 32).status_code == 404
+
+def test_metrics_endpoint(client):
+    client.get('/jobs/' + '0' * 32)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_requests_total counter' in text
+    assert 'http_requests_total{method="GET",endpoint="/jobs/<job_id>",status="404"}' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="/jobs/<job_id>",le="+Inf"}' in text
+
+def test_startup_defers_heavy_imports(tmp_path):
+    # A fresh worker boots without pandas or a GCS client; both load on first use
+    script = ("import sys, app; "
+              "print([m for m in ('pandas', 'matplotlib', 'google.cloud.storage') if m in sys.modules])")
+    env = dict(os.environ, STORAGE_BACKEND='gcs', UPLOAD_FOLDER=str(tmp_path))
+    output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, check=True, capture_output=True, text=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
+
+def test_identical_uploads_share_one_job(client, app_module):
+    def upload(ascap_csv):
+        return client.post('/upload', content_type='multipart/form-data', data={
+            'ascap': (io.BytesIO(ascap_csv), 'dedupe_ascap.csv'),
+            'bmi': (io.BytesIO(BMI_CSV + b'Dedupe Shows,Ep 1,Song,NBC,9.99\n'), 'dedupe_bmi.csv'),
+        }).get_json()
+
+    # The first run records a new alias; identical inputs still share its job afterwards
+    ascap_csv = ASCAP_CSV + b'Dedupe Show,Ep 1,Song,NBC,9.99\n'
+    revision = app_module.aliases.revision()
+    first = upload(ascap_csv)
+    second = upload(ascap_csv)
+    assert not first['reused'] and second['reused']
+    assert second['job_id'] == first['job_id']
+
+    job = wait_for_job(client, first['status_url'])
+    assert job['status'] == 'done', job.get('error')
+    assert app_module.aliases.revision() > revision
+    third = upload(ascap_csv)
+    assert third['reused'] and third['job_id'] == first['job_id']
+    assert client.get(client.get(third['status_url']).get_json()['report_url']).status_code == 200
+
+    # Different content is a different comparison, and so are the same inputs once aliases change
+    assert upload(ascap_csv + b'Another Show,Ep 1,Song,NBC,1.00\n')['job_id'] != first['job_id']
+    app_module.aliases.confirm('dedupe show', 'house hunters')
+    assert upload(ascap_csv)['job_id'] != first['job_id']
+
+def test_concurrent_duplicates_start_one_job(tmp_path):
+    import threading
+    from jobs import JobManager
+
+    manager = JobManager(str(tmp_path), max_workers=1, max_pending=8)
+    release = threading.Event()
+    started = []
+
+    def job():
+        started.append(1)
+        release.wait(5)
+        return {}
+
+    key = 'a' * 64
+    ids = []
+    threads = [threading.Thread(target=lambda: ids.append(manager.submit_unique(key, job)[0])) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+    assert len(set(ids)) == 1
+    deadline = time.time() + 5
+    while manager.get(ids[0])['status'] != 'done' and time.time() < deadline:
+        time.sleep(0.05)
+    assert started == [1]
+
+def test_jobs_lost_with_their_process_are_replaced(tmp_path):
+    from jobs import JobManager
+
+    # Left behind by a process that died mid-run: its pid was reused after a restart,
+    # and another one stopped sending heartbeats
+    manager = JobManager(str(tmp_path), max_workers=1, stale_after=60)
+    old_owner = dict(manager.owner, process='0' * 32)
+    states = {
+        'a' * 32: {'job_id': 'a' * 32, 'status': 'running', 'created_at': time.time(), 'owner': old_owner,
+                   'heartbeat_at': time.time()},
+        'b' * 32: {'job_id': 'b' * 32, 'status': 'running', 'created_at': time.time() - 600,
+                   'owner': {'host': 'elsewhere', 'pid': 1, 'process': '1' * 32}, 'heartbeat_at': time.time() - 600}
+    }
+    for job_id, state in states.items():
+        (tmp_path / f'{job_id}.json').write_text(json.dumps(state))
+    (tmp_path / 'keys' / f'{"c" * 64}.json').write_text(json.dumps({'job_id': 'b' * 32}))
+
+    restarted = JobManager(str(tmp_path), max_workers=1, stale_after=60)
+    assert restarted.get('a' * 32)['status'] == 'failed'
+    assert restarted.get('b' * 32)['status'] == 'failed'
+
+    job_id, created = restarted.submit_unique('c' * 64, lambda: {'ok': True})
+    assert created and job_id != 'b' * 32
+    deadline = time.time() + 5
+    while restarted.get(job_id)['status'] != 'done' and time.time() < deadline:
+        time.sleep(0.05)
+    assert restarted.get(job_id)['result'] == {'ok': True}
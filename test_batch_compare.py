@@ -0,0 +1,17 @@
+from batch_compare import pair_files, read_manifest, report_names
+
+def test_pair_files_by_name_without_pro():
+    pairs = pair_files(['/s/BMI 4TH 2023.csv', '/s/ASCAP 4TH 2023.csv', '/s/ascap q1.csv',
+                        '/s/bmi q1.csv', '/s/ASCAP orphan.csv', '/s/notes.csv'])
+    assert pairs == [
+        ('4th 2023', '/s/ASCAP 4TH 2023.csv', '/s/BMI 4TH 2023.csv'),
+        ('q1', '/s/ascap q1.csv', '/s/bmi q1.csv')
+    ]
+
+def test_manifest_paths_are_relative_to_manifest(tmp_path):
+    manifest = tmp_path / 'pairs.csv'
+    manifest.write_text('ascap,bmi,name\nin/a.csv,in/b.csv,Q4 2023\nin/a.csv,in/c.csv,\n')
+    pairs = read_manifest(str(manifest))
+    assert pairs == [('Q4 2023', str(tmp_path / 'in/a.csv'), str(tmp_path / 'in/b.csv')),
+                     ('a', str(tmp_path / 'in/a.csv'), str(tmp_path / 'in/c.csv'))]
+    assert report_names(pairs + pairs[:1]) == ['Q4_2023.xlsx', 'a.xlsx', 'Q4_2023_2.xlsx']
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from compare_earnings import ASCAP_COLUMNS, BMI_COLUMNS, ShowMatch, aggregate_episodes, reconcile_episodes
+from normalize import normalize_statement
+
+def statement(columns, rows):
+    df = pd.DataFrame(rows, columns=[columns['show'], columns['episode'], columns['song'],
+                                     columns['network'], columns['amount']])
+    return normalize_statement(df, columns['show'], columns['episode'], columns['song'])
+
+def test_reconcile_episodes_outer_joins_on_clean_keys():
+    ascap = statement(ASCAP_COLUMNS, [
+        ['Show A', 'Pilot', 'Song One!', 'NBC', 1.0],
+        ['Show A', 'Pilot', 'song one', 'NBC', 2.0],
+        ['Show A', None, 'Song Two', None, 4.0],
+        ['Show C', 'Pilot', 'Song One', 'CBS', 8.0]
+    ])
+    bmi = statement(BMI_COLUMNS, [
+        ['SHOW A', 'PILOT', 'SONG ONE', 'NBC', 2.5],
+        ['SHOW A', 'PILOT', 'SONG THREE', 'ABC', 1.5]
+    ])
+    matches = {'show a': ShowMatch('show a', 100)}
+
+    reconciliation = reconcile_episodes(aggregate_episodes(ascap, ASCAP_COLUMNS),
+                                        aggregate_episodes(bmi, BMI_COLUMNS), matches)
+
+    rows = reconciliation[['show', 'clean_episode', 'clean_song_title', 'ascap_amount',
+                           'bmi_amount', 'difference', 'in_ascap', 'in_bmi']].values.tolist()
+    assert rows == [
+        ['show a', '', 'song two', 4.0, 0.0, 4.0, True, False],
+        ['show a', 'pilot', 'song one', 3.0, 2.5, 0.5, True, True],
+        ['show a', 'pilot', 'song three', 0.0, 1.5, 1.5, False, True]
+    ]
+    # Display names come from ASCAP when the song is there, otherwise from BMI
+    assert reconciliation['song'].tolist() == ['Song Two', 'Song One!', 'SONG THREE']
+    # Names are kept as codes, not one Python string per row
+    assert all(isinstance(reconciliation[column].dtype, pd.CategoricalDtype)
+               for column in ['show', 'clean_episode', 'clean_song_title', 'episode', 'song', 'network'])
+
+def test_aliases_resolve_repeat_runs_without_fuzzy_matching(tmp_path, monkeypatch):
+    import compare_earnings as module
+    from alias_store import AliasStore
+
+    ascap = tmp_path / 'ascap.csv'
+    bmi = tmp_path / 'bmi.csv'
+    pd.DataFrame({'Series or Film/Attraction': ['Late Night Show', 'Morning News'], 'Program Name': ['Pilot', 'Pilot'],
+                  'Work Title': ['Song', 'Song'], 'Network Service': ['NBC', 'NBC'],
+                  'Dollars': [1.0, 2.0]}).to_csv(ascap, index=False)
+    pd.DataFrame({'SHOW NAME': ['Late Night Shows', 'Morning Newz'], 'EPISODE NAME': ['Pilot', 'Pilot'],
+                  'TITLE NAME': ['Song', 'Song'], 'PERF SOURCE': ['NBC', 'NBC'],
+                  'ROYALTY AMOUNT': [1.0, 2.0]}).to_csv(bmi, index=False)
+    monkeypatch.chdir(tmp_path)
+    store = AliasStore(str(tmp_path / 'aliases.sqlite3'))
+
+    assert module.compare_earnings(str(ascap), str(bmi), aliases=store)
+    assert store.lookup(['late night show', 'morning news']) == {
+        'late night show': ('late night shows', 97.0, False),
+        'morning news': ('morning newz', 92.0, False)
+    }
+
+    scored = []
+    monkeypatch.setattr(module, 'find_candidate_matches',
+                        lambda queries, *args, **kwargs: scored.extend(queries) or {})
+    assert module.compare_earnings(str(ascap), str(bmi), aliases=store)
+    assert scored == []
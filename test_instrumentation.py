@@ -0,0 +1,23 @@
+import tracemalloc
+
+from instrumentation import RunProfile, format_profile
+
+def test_stages_record_time_memory_and_counts():
+    profile = RunProfile()
+    with profile.stage('parse_ascap', rows=3):
+        pass
+    tracemalloc.start()
+    try:
+        with profile.stage('fuzzy_matching') as stage:
+            data = [bytes(1024) for _ in range(1024)]
+            stage['matched'] = len(data)
+    finally:
+        tracemalloc.stop()
+
+    result = profile.as_dict()
+    parse, fuzzy = result['stages']
+    assert parse['stage'] == 'parse_ascap' and parse['rows'] == 3 and 'traced_peak_mb' not in parse
+    assert fuzzy['matched'] == 1024 and fuzzy['traced_peak_mb'] >= 1
+    assert result['peak_rss_mb'] > 0
+    assert result['total_seconds'] >= parse['seconds']
+    assert 'matched=1024' in format_profile(result)
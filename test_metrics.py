@@ -0,0 +1,44 @@
+from metrics import MetricsRegistry
+
+def define(registry):
+    return (registry.counter('jobs_total', 'Jobs', ['status']),
+            registry.histogram('job_seconds', 'Job time', buckets=(1, 10)))
+
+def test_render_counters_and_histograms():
+    registry = MetricsRegistry()
+    jobs, seconds = define(registry)
+    jobs.inc(status='done')
+    jobs.inc(2, status='done')
+    jobs.inc(status='fail"ed')
+    for value in (0.5, 5, 50):
+        seconds.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP jobs_total Jobs',
+        '# TYPE jobs_total counter',
+        'jobs_total{status="done"} 3',
+        'jobs_total{status="fail\\"ed"} 1',
+        '# HELP job_seconds Job time',
+        '# TYPE job_seconds histogram',
+        'job_seconds_bucket{le="1"} 1',
+        'job_seconds_bucket{le="10"} 2',
+        'job_seconds_bucket{le="+Inf"} 3',
+        'job_seconds_sum 55.5',
+        'job_seconds_count 3',
+    ]
+
+def test_processes_are_summed_through_the_directory(tmp_path):
+    # Two registries on one directory stand in for two gunicorn workers
+    first, second = MetricsRegistry(str(tmp_path)), MetricsRegistry(str(tmp_path))
+    first_jobs, first_seconds = define(first)
+    second_jobs, second_seconds = define(second)
+    first_jobs.inc(status='done')
+    first_seconds.observe(2)
+    second_jobs.inc(4, status='done')
+    second_seconds.observe(20)
+    first.flush()
+    second.flush()
+
+    totals = first.collect()
+    assert totals['jobs_total'] == {('done',): 5}
+    assert totals['job_seconds'] == {(): [0, 1, 1, 22.0]}
@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from normalize import clean_show_name, clean_song_title, normalize_column
+
+def test_normalize_column_matches_row_by_row_cleaning():
+    names = pd.Series(['(COMM/PROMO) Law & Order', 'law and order', 'Law & Order!', np.nan,
+                       '  The   Late Show ', 'law & order', None, 42])
+    for cleaner in (clean_show_name, clean_song_title):
+        normalized = normalize_column(names, cleaner)
+        assert normalized.dtype == 'category'
+        assert list(normalized.astype(object)) == list(names.apply(cleaner))
+
+def test_normalize_column_reuses_existing_categories():
+    names = pd.Series(['Show A', 'SHOW A!', 'Show B', None], dtype='category')
+    normalized = normalize_column(names, clean_show_name)
+    assert list(normalized.astype(object)) == ['show a', 'show a', 'show b', '']
+    assert sorted(normalized.cat.categories) == ['', 'show a', 'show b']
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from benchmarks.synthetic_statements import generate_statements
+from compare_earnings import run_comparison
+from out_of_core import SpilledFrames, bucket_groups, concat_frames
+from result_store import TABLES, ResultStore
+
+def stored_rows(store, table):
+    """{show: its rows in report order} of a stored result"""
+    shows = {}
+    cursor = None
+    while True:
+        page, cursor = store.query('result', table, limit=1000, cursor=cursor)
+        for row in page:
+            shows.setdefault(row['show'], []).append([row[column] for column in TABLES[table]])
+        if cursor is None:
+            return shows
+
+def test_partitioned_comparison_matches_in_memory_results(tmp_path):
+    ascap_path, bmi_path = str(tmp_path / 'ascap.csv'), str(tmp_path / 'bmi.csv')
+    generate_statements(ascap_path, bmi_path, 6000, noise=0.3, seed=2)
+
+    runs = []
+    for budget in (None, 1):
+        store = ResultStore(str(tmp_path / f'results-{budget}.sqlite3'))
+        result = run_comparison(ascap_path, bmi_path, output_file=str(tmp_path / f'report-{budget}.xlsx'),
+                                results=store, result_id='result', memory_budget_mb=budget, spill_dir=str(tmp_path))
+        runs.append((result, store))
+    (in_memory, in_memory_store), (partitioned, partitioned_store) = runs
+
+    counts = ['matched_shows', 'only_in_ascap', 'only_in_bmi', 'songs_only_in_ascap', 'songs_only_in_bmi']
+    assert {key: partitioned[key] for key in counts} == {key: in_memory[key] for key in counts}
+    for table in TABLES:
+        assert stored_rows(partitioned_store, table) == stored_rows(in_memory_store, table)
+
+    stages = {record['stage']: record for record in partitioned['profile']['stages']}
+    assert stages['partition_ascap']['chunks'] > 1
+    assert stages['move_matched_shows']['shows'] > 0
+    assert stages['reconciliation']['groups'] > 1
+    # Spill files go with the run
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_dir()) == []
+
+def test_spilled_frames_and_bucket_groups(tmp_path):
+    spill = SpilledFrames(str(tmp_path / 'bucket.pkl'))
+    assert list(spill) == [] and len(spill) == 0 and spill.size == 0
+
+    empty = pd.DataFrame({'show': pd.Categorical([]), 'amount': pd.Series([], dtype=float)})
+    spill.append(pd.DataFrame({'show': pd.Categorical(['a', 'b']), 'amount': [1.0, 2.0]}))
+    spill.append(pd.DataFrame({'show': pd.Categorical(['c']), 'amount': [3.0]}))
+    combined = concat_frames(spill, empty)
+    assert len(spill) == 3 and spill.size > 0
+    assert combined['show'].tolist() == ['a', 'b', 'c'] and combined['amount'].tolist() == [1.0, 2.0, 3.0]
+    assert isinstance(combined['show'].dtype, pd.CategoricalDtype)
+    assert concat_frames([], empty) is empty
+
+    # A bucket larger than the limit still gets a group of its own
+    assert bucket_groups([3, 4, 0, 9, 2, 2], 7) == [[0, 1, 2], [3], [4, 5]]
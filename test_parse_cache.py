@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import os
+
+import pandas as pd
+import pytest
+
+from parse_cache import ContentHasher, ContentTooLarge, ParseCache, file_digest, open_content
+from statement_reader import load_statement
+
+BMI_CSV = '''SHOW NAME,EPISODE NAME,TITLE NAME,PERF SOURCE,ROYALTY AMOUNT
+LAW & ORDER,PILOT,THEME,NBC,1.10
+(COMM/PROMO) The Late Show,,Song!,ABC,0.25
+'''
+
+@pytest.fixture
+def statement(tmp_path):
+    path = tmp_path / 'bmi.csv'
+    path.write_text(BMI_CSV)
+    return str(path)
+
+def test_cached_statement_matches_fresh_parse(tmp_path, statement):
+    pytest.importorskip('pyarrow')
+    cache = ParseCache(str(tmp_path / 'cache'), 10 * 1024 * 1024)
+
+    fresh = load_statement(statement, 'bmi', cache=cache)
+    assert cache.get(file_digest(statement), 'bmi') is not None
+
+    # Same content under another name is served from the cache
+    copy = tmp_path / 'renamed.csv'
+    copy.write_text(BMI_CSV)
+    cached = load_statement(str(copy), 'bmi', cache=cache)
+    pd.testing.assert_frame_equal(cached, fresh)
+    assert list(cached['clean_name']) == ['law order', 'the late show']
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    pytest.importorskip('pyarrow')
+    cache = ParseCache(str(tmp_path / 'cache'), 10 * 1024 * 1024)
+    df = pd.DataFrame({'value': range(1000)})
+    cache.put('old', 'bmi', df)
+    cache.put('new', 'bmi', df)
+    os.utime(cache.path_for('old', 'bmi'), (0, 0))
+
+    cache.max_bytes = os.path.getsize(cache.path_for('new', 'bmi'))
+    cache.evict()
+
+    assert cache.get('old', 'bmi') is None
+    assert cache.get('new', 'bmi') is not None
+
+def test_corrupt_entry_is_removed_and_parsed_again(tmp_path, statement):
+    pytest.importorskip('pyarrow')
+    cache = ParseCache(str(tmp_path / 'cache'), 10 * 1024 * 1024)
+    fresh = load_statement(statement, 'bmi', cache=cache)
+    path = cache.path_for(file_digest(statement), 'bmi')
+    with open(path, 'wb') as f:
+        f.write(b'not a feather file')
+
+    assert cache.get(file_digest(statement), 'bmi') is None
+    assert not os.path.exists(path)
+    pd.testing.assert_frame_equal(load_statement(statement, 'bmi', cache=cache), fresh)
+    assert os.path.exists(path)
+
+def test_zero_budget_disables_cache(tmp_path, statement):
+    cache = ParseCache(str(tmp_path / 'cache'), 0)
+    load_statement(statement, 'bmi', cache=cache)
+    assert not os.path.exists(tmp_path / 'cache')
+
+def test_gzip_content_is_hashed_and_limited_once_decompressed(tmp_path):
+    content = BMI_CSV.encode() * 1000
+    # Two gzip members and trailing zero padding, fed in small uneven pieces
+    data = gzip.compress(content[:5000]) + gzip.compress(content[5000:]) + b'\x00' * 10
+    hasher = ContentHasher()
+    for start in range(0, len(data), 777):
+        hasher.update(data[start:start + 777])
+    assert hasher.hexdigest() == hashlib.sha256(content).hexdigest()
+
+    bomb = tmp_path / 'bomb.csv'
+    bomb.write_bytes(gzip.compress(BMI_CSV.encode() + b'\n' * (10 * 1024 * 1024)))
+    with pytest.raises(ContentTooLarge):
+        file_digest(str(bomb), max_size=1024 * 1024)
+    with pytest.raises(ContentTooLarge), open_content(str(bomb), max_size=1024 * 1024) as f:
+        f.read()
+
+    truncated = ContentHasher()
+    truncated.update(data[:100])
+    with pytest.raises(ValueError):
+        truncated.hexdigest()
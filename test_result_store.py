@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from compare_earnings import run_comparison
+from result_store import ResultStore
+
+@pytest.fixture
+def stored(tmp_path):
+    ascap = tmp_path / 'ascap.csv'
+    bmi = tmp_path / 'bmi.csv'
+    shows = ['Law & Order', 'The Late Show', 'Morning News', 'Kitchen Nightmares']
+    pd.DataFrame({'Series or Film/Attraction': [show for show in shows for _ in range(3)],
+                  'Program Name': ['Pilot', 'Ep 2', 'Ep 3'] * 4,
+                  'Work Title': ['Theme', 'Song', 'Outro'] * 4,
+                  'Network Service': ['NBC'] * 12,
+                  'Dollars': [float(i) for i in range(12)]}).to_csv(ascap, index=False)
+    pd.DataFrame({'SHOW NAME': [show.upper() for show in shows[:3] for _ in range(2)] + ['HOUSE HUNTERS'],
+                  'EPISODE NAME': ['Pilot', 'Ep 2'] * 3 + ['Ep 9'],
+                  'TITLE NAME': ['Theme', 'Song'] * 3 + ['Intro'],
+                  'PERF SOURCE': ['NBC'] * 7,
+                  'ROYALTY AMOUNT': [1.0] * 7}).to_csv(bmi, index=False)
+    store = ResultStore(str(tmp_path / 'results.sqlite3'))
+    result = run_comparison(str(ascap), str(bmi), output_file=str(tmp_path / 'report.xlsx'),
+                            results=store, result_id='r1')
+    return store, result
+
+def test_results_are_stored_with_counts(stored):
+    store, result = stored
+    assert store.counts('r1') == {key: result[key] for key in store.counts('r1')}
+    assert store.counts('missing') is None
+
+    shows, _ = store.query('r1', 'shows')
+    assert {show['show']: show['bmi_show'] for show in shows} == {
+        'law order': 'law order', 'the late show': 'the late show', 'morning news': 'morning news'}
+    law_and_order = shows[[show['show'] for show in shows].index('law order')]
+    assert (law_and_order['ascap_amount'], law_and_order['bmi_amount'], law_and_order['difference']) == (3.0, 2.0, 1.0)
+    assert len(shows) == result['matched_shows'] == 3
+    only_ascap, _ = store.query('r1', 'ascap_only')
+    assert {row['show'] for row in only_ascap} == {'kitchen nightmares'}
+    assert store.query('r1', 'bmi_only')[0][0]['song'] == 'Intro'
+
+def test_pages_follow_the_sort_order(stored):
+    store, _ = stored
+    everything, _ = store.query('r1', 'episodes', sort='-difference', limit=1000)
+    differences = [row['difference'] for row in everything]
+    assert differences == sorted(differences, reverse=True)
+
+    pages = []
+    cursor = None
+    while True:
+        rows, cursor = store.query('r1', 'episodes', sort='-difference', limit=2, cursor=cursor)
+        pages.append(rows)
+        if cursor is None:
+            break
+    assert [row for page in pages for row in page] == everything
+    assert all(len(page) <= 2 for page in pages)
+
+    with pytest.raises(ValueError):
+        store.query('r1', 'episodes', sort='difference', cursor=store.query('r1', 'episodes', limit=1)[1])
+
+def test_filters(stored):
+    store, _ = stored
+    rows, _ = store.query('r1', 'episodes', show='morning news')
+    assert {row['show'] for row in rows} == {'morning news'} and len(rows) == 3
+
+    missing, _ = store.query('r1', 'episodes', missing_from='bmi')
+    assert {(row['in_ascap'], row['in_bmi']) for row in missing} == {(True, False)}
+    assert {row['song'] for row in missing} == {'Outro'}
+
+    rows, _ = store.query('r1', 'shows', search='late')
+    assert [row['show'] for row in rows] == ['the late show']
+    rows, _ = store.query('r1', 'episodes', minimum=7)
+    assert rows and all(row['difference'] >= 7 for row in rows)
@@ -0,0 +1,89 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from parse_cache import ContentTooLarge
+from resumable_upload import ResumableUploads, UploadError, merge_ranges, parse_content_range
+from storage_backend import LocalStorageBackend
+
+CSV = b'SHOW NAME,ROYALTY AMOUNT\n' + b'LAW & ORDER,1.00\n' * 20000
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ResumableUploads(str(tmp_path / 'resumable'), max_size=10 * 1024 * 1024, max_chunk_size=64 * 1024)
+
+def test_chunks_in_any_order_assemble_the_file(tmp_path, uploads):
+    data = gzip.compress(CSV)
+    state = uploads.create('bmi.csv.gz', len(data))
+    chunks = [(start, data[start:start + 10000]) for start in range(0, len(data), 10000)]
+
+    # Reversed, with one chunk sent twice as a retry would
+    for start, chunk in reversed(chunks + chunks[:1]):
+        state = uploads.write_chunk(state['upload_id'], start, chunk)
+    assert state['received'] == [[0, len(data)]]
+
+    storage = LocalStorageBackend(str(tmp_path / 'storage'))
+    uploaded = uploads.complete(state['upload_id'], str(tmp_path), storage=storage,
+                                archive_key=lambda name: f'uploads/{name}')
+    assert uploaded.path.endswith('.csv.gz')
+    assert uploaded.size == len(data)
+    assert uploaded.digest == hashlib.sha256(CSV).hexdigest()
+    uploaded.store_archive()
+    uploaded.archive.wait()
+    with open(storage.path_for('uploads/bmi.csv.gz'), 'rb') as f:
+        assert f.read() == data
+    assert uploads.get(state['upload_id']) is None
+    assert os.listdir(uploads.directory) == []
+
+def test_upload_past_the_decompressed_limit_is_dropped(tmp_path):
+    uploads = ResumableUploads(str(tmp_path / 'resumable'), max_size=10 * 1024 * 1024, max_chunk_size=64 * 1024,
+                               max_decompressed_size=len(CSV))
+    data = gzip.compress(CSV + b'\n' * 1000000)
+    state = uploads.create('bmi.csv.gz', len(data))
+
+    with pytest.raises(ContentTooLarge):
+        for start in range(0, len(data), 1000):
+            uploads.write_chunk(state['upload_id'], start, data[start:start + 1000])
+    assert uploads.get(state['upload_id']) is None
+    assert os.listdir(uploads.directory) == []
+
+def test_incomplete_upload_reports_missing_ranges(tmp_path, uploads):
+    state = uploads.create('ascap.csv', len(CSV))
+    uploads.write_chunk(state['upload_id'], 0, CSV[:50000])
+    state = uploads.write_chunk(state['upload_id'], 100000, CSV[100000:150000])
+
+    assert uploads.get(state['upload_id'])['received'] == [[0, 50000], [100000, 150000]]
+    with pytest.raises(UploadError):
+        uploads.complete(state['upload_id'], str(tmp_path))
+
+def test_invalid_chunks_are_rejected(uploads):
+    state = uploads.create('ascap.csv', 1000)
+    with pytest.raises(UploadError):
+        uploads.write_chunk(state['upload_id'], 900, b'x' * 200)
+    with pytest.raises(UploadError):
+        uploads.write_chunk(state['upload_id'], 0, b'x' * 100, total=2000)
+    with pytest.raises(UploadError):
+        uploads.create('huge.csv', 20 * 1024 * 1024)
+    with pytest.raises(KeyError):
+        uploads.write_chunk('0' * 32, 0, b'x')
+
+def test_uploads_do_not_wait_for_each_other(uploads):
+    import threading
+
+    first = uploads.create('ascap.csv', 1000)
+    second = uploads.create('bmi.csv', 1000)
+    written = threading.Event()
+    with uploads._locked(first['upload_id']):
+        thread = threading.Thread(target=lambda: uploads.write_chunk(second['upload_id'], 0, b'x' * 100) and written.set())
+        thread.start()
+        assert written.wait(5)
+    thread.join()
+    assert uploads.get(second['upload_id'])['received'] == [[0, 100]]
+
+def test_ranges_and_content_range():
+    assert merge_ranges([[10, 20], [0, 5], [5, 10], [30, 40], [35, 38]]) == [[0, 20], [30, 40]]
+    assert parse_content_range('bytes 0-99/1000') == (0, 100, 1000)
+    with pytest.raises(UploadError):
+        parse_content_range('bytes */1000')
@@ -0,0 +1,57 @@
+import random
+import string
+
+from compare_earnings import find_similar_shows
+from show_matcher import assign_matches, find_candidate_matches
+
+def _noisy_names(count, seed):
+    rng = random.Random(seed)
+    words = ['law', 'order', 'night', 'live', 'the', 'late', 'show', 'news', 'kitchen', 'house', 'hunters', 'today']
+    names = set()
+    while len(names) < count:
+        name = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        # Add a typo to roughly half of the names
+        if rng.random() < 0.5:
+            pos = rng.randrange(len(name))
+            name = name[:pos] + rng.choice(string.ascii_lowercase) + name[pos + 1:]
+        names.add(name)
+    return names
+
+def test_candidate_matches_agree_with_all_pairs_scoring():
+    ascap_shows = _noisy_names(150, seed=1)
+    bmi_shows = _noisy_names(150, seed=2)
+
+    candidates = find_candidate_matches(ascap_shows, bmi_shows, threshold=85)
+
+    for show in ascap_shows:
+        expected = find_similar_shows(show, bmi_shows)
+        found = candidates.get(show, [])
+        assert sorted(found) == sorted(expected)
+
+def test_empty_names_never_match():
+    assert find_candidate_matches({'', 'abc'}, {'', 'abd'}, threshold=0) == {'abc': [('abd', 67)]}
+
+def test_assignment_takes_best_pairs_first():
+    # 'law order' would take 'law orders' first in query order, leaving 'law order s' unmatched
+    candidates = {
+        'law order': [('law orders', 95), ('law order s', 90)],
+        'law orders': [('law orders', 100), ('law order s', 95)],
+        'late show': [('late shows', 95)],
+        'late shows': [('late shows', 100)]
+    }
+    assert assign_matches(candidates) == {
+        'law orders': ('law orders', 100),
+        'law order': ('law order s', 90),
+        'late shows': ('late shows', 100)
+    }
+    assert assign_matches({}) == {}
+
+def test_assignment_is_one_to_one_at_scale():
+    queries = _noisy_names(3000, seed=3)
+    choices = _noisy_names(3000, seed=4)
+    candidates = find_candidate_matches(queries, choices, threshold=85)
+    assignment = assign_matches(candidates)
+    assigned = [choice for choice, _ in assignment.values()]
+    assert len(assigned) == len(set(assigned))
+    for query, (choice, score) in assignment.items():
+        assert (choice, score) in candidates[query]
@@ -0,0 +1,53 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from parse_cache import file_digest
+from statement_reader import read_statement
+
+ASCAP_CSV = '''Party ID,Series or Film/Attraction,Program Name,Work Title,Network Service,Dollars,Notes
+1,Law & Order,Pilot,"Theme, Part 1",NBC,1.25,x
+2,(COMM/PROMO) Law & Order,,Theme,NA,0.5,
+3,The Late Show,Ep 2,"Song ""Quoted""",,2,y
+4,,Ep 3,Song,CBS,,z
+5,Law & Order,Pilot,Theme,NBC,-3.75,
+'''
+
+BMI_CSV = '''SHOW NAME,EPISODE NAME,TITLE NAME,PERF SOURCE,ROYALTY AMOUNT,EXTRA
+LAW AND ORDER,PILOT,THEME PART 1,NBC,1.10,1
+The Late Show,N/A,Song,ABC,0.25,2
+The Late Show,Ep 2,Song,,null,3
+None,Ep 3,None,CBS,0.50,4
+'''
+
+@pytest.mark.parametrize('pro, content', [('ascap', ASCAP_CSV), ('bmi', BMI_CSV)])
+def test_arrow_engine_matches_pandas_engine(tmp_path, pro, content):
+    pytest.importorskip('pyarrow')
+    path = tmp_path / f'{pro}.csv'
+    path.write_text(content)
+
+    expected = read_statement(str(path), pro, engine='pandas')
+    result = read_statement(str(path), pro, engine='arrow')
+
+    pd.testing.assert_frame_equal(result, expected, check_like=True)
+
+def test_unknown_engine_is_rejected(tmp_path):
+    path = tmp_path / 'bmi.csv'
+    path.write_text(BMI_CSV)
+    with pytest.raises(ValueError):
+        read_statement(str(path), 'bmi', engine='polars')
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_gzip_statement_reads_like_plain_one(tmp_path, engine):
+    if engine == 'arrow':
+        pytest.importorskip('pyarrow')
+    plain = tmp_path / 'ascap.csv'
+    plain.write_text(ASCAP_CSV)
+    # Named .csv on purpose: compression is detected from the content
+    compressed = tmp_path / 'ascap-gzip.csv'
+    compressed.write_bytes(gzip.compress(ASCAP_CSV.encode()))
+
+    pd.testing.assert_frame_equal(read_statement(str(compressed), 'ascap', engine=engine),
+                                  read_statement(str(plain), 'ascap', engine=engine))
+    assert file_digest(str(compressed)) == file_digest(str(plain))
@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+from parse_cache import ContentTooLarge
+from storage_backend import LocalStorageBackend
+from streaming_upload import ingest_multipart
+
+def multipart_body(fields):
+    boundary, body = encode_multipart(fields)
+    return io.BytesIO(body), f'multipart/form-data; boundary={boundary}'
+
+def test_files_are_spooled_hashed_and_archived_in_one_pass(tmp_path):
+    ascap = b'Series or Film/Attraction,Dollars\n' + b'Show,1.0\n' * 300000
+    stream, content_type = multipart_body({
+        'ascap': FileStorage(io.BytesIO(ascap), 'ascap.csv'),
+        'note': 'fourth quarter',
+    })
+    storage = LocalStorageBackend(str(tmp_path / 'storage'))
+
+    files, fields = ingest_multipart(stream, content_type, str(tmp_path),
+                                     storage=storage, archive_key=lambda name: f'uploads/{name}')
+    ingested = files['ascap']
+    ingested.store_archive()
+    ingested.archive.wait()
+
+    assert fields == {'note': 'fourth quarter'}
+    assert ingested.filename == 'ascap.csv'
+    assert ingested.size == len(ascap)
+    assert ingested.digest == hashlib.sha256(ascap).hexdigest()
+    with open(ingested.path, 'rb') as f:
+        assert f.read() == ascap
+    with open(storage.path_for('uploads/ascap.csv'), 'rb') as f:
+        assert f.read() == ascap
+
+def test_truncated_body_discards_partial_files(tmp_path):
+    stream, content_type = multipart_body({'bmi': FileStorage(io.BytesIO(b'x' * 100000), 'bmi.csv')})
+    truncated = io.BytesIO(stream.getvalue()[:50000])
+    storage = LocalStorageBackend(str(tmp_path / 'storage'))
+
+    with pytest.raises(ValueError):
+        ingest_multipart(truncated, content_type, str(tmp_path),
+                         storage=storage, archive_key=lambda name: f'uploads/{name}')
+
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.csv')] == []
+    assert not os.path.exists(storage.path_for('uploads/bmi.csv'))
+
+def test_gzip_parts_are_hashed_and_limited_by_their_content(tmp_path):
+    bmi = b'SHOW NAME,ROYALTY AMOUNT\n' + b'LAW & ORDER,1.00\n' * 20000
+    stream, content_type = multipart_body({'bmi': FileStorage(io.BytesIO(gzip.compress(bmi)), 'bmi.csv.gz')})
+    files, _ = ingest_multipart(stream, content_type, str(tmp_path))
+    # The same digest as the plain statement, so both share cache entries and jobs
+    assert files['bmi'].digest == hashlib.sha256(bmi).hexdigest()
+    files['bmi'].discard()
+
+    stream, content_type = multipart_body({'bmi': FileStorage(io.BytesIO(gzip.compress(bmi)), 'bmi.csv.gz')})
+    with pytest.raises(ContentTooLarge):
+        ingest_multipart(stream, content_type, str(tmp_path), max_decompressed_size=len(bmi) - 1)
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.csv')] == []
+
+class CountingStorage(LocalStorageBackend):
+    """Local storage that counts the bytes sent to it"""
+
+    def __init__(self, root, parallel_threshold):
+        super().__init__(root)
+        self.parallel_threshold = parallel_threshold
+        self.sent = {'writer': 0, 'upload_file': 0}
+
+    def open_writer(self, key):
+        writer = super().open_writer(key)
+        write = writer.write
+
+        def counted(data):
+            self.sent['writer'] += len(data)
+            write(data)
+        writer.write = counted
+        return writer
+
+    def upload_file(self, path, key):
+        self.sent['upload_file'] += os.path.getsize(path)
+        super().upload_file(path, key)
+
+def test_large_parts_are_archived_once_from_the_spool_file(tmp_path):
+    ascap = b'Series or Film/Attraction,Dollars\n' + b'Show,1.0\n' * 10000
+
+    # A body that may hold a part over the threshold is not teed; a smaller one is
+    for threshold, sent in [(50000, {'writer': 0, 'upload_file': len(ascap)}),
+                            (10 ** 7, {'writer': len(ascap), 'upload_file': 0})]:
+        stream, content_type = multipart_body({'ascap': FileStorage(io.BytesIO(ascap), 'ascap.csv')})
+        storage = CountingStorage(str(tmp_path / f'storage-{threshold}'), threshold)
+        files, _ = ingest_multipart(stream, content_type, str(tmp_path), storage=storage,
+                                    archive_key=lambda name: f'uploads/{name}',
+                                    content_length=len(stream.getvalue()))
+        files['ascap'].store_archive()
+        files['ascap'].archive.wait()
+
+        # Each byte goes to storage once
+        assert storage.sent == sent
+        with open(storage.path_for('uploads/ascap.csv'), 'rb') as f:
+            assert f.read() == ascap
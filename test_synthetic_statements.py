@@ -0,0 +1,26 @@
+import pandas as pd
+
+from benchmarks.synthetic_statements import generate_statements
+from compare_earnings import run_comparison
+from statement_reader import STATEMENT_SCHEMAS
+
+def test_generated_statements_have_real_columns_and_overlap(tmp_path):
+    ascap_path, bmi_path = str(tmp_path / 'ascap.csv'), str(tmp_path / 'bmi.csv')
+    generate_statements(ascap_path, bmi_path, 5000, overlap=0.6, noise=0.5, promo=0.2, shows=40, seed=1)
+
+    ascap = pd.read_csv(ascap_path)
+    bmi = pd.read_csv(bmi_path)
+    assert len(ascap) == len(bmi) == 5000
+    assert set(STATEMENT_SCHEMAS['ascap'].values()) <= set(ascap.columns)
+    assert set(STATEMENT_SCHEMAS['bmi'].values()) <= set(bmi.columns)
+    assert ascap['Series or Film/Attraction'].str.startswith('(COMM/PROMO) ').mean() > 0.1
+    assert ascap['Series or Film/Attraction'].nunique() > bmi['SHOW NAME'].nunique() == 40
+
+    # Same arguments, same files
+    generate_statements(str(tmp_path / 'again.csv'), str(tmp_path / 'again_bmi.csv'), 5000,
+                        overlap=0.6, noise=0.5, promo=0.2, shows=40, seed=1)
+    assert (tmp_path / 'again.csv').read_bytes() == (tmp_path / 'ascap.csv').read_bytes()
+
+    result = run_comparison(ascap_path, bmi_path, output_file=str(tmp_path / 'report.xlsx'))
+    fuzzy = next(record for record in result['profile']['stages'] if record['stage'] == 'fuzzy_matching')
+    assert 20 <= result['matched_shows'] <= 24 and fuzzy['matched'] > 0